@@ -0,0 +1,177 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.asgi
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.asgi as asgi
+import werkzeugverleih.routine as routine
+import werkzeugverleih.display as display
+import werkzeugverleih.lifecycle as lifecycle
+import pytest
+import asyncio
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  cfg.DEBUG = True
+  cfg.STREAM_FRAMERATE = 100
+  log.initialize_logger()
+
+  # later tests depend on the session state, e.g. test_routine
+  last_activity = routine.last_activity
+  yield
+  routine.last_activity = last_activity
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def watch_stream(frames: int, viewer_count: list) -> list:
+  '''run one viewer until it received `frames` frames, then disconnect'''
+  messages = []
+  received_frames = asyncio.Event()
+  requested = False
+
+  async def receive():
+    nonlocal requested
+    if not requested:
+      requested = True
+      return {'type': 'http.request', 'body': b'', 'more_body': False}
+    await received_frames.wait()
+    return {'type': 'http.disconnect'}
+
+  async def send(message):
+    messages.append(message)
+    viewer_count.append(asgi.viewers)
+    if len(messages) > frames:
+      received_frames.set()
+
+  scope = {'type': 'http', 'path': '/video-feed', 'method': 'GET'}
+  await asyncio.wait_for(asgi.application(scope, receive, send), timeout=10)
+  return messages
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_video_stream():
+  async def three_viewers():
+    viewer_count = []
+    results = await asyncio.gather(*(watch_stream(5, viewer_count)
+                                      for _ in range(3)))
+    # let the producer task notice there are no viewers left
+    await asyncio.sleep(0.1)
+    return results, viewer_count
+
+  asgi.frame_condition = None
+  routine.last_activity = 0
+  results, viewer_count = asyncio.run(three_viewers())
+
+  for messages in results:
+    assert messages[0]['type'] == 'http.response.start'
+    assert messages[0]['status'] == 200
+    assert (dict(messages[0]['headers'])[b'content-type'] ==
+            b'multipart/x-mixed-replace; boundary=frame')
+    body = messages[1]['body']
+    assert body.startswith(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n')
+    assert len(body) > 100
+    assert all(m['more_body'] for m in messages[1:])
+    assert len(messages) >= 6
+
+  # all viewers shared a single producer, which stopped after they left
+  assert max(viewer_count) == 3
+  assert asgi.viewers == 0
+  assert asgi.producer_task is None
+  asgi.frame_condition = None
+  # passive viewers don't keep the kiosk busy
+  assert routine.last_activity == 0
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def watch_blanked_stream(disconnect_after: float = None) -> list:
+  '''run one viewer, disconnect after `disconnect_after` seconds or never'''
+  messages = []
+
+  async def receive():
+    if disconnect_after is None:
+      await asyncio.Event().wait()
+    await asyncio.sleep(disconnect_after)
+    return {'type': 'http.disconnect'}
+
+  async def send(message):
+    messages.append(message)
+
+  scope = {'type': 'http', 'path': '/video-feed', 'method': 'GET'}
+  await asyncio.wait_for(asgi.application(scope, receive, send), timeout=3)
+  # let the producer task notice there are no viewers left
+  while asgi.producer_task is not None:
+    await asyncio.sleep(0.1)
+  return messages
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_video_stream_blanked(monkeypatch):
+  monkeypatch.setattr(display, 'screen_on', False)
+  # no earlier frame either, new viewers would get that one right away
+  monkeypatch.setattr(asgi, 'frame_sequence', 0)
+  asgi.frame_condition = None
+
+  # no frames arrive while blanked, the viewer still notices leaving
+  messages = asyncio.run(watch_blanked_stream(disconnect_after=0.2))
+  assert [m['type'] for m in messages] == ['http.response.start']
+  assert asgi.viewers == 0
+  asgi.frame_condition = None
+
+  # and the shutdown
+  async def shutdown_later():
+    await asyncio.sleep(0.2)
+    lifecycle.begin_shutdown()
+
+  async def shutdown_while_watching():
+    _, messages = await asyncio.gather(shutdown_later(),
+                                       watch_blanked_stream())
+    return messages
+
+  try:
+    messages = asyncio.run(shutdown_while_watching())
+  finally:
+    lifecycle.shutting_down.clear()
+  assert [m['type'] for m in messages] == ['http.response.start']
+  assert asgi.viewers == 0
+  asgi.frame_condition = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_lifespan():
+  messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+  sent = []
+
+  async def receive():
+    return messages.pop(0)
+
+  async def send(message):
+    sent.append(message['type'])
+
+  asyncio.run(asgi.application({'type': 'lifespan'}, receive, send))
+  assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+# ------------------------------------------------------------------------------
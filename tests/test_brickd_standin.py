@@ -0,0 +1,166 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.brickd_standin
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.brickd_standin as brickd
+from werkzeugverleih.nfc_simulator import SimulatedReader
+import pytest
+import socket
+import struct
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class Client:
+  '''raw protocol client, same packets as the tinkerforge IPConnection'''
+  def __init__(self, port):
+    self.socket = socket.create_connection(('127.0.0.1', port), timeout=2)
+    self.sequence = 0
+
+  def request(self, uid, function_id, payload=b'', response_expected=True):
+    self.sequence = self.sequence % 15 + 1
+    options = (self.sequence << 4) | (0b1000 if response_expected else 0)
+    self.socket.sendall(struct.pack('<IBBBB', uid, 8 + len(payload),
+                                    function_id, options, 0) + payload)
+
+  def receive(self):
+    '''next packet as `(uid, function_id, sequence, error, payload)`'''
+    header = self.socket.recv(8, socket.MSG_WAITALL)
+    uid, length, function_id, options, flags = struct.unpack('<IBBBB', header)
+    payload = (self.socket.recv(length - 8, socket.MSG_WAITALL)
+               if length > 8 else b'')
+    return uid, function_id, options >> 4, flags >> 6, payload
+
+  def receive_callback(self, function_id):
+    '''skip responses and other callbacks'''
+    while True:
+      packet = self.receive()
+      if packet[1] == function_id and packet[2] == 0:
+        return packet
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def server():
+  server = brickd.BrickdStandIn(('127.0.0.1', 0),
+                                SimulatedReader(delay=0.01, jitter=0), 'PMv')
+  server.start()
+  yield server
+  server.stop()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_base58_decode():
+  assert brickd.base58_decode('1') == 0
+  assert brickd.base58_decode('PMv') == (47 * 58 + 45) * 58 + 29
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_identity_and_enumerate(server):
+  client = Client(server.server_address[1])
+  uid = brickd.base58_decode('PMv')
+
+  client.request(uid, brickd.FUNCTION_GET_IDENTITY)
+  response_uid, function_id, sequence, error, payload = client.receive()
+  assert (response_uid, function_id, sequence, error) == (
+    uid, brickd.FUNCTION_GET_IDENTITY, 1, 0)
+  identity = struct.unpack('<8s8sc3B3BH', payload)
+  assert identity[0].rstrip(b'\0') == b'PMv'
+  assert identity[-1] == brickd.DEVICE_IDENTIFIER_NFC
+
+  client.request(0, brickd.FUNCTION_ENUMERATE, response_expected=False)
+  _, _, _, _, payload = client.receive_callback(brickd.CALLBACK_ENUMERATE)
+  assert struct.unpack('<8s8sc3B3BHB', payload)[-2:] == (
+    brickd.DEVICE_IDENTIFIER_NFC, 0)
+
+  # unsupported functions report an error
+  client.request(uid, 100)
+  assert client.receive()[3] == brickd.ERROR_FUNCTION_NOT_SUPPORTED
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_read_tag(server):
+  client = Client(server.server_address[1])
+  uid = brickd.base58_decode('PMv')
+  reader = server.reader
+
+  def next_state():
+    payload = client.receive_callback(brickd.CALLBACK_READER_STATE_CHANGED)[4]
+    return struct.unpack('<B?', payload)[0]
+
+  client.request(uid, brickd.FUNCTION_SET_MODE, bytes([reader.MODE_READER]),
+                 response_expected=False)
+  assert next_state() == reader.READER_STATE_IDLE
+
+  reader.put_tag('14A1B2C3')
+  client.request(uid, brickd.FUNCTION_READER_REQUEST_TAG_ID,
+                 response_expected=False)
+  assert next_state() == reader.READER_STATE_REQUEST_TAG_ID
+  assert next_state() == reader.READER_STATE_REQUEST_TAG_ID_READY
+
+  client.request(uid, brickd.FUNCTION_READER_GET_TAG_ID_LOW_LEVEL)
+  payload = client.receive()[4]
+  tag_type, length = struct.unpack('<BB', payload[:2])
+  assert payload[2:2 + length] == bytes.fromhex('14A1B2C3')
+  assert len(payload) == 34
+
+  client.request(uid, brickd.FUNCTION_READER_GET_STATE)
+  assert struct.unpack('<B?', client.receive()[4]) == (
+    reader.READER_STATE_REQUEST_TAG_ID_READY, True)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_main_cli(tmp_path):
+  import signal
+  import subprocess
+  import sys
+  from os.path import abspath
+  # fresh interpreter without an initialized logger, logs end up in tmp_path
+  (tmp_path / 'data' / 'logs').mkdir(parents=True)
+  process = subprocess.Popen(
+    [sys.executable, '-u', '-m', 'werkzeugverleih.brickd_standin',
+     '--port', '0', '--script', ''],
+    cwd=tmp_path, env={'PYTHONPATH': abspath('.')},
+    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+  try:
+    for line in process.stdout:
+      if line.startswith('brickd stand-in listening'):
+        break
+    else:
+      pytest.fail('stand-in exited before serving')
+    process.send_signal(signal.SIGINT)
+    _, errors = process.communicate(timeout=10)
+  finally:
+    process.kill()
+  assert process.returncode == 0, errors
+# ------------------------------------------------------------------------------
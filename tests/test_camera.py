@@ -15,8 +15,12 @@ dependencies:
 """
 
 import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
 import werkzeugverleih.camera as camera
+import sys
 from io import BytesIO
+from threading import Thread
+import time
 from PIL import Image
 import pytest
 
@@ -26,6 +30,9 @@ import pytest
 def default_statements():
   cfg.DEBUG = True
   cfg.STREAM_FRAMERATE = 1000
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  log.initialize_logger()
 # ------------------------------------------------------------------------------
 
 
@@ -72,3 +79,62 @@ def test_prod_get_jpeg():
   # Remove this line when uncommenting the block above
   camera.get_jpeg()
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_stop_camera():
+  assert camera.stop_camera(timeout=1)  # nothing to stop
+
+  def capture(duration):
+    # stand-in for the capture loop of get_camera_frame()
+    end = time.time() + duration
+    while time.time() < end and not camera.stop_requested:
+      time.sleep(0.01)
+    camera.thread = None
+
+  camera.thread = Thread(target=capture, args=(5,))
+  camera.thread.start()
+  assert camera.stop_camera(timeout=1)
+  assert camera.thread is None
+
+  # a camera that doesn't react in time
+  running = Thread(target=time.sleep, args=(1,))
+  camera.thread = running
+  running.start()
+  assert not camera.stop_camera(timeout=0.1)
+  running.join()
+  camera.thread = None
+
+  # the next camera thread isn't stopped by the old request
+  original_get_camera_frame = camera.get_camera_frame
+  camera.get_camera_frame = lambda: capture(0.2)
+  camera.camera_frame = b'frame'
+  cfg.DEBUG = False
+  camera.fallback = False
+  try:
+    camera.initialize_camera()
+    assert not camera.stop_requested
+  finally:
+    camera.get_camera_frame = original_get_camera_frame
+    camera.thread.join()
+    cfg.DEBUG = True
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_camera_fallback(monkeypatch):
+  # e.g. picamera installed, but not running on a Raspberry Pi, a None entry
+  # makes `import picamera` fail without touching other imports
+  monkeypatch.setitem(sys.modules, 'picamera', None)
+  monkeypatch.setattr(cfg, 'DEBUG', False)
+  monkeypatch.setattr(camera, 'fallback', False)
+  monkeypatch.setattr(camera, 'thread', None)
+  monkeypatch.setattr(camera, 'camera_frame', None)
+  monkeypatch.setattr(camera, 'last_access', 0)
+
+  assert camera.get_jpeg().startswith(b'\xff\xd8')  # jpeg
+  assert camera.fallback
+  assert camera.thread is None
+  # the rest of the application stays in production mode
+  assert not cfg.DEBUG
+# ------------------------------------------------------------------------------
@@ -233,6 +233,139 @@ def test_delete_inactive_users(db_fixture):
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def test_user_cache(fill_users):
+  cfg.USER_CACHE_SIZE = 2
+  database.invalidate_users()
+
+  loads = []
+  original_load_user = database.load_user
+
+  def counting_load_user(nfc_id):
+    loads.append(nfc_id)
+    return original_load_user(nfc_id)
+
+  database.load_user = counting_load_user
+  try:
+    assert database.get_user('a')['given_name'] == 'b'
+    assert database.get_user('a')['given_name'] == 'b'
+    assert loads == ['a']
+
+    # least recently used user is evicted
+    database.get_user('e')
+    database.get_user('a')
+    database.get_user('i')
+    assert list(database.user_cache) == ['a', 'i']
+
+    # changes invalidate the cached user
+    database.update_user('a', 'x', 'y', 'z')
+    assert database.get_user('a')['given_name'] == 'x'
+    database.delete_user('i')
+    assert database.get_user('i') is None
+    assert loads == ['a', 'e', 'i', 'a', 'i']
+
+    # callers can't modify the cache
+    database.get_user('a')['given_name'] = 'modified'
+    assert database.get_user('a')['given_name'] == 'x'
+
+    # a lookup that raced with a change doesn't cache outdated data
+    version = database.users_version
+    user = original_load_user('e')
+    database.update_user('e', 'changed', 'g', 'h')
+    database.cache_user(user, version)
+    assert database.get_user('e')['given_name'] == 'changed'
+  finally:
+    database.load_user = original_load_user
+    cfg.USER_CACHE_SIZE = 256
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_deferred_last_access(fill_users):
+  c = database.db_connection.cursor()
+  c.execute('UPDATE users SET last_access=0')
+  database.pending_access.clear()
+
+  def last_access(nfc_id):
+    c.execute('SELECT last_access FROM users WHERE nfc_id=?', (nfc_id,))
+    return c.fetchone()[0]
+
+  user = database.get_user('e')
+  assert user['last_access'] > 0
+  assert last_access('e') == 0
+
+  assert database.flush_last_access() == 1
+  assert last_access('e') == user['last_access']
+  assert database.flush_last_access() == 0
+
+  # recently active users survive the purge, even before a flush
+  database.get_user('i')
+  assert database.delete_inactive_users(database.unix_timestamp() - 3600) == 0
+  assert last_access('i') > 0
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_prefetch(fill_users):
+  cfg.PREFETCH_DURATION = 30
+  database.add_transaction('e', b'DATA')
+  assert not database.prefetch('unknown')
+  assert database.prefetch('e')
+  assert 'e' in database.user_cache
+
+  queries = []
+  original_get_transactions = database.get_transactions_from_nfc_id
+
+  def counting_get_transactions(nfc_id):
+    queries.append(nfc_id)
+    return original_get_transactions(nfc_id)
+
+  database.get_transactions_from_nfc_id = counting_get_transactions
+  try:
+    # images aren't kept in memory, they are loaded with the page
+    assert all('image' not in t for t in database.prefetched['e'][1])
+    transactions = database.get_prefetched_transactions('e')
+    assert [t['image'] for t in transactions] == [b'DATA']
+    assert set(transactions[0]) == set(database.get_transactions()[0])
+    assert queries == []
+
+    # changes of other users keep the prefetched list
+    database.add_transaction('a', b'DATA')
+    assert database.prefetch('a')
+    database.unsafe_delete_transaction(
+      database.get_transactions_from_nfc_id('a')[0]['transaction_id'])
+    assert 'e' in database.prefetched
+    assert 'a' not in database.prefetched
+    database.get_prefetched_transactions('e')
+    assert queries == ['a']
+
+    # new transactions outdate the prefetched list
+    database.add_transaction('e', b'MORE')
+    transactions = database.get_prefetched_transactions('e')
+    assert len(transactions) == 2
+    assert queries == ['a', 'e']
+
+    # so does deleting them by transaction_id
+    database.prefetch('e')
+    database.delete_transaction(transactions[0]['transaction_id'],
+                                transactions[0]['removal_key'])
+    assert len(database.get_prefetched_transactions('e')) == 1
+    assert queries == ['a', 'e', 'e']
+
+    # expired
+    database.prefetch('e')
+    database.prefetched['e'] = (0,) + database.prefetched['e'][1:]
+    database.get_prefetched_transactions('e')
+    assert queries == ['a', 'e', 'e', 'e']
+
+    cfg.PREFETCH_DURATION = 0
+    assert not database.prefetch('e')
+  finally:
+    database.get_transactions_from_nfc_id = original_get_transactions
+    cfg.PREFETCH_DURATION = 30
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def test_add_transaction(db_fixture):
   t = database.add_transaction('a', b'DATA')
@@ -298,6 +431,14 @@ def test_get_transactions(fill_transactions):
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def test_count_transactions(fill_transactions):
+  assert database.count_transactions() == 4
+  database.unsafe_delete_transaction(fill_transactions)
+  assert database.count_transactions() == 3
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def test_get_transaction(fill_transactions):
   t_id = fill_transactions
@@ -399,3 +540,92 @@ def test_unsafe_delete_transaction_nonexistant(fill_transactions):
   r = database.unsafe_delete_transaction(None)
   assert r == 0
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_maintenance_status():
+  cfg.DATABASE_FILE_LOCATION = ':memory:'
+  database.initialize_connection()
+  database.create_tables()
+
+  assert database.get_maintenance_status() == []
+
+  database.update_maintenance_status('job', 'success', 0.5, 10, 'rows')
+  first = database.get_maintenance_status()[0]
+
+  database.update_maintenance_status('job', 'failed', 0.1, None, 'rows',
+                                      'error')
+  status_list = database.get_maintenance_status()
+
+  database.close_connection()
+
+  assert len(status_list) == 1
+  assert status_list[0]['status'] == 'failed'
+  assert status_list[0]['message'] == 'error'
+  # last success is kept on failed runs
+  assert status_list[0]['last_success'] == first['last_success']
+  assert first['affected'] == 10
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_get_activity_timestamps():
+  cfg.DATABASE_FILE_LOCATION = ':memory:'
+  database.initialize_connection()
+  database.create_tables()
+
+  database.db_connection.executemany(
+    'INSERT INTO users(nfc_id, admin, last_access) VALUES (?, 0, ?)',
+    [('A', 10), ('B', 100)])
+  database.db_connection.executemany(
+    'INSERT INTO transactions(nfc_id, transaction_time) VALUES (?, ?)',
+    [('A', 20), ('B', 200)])
+
+  timestamps = database.get_activity_timestamps(50)
+
+  database.close_connection()
+
+  assert sorted(timestamps) == [100, 200]
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_lock_diagnostics():
+  from threading import Thread
+  from time import sleep
+  cfg.DB_LOCK_DIAGNOSTICS = True
+  cfg.DB_LOCK_WARN_SECONDS = 0.1
+  database.lock_statistics.clear()
+
+  @database.lock_and_release
+  def hold_lock():
+    assert database.lock_holder == 'hold_lock'
+    sleep(0.3)
+
+  @database.lock_and_release
+  def quick():
+    pass
+
+  holder = Thread(target=hold_lock)
+  holder.start()
+  sleep(0.1)
+  quick()
+  holder.join()
+
+  assert database.lock_holder is None
+  statistics = {e['function']: e for e in database.get_lock_statistics()}
+  assert statistics['hold_lock']['holds'] == 1
+  assert statistics['hold_lock']['slow_holds'] == 1
+  assert statistics['hold_lock']['hold_max'] >= 0.3
+  assert statistics['hold_lock']['wait_caused'] >= 0.1
+  assert statistics['quick']['slow_holds'] == 0
+  assert statistics['quick']['wait_total'] >= 0.1
+  # longest total hold first
+  assert database.get_lock_statistics(limit=1)[0]['function'] == 'hold_lock'
+
+  cfg.DB_LOCK_DIAGNOSTICS = False
+  quick()
+  assert database.get_lock_statistics(limit=1)[0]['holds'] == 1
+  assert len(database.get_lock_statistics()) == 2
+  database.lock_statistics.clear()
+# ------------------------------------------------------------------------------
@@ -0,0 +1,255 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.display
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.display as display
+import werkzeugverleih.routine as routine
+import pytest
+import sys
+from time import time
+from types import ModuleType
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class FakeController:
+  '''records mouse movements instead of talking to the X server'''
+  instances = 0
+
+  def __init__(self):
+    FakeController.instances += 1
+    self.moves = []
+
+  def move(self, dx, dy):
+    self.moves.append((dx, dy))
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def fake_screen(monkeypatch):
+  FakeController.instances = 0
+  mouse = ModuleType('pynput.mouse')
+  mouse.Controller = FakeController
+  monkeypatch.setitem(sys.modules, 'pynput', ModuleType('pynput'))
+  monkeypatch.setitem(sys.modules, 'pynput.mouse', mouse)
+  monkeypatch.setattr(display, 'controller', None)
+  monkeypatch.setattr(display, 'last_wake', None)
+  monkeypatch.setattr(display, 'screen_on', True)
+  monkeypatch.setattr(display, 'blanked_at', 0.0)
+  cfg.DISPLAY_WAKE_METHOD = 'mouse'
+  cfg.DISPLAY_WAKE_DEBOUNCE = 10
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wake_screen(fake_screen):
+  assert display.wake_screen()
+  assert display.screen_awake()
+  # the pointer ends up where it was
+  assert display.controller.moves == [(1, 1), (-1, -1)]
+
+  # debounced, the controller is reused
+  for _ in range(10):
+    assert not display.wake_screen()
+  assert FakeController.instances == 1
+  assert len(display.controller.moves) == 2
+
+  cfg.DISPLAY_WAKE_DEBOUNCE = 0
+  assert display.wake_screen()
+  assert FakeController.instances == 1
+  assert len(display.controller.moves) == 4
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wake_screen_xset(fake_screen, monkeypatch):
+  commands = []
+  monkeypatch.setattr(display.subprocess, 'run',
+                      lambda command, **kwargs: commands.append(command))
+  cfg.DISPLAY_WAKE_METHOD = 'xset'
+
+  assert display.wake_screen()
+  assert commands == [['xset', 'dpms', 'force', 'on'], ['xset', 's', 'reset']]
+  assert display.controller is None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wake_screen_failure(fake_screen, monkeypatch):
+  def fail(command, **kwargs):
+    raise FileNotFoundError('xset')
+  monkeypatch.setattr(display.subprocess, 'run', fail)
+  cfg.DISPLAY_WAKE_METHOD = 'xset'
+
+  # failed wake-ups are logged and retried on the next call
+  assert not display.wake_screen()
+  assert not display.screen_awake()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def idle_screen(fake_screen, monkeypatch):
+  commands = []
+  monkeypatch.setattr(display.subprocess, 'run',
+                      lambda command, **kwargs: commands.append(command))
+  stopped = []
+  monkeypatch.setattr(display.cam, 'stop_camera',
+                      lambda: stopped.append(True))
+  monkeypatch.setattr(display, 'started_at', time() - 100)
+  monkeypatch.setattr(routine, 'last_activity', 0)
+  cfg.DISPLAY_IDLE_SECONDS = 60
+  return commands, stopped
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_check_screen(idle_screen):
+  commands, stopped = idle_screen
+
+  # recent activity, check again when the idle time is reached
+  routine.last_activity = time() - 40
+  assert 19 < display.check_screen() <= 20
+  assert not display.screen_blanked()
+
+  routine.last_activity = time() - 61
+  assert display.check_screen() == display.BLANKED_CHECK_INTERVAL
+  assert display.screen_blanked()
+  assert commands == [['xset', 'dpms', 'force', 'off']]
+  assert stopped == [True]
+
+  # nothing happened
+  display.check_screen()
+  assert display.screen_blanked()
+  assert len(commands) == 1
+
+  # touch on the web interface
+  routine.register_activity()
+  display.check_screen()
+  assert not display.screen_blanked()
+  assert display.controller.moves == [(1, 1), (-1, -1)]
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_check_screen_reblank(idle_screen):
+  commands, _ = idle_screen
+  display.check_screen()
+  assert display.screen_blanked()
+
+  # a touch outside of the browser may have turned the monitor on
+  display.blanked_at -= 60
+  display.check_screen()
+  assert display.screen_blanked()
+  assert len(commands) == 2
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_check_screen_startup(idle_screen):
+  # no activity since booting, the idle time starts with the display thread
+  display.started_at = time()
+  assert display.check_screen() > 59
+  assert not display.screen_blanked()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wake_screen_nfc_after_blank(idle_screen):
+  assert display.wake_screen()
+  display.check_screen()
+  assert display.screen_blanked()
+
+  # the debounce time doesn't apply to a blanked screen
+  assert display.wake_screen()
+  assert not display.screen_blanked()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_start_stop_display(idle_screen):
+  cfg.DEBUG = False
+  display.start_display()
+  try:
+    assert display.thread is not None
+    assert display.thread.name == 'display'
+  finally:
+    assert display.stop_display()
+  assert display.thread is None
+  assert not display.screen_blanked()
+
+  cfg.DEBUG = True
+  display.start_display()
+  assert display.thread is None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wake_screen_while_blanking(idle_screen, monkeypatch):
+  commands, stopped = idle_screen
+  woken = []
+
+  def scan_while_blanking(command, **kwargs):
+    commands.append(command)
+    # NFC scan while xset runs, the lock is taken
+    woken.append(display.wake_screen())
+  monkeypatch.setattr(display.subprocess, 'run', scan_while_blanking)
+
+  assert not display.blank_screen()
+  assert woken == [False]
+  # the dropped wake-up was made up for
+  assert not display.screen_blanked()
+  assert display.controller.moves == [(1, 1), (-1, -1)]
+  assert stopped == []
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_touch_while_blanking(idle_screen, monkeypatch):
+  commands, stopped = idle_screen
+
+  def touch_while_blanking(command, **kwargs):
+    commands.append(command)
+    routine.register_activity()
+  monkeypatch.setattr(display.subprocess, 'run', touch_while_blanking)
+
+  display.check_screen()
+  assert not display.screen_blanked()
+  assert commands == [['xset', 'dpms', 'force', 'off']]
+  assert stopped == []
+
+  # no activity this time, the screen stays off
+  monkeypatch.setattr(display.subprocess, 'run',
+                      lambda command, **kwargs: commands.append(command))
+  routine.last_activity = 0
+  assert display.blank_screen()
+  display.check_screen()
+  assert display.screen_blanked()
+  assert stopped == [True]
+# ------------------------------------------------------------------------------
@@ -0,0 +1,122 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.lifecycle
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.lifecycle as lifecycle
+import pytest
+from threading import Thread
+from time import sleep
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+  yield
+  lifecycle.shutting_down.clear()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_wait_for_requests():
+  assert lifecycle.wait_for_requests(timeout=0.1)
+
+  lifecycle.request_started()
+  lifecycle.request_started()
+  assert not lifecycle.wait_for_requests(timeout=0.1)
+
+  def finish():
+    sleep(0.2)
+    lifecycle.request_finished()
+    lifecycle.request_finished()
+
+  Thread(target=finish).start()
+  assert lifecycle.wait_for_requests(timeout=5)
+  assert lifecycle.in_flight == 0
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_run_shutdown():
+  order = []
+
+  def failing():
+    order.append('failing')
+    raise RuntimeError('hardware gone')
+
+  results = lifecycle.run_shutdown([
+    ('first', lambda: order.append('first'), 1),
+    ('failing', failing, 1),
+    ('hanging', lambda: sleep(2), 0.1),
+    ('unfinished', lambda: False, 1),
+    ('last', lambda: order.append('last'), 1),
+  ])
+
+  assert lifecycle.shutting_down.is_set()
+  assert order == ['first', 'failing', 'last']
+  assert [(name, status) for name, status, _ in results] == [
+    ('first', 'ok'), ('failing', 'failed'), ('hanging', 'timeout'),
+    ('unfinished', 'timeout'), ('last', 'ok')]
+
+  # the hanging stage didn't hold up the shutdown
+  assert results[2][2] < 1
+  assert sum(duration for _, _, duration in results) < 1.5
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_serve_until_shutdown():
+  lifecycle.shutting_down.clear()
+  stopped = []
+
+  def signal_later():
+    sleep(0.2)
+    lifecycle.begin_shutdown()
+  Thread(target=signal_later).start()
+  # a server that ignores being stopped, e.g. open keep-alive connections
+  server = lifecycle.serve_until_shutdown(lambda: sleep(10))
+  assert lifecycle.shutting_down.is_set()
+  assert server.is_alive()
+
+  order = []
+  results = lifecycle.run_shutdown([
+    ('webserver',
+     lambda: lifecycle.stop_server(lambda: stopped.append(True), server, 0.2),
+     1),
+    ('database', lambda: order.append('database'), 1),
+    ('log', lambda: order.append('log'), 1),
+  ])
+
+  # the remaining stages ran anyway
+  assert stopped == [True]
+  assert [(name, status) for name, status, _ in results] == [
+    ('webserver', 'timeout'), ('database', 'ok'), ('log', 'ok')]
+  assert order == ['database', 'log']
+  assert server.daemon
+  lifecycle.shutting_down.clear()
+
+  # a server stopping on its own returns at once
+  server = lifecycle.serve_until_shutdown(lambda: None)
+  assert not server.is_alive()
+  assert lifecycle.stop_server(lambda: stopped.append(True), server, 1)
+  assert stopped == [True]
+# ------------------------------------------------------------------------------
@@ -70,65 +70,197 @@ def test_log_malformed():
 
 
 # ------------------------------------------------------------------------------
-@pytest.fixture
-def mock_daychange():
-  original_today = log.today
-  original_change_log_file = log.change_log_file
+def test_log_daychange():
+  import gzip
+  from os.path import abspath, exists
+  from time import time
+  cfg.LOG_COMPRESS = True
+  log.initialize_logger()
+  open('tests/scratch/daychange.log', 'w').close()
+  log.change_log_file('tests/scratch/daychange.log')
+
+  log.log('before midnight', level='info')
+  log.flush_logger()
+  assert log.file_handler.rollover_at > time()
+
+  # pretend midnight has passed, the next record changes the file
+  log.file_handler.rollover_at = time()
+  log.log('after midnight', level='info')
+  log.flush_logger()
+
+  assert log.current_log_file() == abspath(log.dated_log_file())
+  assert log.file_handler.rollover_at > time()
+  assert not exists('tests/scratch/daychange.log')
+  with gzip.open('tests/scratch/daychange.log.gz', 'rt') as f:
+    content = f.read()
+  assert 'before midnight' in content
+  assert 'after midnight' not in content
+
+  cfg.LOG_COMPRESS = False
+# ------------------------------------------------------------------------------
 
-  from datetime import date, timedelta
-  saved_date = date.today()
 
-  def mock_today_function():
-    '''every call advances the date by one day'''
-    nonlocal saved_date
-    saved_date += timedelta(days=1)
-    return saved_date
+# ------------------------------------------------------------------------------
+def test_current_log_file():
+  log.initialize_logger()
+  f = log.current_log_file()
+  assert f is not None
+# ------------------------------------------------------------------------------
 
-  log.today = mock_today_function
 
-  log_file_changed = False
+# ------------------------------------------------------------------------------
+def test_current_log_file_no_handler():
+  original_file_handler = log.file_handler
+  log.file_handler = None
 
-  def mock_change_log_file(filename=None):
-    nonlocal log_file_changed
-    log_file_changed = True
+  n = log.current_log_file()
 
-  log.change_log_file = mock_change_log_file
+  log.file_handler = original_file_handler
+  assert n is None
+# ------------------------------------------------------------------------------
 
-  def get_log_file_changed():
-    nonlocal log_file_changed
-    return log_file_changed
 
-  yield get_log_file_changed
+# ------------------------------------------------------------------------------
+def test_log_async():
+  log.initialize_logger(level='debug')
+  open('tests/scratch/async.log', 'w').close()
+  log.change_log_file('tests/scratch/async.log')
+
+  for i in range(100):
+    log.log(f'async message {i}', level='debug')
+
+  # messages are written by the listener thread
+  assert log.listener._thread.is_alive()
+  log.flush_logger()
+
+  with open('tests/scratch/async.log', encoding='utf-8') as f:
+    lines = f.readlines()
+
+  assert len([line for line in lines if 'async message' in line]) == 100
+  assert 'async message 99' in lines[-1]
 
-  log.change_log_file = original_change_log_file
-  log.today = original_today
+  log.change_log_file()
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def test_log_daychange(mock_daychange):
-  log.initialize_logger()
-  log.log('test', level='info')
-  log.log('test', level='info')
-  assert mock_daychange()
+def test_log_levels():
+  log.initialize_logger(level='warning')
+  open('tests/scratch/levels.log', 'w').close()
+  log.change_log_file('tests/scratch/levels.log')
+
+  log.log('filtered', level='info')
+  log.log('not filtered', level='error')
+  log.flush_logger()
+
+  with open('tests/scratch/levels.log', encoding='utf-8') as f:
+    content = f.read()
+
+  assert 'filtered' not in content.replace('not filtered', '')
+  assert '| ERROR | not filtered' in content
+
+  log.change_log_file()
+  log.initialize_logger(level='debug')
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def test_current_log_file():
+def test_stop_logger():
   log.initialize_logger()
-  f = log.current_log_file()
-  assert f is not None
+  log.stop_logger()
+  assert log.listener is None
+
+  # messages are kept in the queue until the listener is restarted
+  log.log('test', level='info')
+  log.flush_logger()
+  log.initialize_logger()
+  log.flush_logger()
+  assert log.log_queue.empty()
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def test_current_log_file_no_handler():
-  import logging
-  log.logger = logging.getLogger(name='werkzeugverleih')
-  for handler in log.logger.handlers:
-    log.logger.removeHandler(handler)
+def test_log_lazy():
+  log.initialize_logger(level='info')
+  open('tests/scratch/lazy.log', 'w').close()
+  log.change_log_file('tests/scratch/lazy.log')
 
-  n = log.current_log_file()
-  assert n is None
+  calls = []
+
+  def expensive_message():
+    calls.append(1)
+    return 'expensive message'
+
+  class Unformattable:
+    def __str__(self):
+      raise AssertionError('formatted disabled message')
+
+  assert not log.is_enabled('debug')
+  assert log.is_enabled('info')
+  assert log.is_enabled('some_data')  # defaults to info
+
+  log.log(expensive_message, level='debug')
+  log.log('arguments %s', Unformattable(), level='debug')
+  assert calls == []
+
+  log.log(expensive_message, level='info')
+  log.log('arguments %s and %s', 'first', [1, 2], level='info')
+  log.log('no arguments 100%', level='info')
+  log.flush_logger()
+  assert calls == [1]
+
+  with open('tests/scratch/lazy.log', encoding='utf-8') as f:
+    content = f.read()
+
+  assert 'expensive message' in content
+  assert 'arguments first and [1, 2]' in content
+  assert 'no arguments 100%' in content
+
+  log.change_log_file()
+  log.initialize_logger(level='debug')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_log_json():
+  import json
+  from threading import Thread
+  cfg.LOG_JSON = True
+  log.initialize_logger(level='info')
+  open('tests/scratch/json.log', 'w').close()
+  log.change_log_file('tests/scratch/json.log')
+
+  log.set_request_id('first')
+  log.log('checkout of %s', 'abc', level='info', event='checkout',
+          nfc_id='abc', transaction_ids=[1, 2], duration_ms=12.5)
+
+  # the request id is taken from the logging thread, not the listener thread
+  other = Thread(target=lambda: log.log('other thread', level='warning'))
+  other.start()
+  other.join()
+
+  assert len(log.set_request_id()) == 12
+  log.request_id.set(None)
+  log.log('debug message', level='debug', event='filtered')
+  log.flush_logger()
+
+  with open('tests/scratch/json.log', encoding='utf-8') as f:
+    entries = [json.loads(line) for line in f]
+
+  assert len(entries) == 2
+  assert entries[0]['message'] == 'checkout of abc'
+  assert entries[0]['level'] == 'info'
+  assert entries[0]['request_id'] == 'first'
+  assert entries[0]['event'] == 'checkout'
+  assert entries[0]['nfc_id'] == 'abc'
+  assert entries[0]['transaction_ids'] == [1, 2]
+  assert entries[0]['duration_ms'] == 12.5
+  assert 'time' in entries[0]
+  assert entries[1]['message'] == 'other thread'
+  assert 'request_id' not in entries[1]
+
+  cfg.LOG_JSON = False
+  log.request_id.set(None)
+  log.change_log_file()
+  log.initialize_logger(level='debug')
 # ------------------------------------------------------------------------------
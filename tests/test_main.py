@@ -19,6 +19,8 @@ import werkzeugverleih.database as db
 import werkzeugverleih.camera as cam
 import werkzeugverleih.webserver as webserver
 import werkzeugverleih.routine as routine
+import werkzeugverleih.lifecycle as lifecycle
+import werkzeugverleih.profiler as profiler
 import werkzeugverleih.main as main
 import pytest
 from os import remove
@@ -86,6 +88,8 @@ def main_mocks():
   original_create_tables = db.create_tables
   original_initialize_camera = cam.initialize_camera
   original_start_routine = routine.start_routine
+  original_register_shutdown_signals = main.register_shutdown_signals
+  original_schedule_job = routine.schedule_job
   original_start_webserver = webserver.start_webserver
   original_stop_routine = routine.stop_routine
   original_close_connection = db.close_connection
@@ -96,6 +100,8 @@ def main_mocks():
   db.create_tables = mock_pass
   cam.initialize_camera = mock_pass
   routine.start_routine = mock_pass
+  main.register_shutdown_signals = mock_pass
+  routine.schedule_job = mock_pass
   webserver.start_webserver = mock_pass
   routine.stop_routine = mock_pass
   db.close_connection = mock_pass
@@ -108,9 +114,12 @@ def main_mocks():
   db.create_tables = original_create_tables
   cam.initialize_camera = original_initialize_camera
   routine.start_routine = original_start_routine
+  main.register_shutdown_signals = original_register_shutdown_signals
+  routine.schedule_job = original_schedule_job
   webserver.start_webserver = original_start_webserver
   routine.stop_routine = original_stop_routine
   db.close_connection = original_close_connection
+  lifecycle.shutting_down.clear()
 # ------------------------------------------------------------------------------
 
 
@@ -131,3 +140,73 @@ def test_main(main_mocks):
   with pytest.raises(SystemExit):
     main.main()
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_register_shutdown_signals():
+  import signal
+  original_handlers = {s: signal.getsignal(s)
+                        for s in (signal.SIGTERM, signal.SIGINT)}
+
+  main.register_shutdown_signals()
+  signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+  assert lifecycle.shutting_down.is_set()
+
+  # repeated signals during the shutdown are harmless
+  signal.getsignal(signal.SIGINT)(signal.SIGINT, None)
+  assert lifecycle.shutting_down.is_set()
+
+  lifecycle.shutting_down.clear()
+  signal.getsignal(signal.SIGINT)(signal.SIGINT, None)
+  assert lifecycle.shutting_down.is_set()
+  lifecycle.shutting_down.clear()
+
+  for signum, handler in original_handlers.items():
+    signal.signal(signum, handler)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_register_profiler_signal():
+  import signal
+  from time import sleep
+  original_handler = signal.getsignal(signal.SIGUSR1)
+
+  main.register_profiler_signal()
+  signal.getsignal(signal.SIGUSR1)(signal.SIGUSR1, None)
+  for _ in range(50):
+    if profiler.profiler_running():
+      break
+    sleep(0.1)
+  assert profiler.profiler_running()
+
+  filename = profiler.start_profiler()
+  profiler.stop_profiler()
+  signal.signal(signal.SIGUSR1, original_handler)
+  assert filename is None  # already running
+  remove(profiler.last_profile)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+HARDWARE_MODULES = ('tinkerforge', 'pynput', 'picamera')
+IMPORT_BENCHMARK = '''
+import sys
+from time import perf_counter
+start = perf_counter()
+import werkzeugverleih.main
+print(round(perf_counter() - start, 3))
+print(' '.join(m for m in sys.modules if m.split('.')[0] in sys.argv[1:]))
+'''
+def test_no_hardware_imports():
+  import subprocess
+  import sys
+  # fresh interpreter, other tests may have imported hardware libraries
+  result = subprocess.run(
+    [sys.executable, '-c', IMPORT_BENCHMARK, *HARDWARE_MODULES],
+    capture_output=True, text=True, check=True, timeout=60)
+  duration, hardware_modules = result.stdout.splitlines()
+  # shown with `pytest -s`
+  print(f'import werkzeugverleih.main: {duration} s')
+  assert hardware_modules == ''
+# ------------------------------------------------------------------------------
@@ -0,0 +1,162 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.metrics
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.database as db
+import werkzeugverleih.metrics as metrics
+import pytest
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+  cfg.DATABASE_FILE_LOCATION = ':memory:'
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_histogram():
+  histogram = metrics.Histogram()
+  assert histogram.quantile(0.5) == 0
+
+  for seconds in (0.0005, 0.002, 0.002, 0.2, 20):
+    histogram.observe(seconds)
+
+  snapshot = histogram.snapshot()
+  assert snapshot['count'] == 5
+  assert snapshot['max'] == 20
+  assert snapshot['sum'] == pytest.approx(20.2045)
+  assert snapshot['counts'][0] == 1  # <= 1 ms
+  assert snapshot['counts'][1] == 2  # <= 2.5 ms
+  assert snapshot['counts'][-1] == 1  # > 10 s
+
+  assert histogram.quantile(0.5) == 0.0025
+  assert histogram.quantile(1) == 20
+
+  histogram.reset()
+  assert histogram.snapshot()['count'] == 0
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_timed_summary():
+  metrics.reset_metrics()
+
+  with metrics.timed('test', 'block'):
+    pass
+  metrics.observe('test', 'value', 0.5)
+
+  with pytest.raises(ValueError):
+    with metrics.timed('test', 'error'):
+      raise ValueError
+
+  summary = {(e['metric'], e['label']): e for e in metrics.summary()}
+  assert summary[('test', 'block')]['count'] == 1
+  assert summary[('test', 'error')]['count'] == 1
+  assert summary[('test', 'value')]['mean_ms'] == 500
+  assert summary[('test', 'value')]['p95_ms'] == 500
+
+  metrics.log_metrics()
+
+  metrics.reset_metrics()
+  assert ('test', 'value') not in {(e['metric'], e['label'])
+                                    for e in metrics.summary()}
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_database_timing():
+  metrics.reset_metrics()
+  db.initialize_connection()
+  db.create_tables()
+  db.get_user('nonexistent')
+  db.close_connection()
+
+  summary = {(e['metric'], e['label']): e for e in metrics.summary()}
+  assert summary[('db_wait', 'load_user')]['count'] == 1
+  assert summary[('db_hold', 'load_user')]['count'] == 1
+  assert summary[('db_hold', 'create_tables')]['count'] == 1
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def scrape(text):
+  '''minimal stand-in for a Prometheus scraper, returns {sample: value} and
+  {name: type}'''
+  import re
+  samples = {}
+  types = {}
+  for line in text.splitlines():
+    if line.startswith('# TYPE'):
+      _, _, name, kind = line.split(' ')
+      types[name] = kind
+    elif line.startswith('#') or not line:
+      continue
+    else:
+      match = re.fullmatch(r'([a-zA-Z_:][a-zA-Z0-9_:]*(?:\{.*\})?) (\S+)', line)
+      assert match, line
+      samples[match.group(1)] = float(match.group(2))
+  return samples, types
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_prometheus_text():
+  metrics.reset_metrics()
+  metrics.observe('request', '/checkin', 0.003)
+  metrics.observe('request', '/checkin', 0.2)
+  metrics.observe('unknown', 'with "quotes"', 1)
+  metrics.increment('camera_frames_sent')
+  metrics.increment('camera_frames_sent', 2)
+
+  text = metrics.prometheus_text([
+    ('werkzeugverleih_open_transactions', 'Transactions', {}, 4),
+    ('werkzeugverleih_maintenance_duration_seconds', 'Duration',
+     {'job': 'backup_db'}, 0.5),
+    ('werkzeugverleih_maintenance_duration_seconds', 'Duration',
+     {'job': 'remove_backups'}, 0.25),
+  ])
+  samples, types = scrape(text)
+
+  name = 'werkzeugverleih_request_duration_seconds'
+  assert types[name] == 'histogram'
+  assert samples[name + '_bucket{route="/checkin",le="0.0025"}'] == 0
+  assert samples[name + '_bucket{route="/checkin",le="0.005"}'] == 1
+  assert samples[name + '_bucket{route="/checkin",le="+Inf"}'] == 2
+  assert samples[name + '_count{route="/checkin"}'] == 2
+  assert samples[name + '_sum{route="/checkin"}'] == pytest.approx(0.203)
+
+  assert samples['werkzeugverleih_unknown_seconds_count'
+                 '{label="with \\"quotes\\""}'] == 1
+
+  assert types['werkzeugverleih_camera_frames_sent_total'] == 'counter'
+  assert samples['werkzeugverleih_camera_frames_sent_total'] == 3
+
+  assert types['werkzeugverleih_open_transactions'] == 'gauge'
+  assert samples['werkzeugverleih_open_transactions'] == 4
+  assert samples['werkzeugverleih_maintenance_duration_seconds'
+                 '{job="remove_backups"}'] == 0.25
+  assert text.count('# TYPE werkzeugverleih_maintenance_duration_seconds') == 1
+
+  metrics.reset_metrics()
+# ------------------------------------------------------------------------------
@@ -15,8 +15,11 @@ dependencies:
 
 import werkzeugverleih.config as cfg
 import werkzeugverleih.log as log
+import werkzeugverleih.metrics as metrics
 import werkzeugverleih.nfc as nfc
 import pytest
+from threading import Thread
+from time import sleep, time
 
 
 file_contents = ''
@@ -75,6 +78,293 @@ def test_get_tag_id_debug_None():
 # ------------------------------------------------------------------------------
 def test_get_tag_id_prod():
   cfg.DEBUG = False
+  cfg.NFC_SCAN_TIMEOUT = 0.2
+  nfc.clear_tag_id()
   n = nfc.get_tag_id()
   assert n is None
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_get_tag_id_prod_wakeup():
+  cfg.DEBUG = False
+  cfg.NFC_SCAN_TIMEOUT = 5
+  cfg.NFC_CACHE_DURATION = 5
+  nfc.clear_tag_id()
+
+  def scan():
+    sleep(0.2)
+    nfc.publish_tag_id('04A1B2C3')
+
+  Thread(target=scan).start()
+  start = time()
+  assert nfc.get_tag_id() == '04A1B2C3'
+  # woken up by the scan, not by the timeout
+  assert time() - start < 2
+
+  # cached tag is returned immediately
+  assert nfc.get_tag_id() == '04A1B2C3'
+
+  nfc.clear_tag_id()
+  cfg.NFC_SCAN_TIMEOUT = 0.2
+  assert nfc.get_tag_id() is None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class FakeReader:
+  '''stand-in for BrickletNFC in reader mode, answers every tag id request
+  with the tag the test put on it'''
+  MODE_READER = 2
+  READER_STATE_IDLE = 128
+  READER_STATE_REQUEST_TAG_ID = 2
+  READER_STATE_REQUEST_TAG_ID_READY = 130
+  READER_STATE_REQUEST_TAG_ID_ERROR = 194
+
+  def __init__(self):
+    self.tag_id = None
+    self.requests = 0
+    self.modes = 0
+
+  def set_mode(self, mode):
+    self.modes += 1
+    nfc.cb_reader_state_changed(self.READER_STATE_IDLE, True)
+
+  def reader_request_tag_id(self):
+    self.requests += 1
+    nfc.cb_reader_state_changed(self.READER_STATE_REQUEST_TAG_ID, False)
+    nfc.cb_reader_state_changed(self.READER_STATE_REQUEST_TAG_ID_READY
+                                if self.tag_id else
+                                self.READER_STATE_REQUEST_TAG_ID_ERROR, False)
+
+  def reader_get_tag_id(self):
+    from collections import namedtuple
+    return namedtuple('TagID', 'tag_type tag_id')(0, self.tag_id)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def fake_reader():
+  scans = []
+  original_tag_scanned = nfc.tag_scanned
+  nfc.tag_scanned = scans.append
+
+  cfg.DEBUG = False
+  cfg.NFC_SCAN_TIMEOUT = 2
+  cfg.NFC_CACHE_DURATION = 5
+  cfg.NFC_SEARCH_INTERVALL = 0.05
+  cfg.NFC_PRESENCE_INTERVAL = 0.05
+  cfg.NFC_REMOVAL_GRACE_PERIOD = 0.5
+  nfc.clear_tag_id()
+
+  reader = FakeReader()
+  reader.scans = scans
+  nfc.start_worker(reader)
+  nfc.attach_reader()
+
+  yield reader
+
+  assert nfc.stop_worker()
+  nfc.attached = False
+  nfc.clear_tag_id()
+  nfc.tag_scanned = original_tag_scanned
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def wait_until(condition, timeout=2):
+  end = time() + timeout
+  while not condition():
+    assert time() < end
+    sleep(0.01)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_worker(fake_reader):
+  # no tag, the reader keeps searching, that's not a failed read
+  errors = metrics.counters.get('nfc_scan_errors', 0)
+  wait_until(lambda: fake_reader.requests >= 3)
+  assert nfc.cached_id is None
+  assert metrics.counters.get('nfc_scan_errors', 0) == errors
+
+  fake_reader.tag_id = [0x14, 0xA1, 0xB2]
+  assert nfc.get_tag_id() == '14A1B2'
+
+  # presence checks keep the tag cached without scanning it again
+  requests = fake_reader.requests
+  wait_until(lambda: fake_reader.requests >= requests + 3)
+  assert nfc.get_tag_id() == '14A1B2'
+  assert fake_reader.scans == ['14A1B2']
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_worker_tag_change(fake_reader):
+  # a long cache must not delay the next user
+  fake_reader.tag_id = [0x11]
+  assert nfc.get_tag_id() == '11'
+
+  start = time()
+  fake_reader.tag_id = [0x22]
+  wait_until(lambda: nfc.cached_id == '22')
+  assert time() - start < 1
+  assert nfc.get_tag_id() == '22'
+  assert fake_reader.scans == ['11', '22']
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_worker_tag_removal(fake_reader):
+  fake_reader.tag_id = [0x33]
+  assert nfc.get_tag_id() == '33'
+
+  # still cached during the grace period
+  errors = metrics.counters.get('nfc_scan_errors', 0)
+  fake_reader.tag_id = None
+  wait_until(lambda: nfc.cached_expiry < nfc.cached_timestamp + 5)
+  assert nfc.get_tag_id() == '33'
+  assert metrics.counters.get('nfc_scan_errors', 0) == errors + 1
+
+  wait_until(lambda: not nfc.tag_cached())
+  cfg.NFC_SCAN_TIMEOUT = 0.1
+  assert nfc.get_tag_id() is None
+
+  # the same tag put back counts as a new scan
+  fake_reader.tag_id = [0x33]
+  cfg.NFC_SCAN_TIMEOUT = 2
+  assert nfc.get_tag_id() == '33'
+  assert fake_reader.scans == ['33', '33']
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_worker_callback_not_blocked(fake_reader):
+  fake_reader.tag_id = [0x10]
+  assert nfc.get_tag_id() == '10'
+
+  # the callback returns at once, even while a tag is held
+  start = time()
+  for _ in range(100):
+    nfc.cb_reader_state_changed(fake_reader.READER_STATE_REQUEST_TAG_ID, False)
+  assert time() - start < 0.1
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_backend():
+  cfg.NFC_BACKEND = None
+  cfg.DEBUG = True
+  assert nfc.backend() == 'file'
+  cfg.DEBUG = False
+  assert nfc.backend() == 'tinkerforge'
+
+  cfg.NFC_BACKEND = 'simulator'
+  cfg.NFC_SCAN_TIMEOUT = 2
+  cfg.NFC_SEARCH_INTERVALL = 0.02
+  cfg.NFC_SIMULATOR_SCRIPT = None
+  nfc.scan_side_effects = False
+  try:
+    nfc.initialize_nfc()
+    nfc.reader.put_tag('14A1B2C3')
+    assert nfc.get_tag_id() == '14A1B2C3'
+  finally:
+    nfc.stop_nfc()
+    nfc.scan_side_effects = True
+    cfg.NFC_BACKEND = None
+  assert nfc.reader is None and nfc.worker is None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_worker_reattach(fake_reader):
+  fake_reader.tag_id = [0x12]
+  assert nfc.get_tag_id() == '12'
+  assert fake_reader.modes == 1
+
+  # bricklet reset: no requests while detached, reader mode set again after
+  nfc.cb_enumerate(cfg.NFC_BRICKLET_UID, '0', 'a', (1, 0, 0), (2, 0, 0), 286,
+                   nfc.ENUMERATION_TYPE_DISCONNECTED)
+  wait_until(lambda: nfc.worker_state == nfc.DETACHED)
+  requests = fake_reader.requests
+  sleep(0.2)
+  assert fake_reader.requests == requests
+
+  nfc.cb_enumerate('other', '0', 'a', (1, 0, 0), (2, 0, 0), 286, 0)
+  assert not nfc.attached
+
+  nfc.cb_enumerate(cfg.NFC_BRICKLET_UID, '0', 'a', (1, 0, 0), (2, 0, 0), 286, 0)
+  wait_until(lambda: fake_reader.requests > requests)
+  assert fake_reader.modes == 2
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class FakeIPConnection:
+  '''fails to connect `failures` times'''
+  def __init__(self, failures):
+    self.failures = failures
+    self.attempts = []
+    self.enumerations = 0
+
+  def connect(self, host, port):
+    self.attempts.append(time())
+    if len(self.attempts) <= self.failures:
+      raise ConnectionRefusedError
+    nfc.cb_connected(0)
+
+  def enumerate(self):
+    self.enumerations += 1
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_reconnect(monkeypatch):
+  ipcon = FakeIPConnection(failures=3)
+  monkeypatch.setattr(nfc, 'ipcon', ipcon)
+  monkeypatch.setattr(nfc, 'ever_connected', False)
+  monkeypatch.setattr(nfc, 'reconnects', 0)
+  cfg.NFC_RECONNECT_DELAY = 0.05
+  cfg.NFC_RECONNECT_MAX_DELAY = 0.1
+  nfc.connect_stop.clear()
+
+  nfc.start_connecting()
+  wait_until(lambda: nfc.connection_state == 'connected')
+  wait_until(lambda: nfc.connect_thread is None)
+  assert len(ipcon.attempts) == 4
+  delays = [b - a for a, b in zip(ipcon.attempts, ipcon.attempts[1:])]
+  # doubling delay, limited to NFC_RECONNECT_MAX_DELAY
+  assert 0.04 < delays[0] < delays[1] and 0.09 < delays[2] < 0.2
+  assert ipcon.enumerations == 1
+  assert nfc.reconnects == 0
+
+  # a lost connection is restored, a requested disconnect is not
+  nfc.cb_disconnected(1)
+  wait_until(lambda: nfc.connection_state == 'connected')
+  assert nfc.reconnects == 1
+  assert ipcon.enumerations == 2
+
+  wait_until(lambda: nfc.connect_thread is None)
+  nfc.cb_disconnected(nfc.DISCONNECT_REASON_REQUEST)
+  sleep(0.1)
+  assert nfc.connection_state == 'disconnected'
+  assert len(ipcon.attempts) == 5
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_reader_health(fake_reader, monkeypatch):
+  monkeypatch.setattr(nfc, 'connection_state', 'connected')
+  cfg.NFC_BACKEND = 'simulator'
+  try:
+    health = nfc.reader_health()
+    assert health['backend'] == 'simulator'
+    assert health['healthy']
+
+    nfc.cb_enumerate(cfg.NFC_BRICKLET_UID, '0', 'a', (1, 0, 0), (2, 0, 0),
+                     286, nfc.ENUMERATION_TYPE_DISCONNECTED)
+    assert not nfc.reader_health()['healthy']
+  finally:
+    cfg.NFC_BACKEND = None
+# ------------------------------------------------------------------------------
@@ -0,0 +1,113 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.nfc_simulator
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.nfc_simulator as nfc_simulator
+import pytest
+from json import dump
+from queue import Queue
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def reader():
+  reader = nfc_simulator.SimulatedReader(delay=0.01, jitter=0)
+  states = Queue()
+  reader.register_callback(reader.CALLBACK_READER_STATE_CHANGED,
+                           lambda state, idle: states.put(state))
+  reader.states = states
+  yield reader
+  reader.stop()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_simulated_reader(reader):
+  reader.set_mode(reader.MODE_READER)
+  assert reader.states.get(timeout=1) == reader.READER_STATE_IDLE
+
+  reader.reader_request_tag_id()
+  assert reader.states.get(timeout=1) == reader.READER_STATE_REQUEST_TAG_ID
+  assert (reader.states.get(timeout=1) ==
+          reader.READER_STATE_REQUEST_TAG_ID_ERROR)
+
+  reader.put_tag('14A1B2C3')
+  reader.reader_request_tag_id()
+  reader.states.get(timeout=1)
+  assert (reader.states.get(timeout=1) ==
+          reader.READER_STATE_REQUEST_TAG_ID_READY)
+  assert reader.reader_get_tag_id().tag_id == [0x14, 0xA1, 0xB2, 0xC3]
+
+  # the answered tag stays readable after removal, like on the bricklet
+  reader.remove_tag()
+  assert reader.reader_get_tag_id().tag_id == [0x14, 0xA1, 0xB2, 0xC3]
+  assert reader.requests == 2
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_run_script(reader):
+  filename = 'tests/scratch/nfc_script.json'
+  with open(filename, 'w') as script_file:
+    dump([{'tag': '11', 'seconds': 0.2},
+          {'tag': None, 'seconds': 0.2},
+          {'tag': '22', 'seconds': 10}], script_file)
+
+  steps = nfc_simulator.load_script(filename)
+  assert steps == [('11', 0.2), (None, 0.2), ('22', 10.0)]
+
+  seen = []
+  reader.run_script(steps)
+  for _ in range(100):
+    if not seen or seen[-1] != reader.tag_id:
+      seen.append(reader.tag_id)
+    if reader.tag_id == '22':
+      break
+    nfc_simulator.sleep(0.01)
+  reader.stop_script()
+
+  assert seen == ['11', None, '22']
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_benchmark():
+  cfg.DEBUG = False
+  cfg.NFC_SCAN_TIMEOUT = 2
+  cfg.NFC_CACHE_DURATION = 5
+  cfg.NFC_SEARCH_INTERVALL = 0.02
+  cfg.NFC_PRESENCE_INTERVAL = 0.02
+  import werkzeugverleih.nfc as nfc
+
+  latencies = nfc_simulator.benchmark(users=5, delay=0.01, jitter=0.005)
+
+  assert nfc.scan_side_effects
+  assert len(latencies) == 5
+  assert all(0 < latency < 1 for latency in latencies)
+# ------------------------------------------------------------------------------
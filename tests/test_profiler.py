@@ -0,0 +1,124 @@
+"""
+name:
+  Werkzeugverleih tests
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Collection of tests for werkzeugverleih.profiler
+dependencies:
+  pytest
+"""
+
+import werkzeugverleih.config as cfg
+import werkzeugverleih.log as log
+import werkzeugverleih.profiler as profiler
+import pytest
+from os import remove
+from threading import Event, Thread
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture(scope='module', autouse=True)
+def default_statements():
+  cfg.LOG_LEVEL = 'debug'
+  cfg.LOG_FILENAME_TEMPLATE = 'log_${date}.log'
+  cfg.LOG_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+  cfg.LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+  log.initialize_logger()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def busy_thread():
+  stop = Event()
+
+  def busy_waiting_function():
+    while not stop.is_set():
+      stop.wait(0.001)
+
+  thread = Thread(target=busy_waiting_function, name='busy thread')
+  thread.start()
+  yield thread
+  stop.set()
+  thread.join()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_sample_stacks(busy_thread):
+  stacks = profiler.sample_stacks()
+
+  busy = [s for s in stacks if s.startswith('busy_thread;')]
+  assert len(busy) == 1
+  assert 'tests.test_profiler.busy_waiting_function' in busy[0]
+  # the sampling thread itself is never part of the samples
+  assert not any('profiler.sample_stacks' in s for s in stacks)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_start_profiler(busy_thread):
+  filename = profiler.start_profiler(duration=0.2, interval=0.01)
+  running = profiler.thread
+  assert filename.startswith('tests/scratch/profile_')
+  assert profiler.profiler_running()
+  assert profiler.start_profiler() is None  # already running
+
+  running.join()
+  assert not profiler.profiler_running()
+  assert profiler.last_profile == filename
+
+  with open(filename, encoding='utf-8') as f:
+    lines = f.read().splitlines()
+  remove(filename)
+
+  counts = {}
+  for line in lines:
+    stack, count = line.rsplit(' ', 1)
+    counts[stack] = int(count)
+
+  busy = sum(c for s, c in counts.items() if 'busy_waiting_function' in s)
+  assert busy >= 5
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_stop_profiler():
+  filename = profiler.start_profiler(duration=60, interval=0.01)
+  profiler.stop_profiler()
+  assert not profiler.profiler_running()
+  remove(filename)
+
+  # nothing to stop
+  profiler.stop_profiler()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_remove_old_profiles(tmp_path, monkeypatch):
+  monkeypatch.setattr(cfg, 'LOG_FILEPATH_TEMPLATE', f'{tmp_path}/${{filename}}')
+  names = [f'profile_2020-01-0{day}_12-00-00.folded' for day in range(1, 5)]
+  for name in names + ['log_2020-01-01.log']:
+    (tmp_path / name).touch()
+
+  assert profiler.remove_old_profiles(2) == 2
+  assert sorted(p.name for p in tmp_path.iterdir()) == ['log_2020-01-01.log',
+                                                        *names[2:]]
+  # the newest profile is always kept
+  assert profiler.remove_old_profiles(0) == 1
+  assert (tmp_path / names[-1]).exists()
+
+  # new profiles make room by themselves
+  monkeypatch.setattr(cfg, 'PROFILER_KEEP', 1)
+  profiler.start_profiler(duration=0, interval=0.01)
+  profiler.thread.join()
+  assert [p.name for p in tmp_path.glob('profile_*')] == [
+    profiler.last_profile[len(str(tmp_path)) + 1:]]
+# ------------------------------------------------------------------------------
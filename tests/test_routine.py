@@ -77,6 +77,55 @@ def test_tomorrow_prod():
   assert count >= 8  # correct timestamp at least 80% of the time
 
 
+def test_quiet_hour_configured():
+  cfg.MAINTENANCE_WINDOW = 3
+  assert routine.quiet_hour() == 3
+  cfg.MAINTENANCE_WINDOW = None
+
+
+def test_quiet_hour_activity():
+  import datetime as dt
+  cfg.MAINTENANCE_WINDOW = None
+  cfg.DATABASE_FILE_LOCATION = ':memory:'
+  database.initialize_connection()
+  database.create_tables()
+
+  # kiosk in use every hour of the day, except for 02:00 - 02:59
+  yesterday = dt.date.today() - dt.timedelta(days=1)
+  timestamps = [dt.datetime.combine(yesterday, dt.time(h, 30)).timestamp()
+                for h in range(24) if h != 2]
+  database.db_connection.executemany(
+    'INSERT INTO transactions(nfc_id, transaction_time) VALUES (?, ?)',
+    [('A', t) for t in timestamps])
+
+  hour = routine.quiet_hour()
+
+  database.close_connection()
+
+  assert hour == 2
+
+
+def test_quiet_hour_no_database():
+  cfg.MAINTENANCE_WINDOW = None
+  assert routine.quiet_hour() == 0
+
+
+def test_next_maintenance_window():
+  import datetime as dt
+  from time import time
+  cfg.DEBUG = False
+  now = dt.datetime.now()
+
+  for offset in (-1, 1):
+    cfg.MAINTENANCE_WINDOW = (now.hour + offset) % 24
+    window = dt.datetime.fromtimestamp(routine.next_maintenance_window())
+    assert window.hour == cfg.MAINTENANCE_WINDOW
+    assert window.minute == 1
+    assert 0 < window.timestamp() - time() <= 24 * 60 * 60
+
+  cfg.MAINTENANCE_WINDOW = None
+
+
 def test_get_formatted_days_elapsed_0():
   from datetime import date
   cfg.DATE_FORMAT = "%Y-%m-%d"
@@ -144,6 +193,129 @@ def test_remove_backups():
   assert not exists(path_list[3])
 
 
+@pytest.fixture
+def retention_files():
+  from datetime import date, timedelta
+  from os import remove, scandir
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  cfg.BACKUP_FILENAME_TEMPLATE = 'retention_${date}.db'
+  cfg.BACKUP_FILEPATH_TEMPLATE = 'tests/scratch/${filename}'
+  cfg.DATE_FORMAT = "%Y-%m-%d"
+
+  def create_files(days, size=0):
+    '''create one file for each of the last `days` days, return the dates'''
+    dates = [date.today() - timedelta(days=i) for i in range(days)]
+    for d in dates:
+      with open(backup_filepath(backup_filename(d.strftime('%Y-%m-%d'))),
+                'wb') as f:
+        f.write(b'0' * size)
+    return dates
+
+  def remaining_dates():
+    with scandir('tests/scratch') as scan:
+      return {date.fromisoformat(e.name[len('retention_'):-len('.db')])
+              for e in scan if e.name.startswith('retention_')}
+
+  yield create_files, remaining_dates
+
+  with scandir('tests/scratch') as scan:
+    for e in scan:
+      if e.name.startswith('retention_'):
+        remove(e.path)
+
+  cfg.BACKUP_FILENAME_TEMPLATE = 'backup_${date}.db'
+
+
+def test_retention_sweep_gfs(retention_files):
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  create_files, remaining_dates = retention_files
+  dates = create_files(120)
+
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=2,
+                          keep_weeks=3, keep_months=2)
+
+  expected = set(dates[:3])
+  expected |= {max(d for d in dates if d.isocalendar()[:2] == w)
+                for w in sorted({d.isocalendar()[:2] for d in dates})[-3:]}
+  expected |= {max(d for d in dates if (d.year, d.month) == m)
+                for m in sorted({(d.year, d.month) for d in dates})[-2:]}
+
+  assert remaining_dates() == expected
+
+
+def test_retention_sweep_size_limit(retention_files):
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  create_files, remaining_dates = retention_files
+  dates = create_files(5, size=1024 * 1024)
+
+  freed = routine.retention_sweep(backup_filename, backup_filepath,
+                                  keep_days=10, size_limit_mb=2.5)
+
+  assert remaining_dates() == set(dates[:2])
+  assert freed == 3 * 1024 * 1024
+
+  # the newest file is kept even if it exceeds the limit on its own
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=10,
+                          size_limit_mb=0)
+  assert remaining_dates() == set(dates[:1])
+
+
+def test_retention_sweep_mtime_fallback(retention_files):
+  from os import utime
+  from os.path import exists
+  from time import time
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  undated = backup_filepath(backup_filename('undated'))
+  old = backup_filepath(backup_filename('old'))
+  for path in (undated, old):
+    open(path, 'a').close()
+  utime(old, (time() - 10 * 24 * 60 * 60, ) * 2)
+
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=2)
+
+  assert exists(undated)
+  assert not exists(old)
+
+
+def test_retention_sweep_compressed(retention_files):
+  from datetime import date, timedelta
+  from os.path import exists
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  recent = backup_filepath(backup_filename(date.today().isoformat())) + '.gz'
+  old = backup_filepath(backup_filename(
+    (date.today() - timedelta(days=10)).isoformat())) + '.gz'
+  for path in (recent, old):
+    open(path, 'a').close()
+
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=2)
+
+  assert exists(recent)
+  assert not exists(old)
+
+
+def test_retention_sweep_undated_template(retention_files):
+  from os import utime
+  from os.path import exists
+  from time import time
+  from werkzeugverleih.template_string import backup_filename, backup_filepath
+  cfg.BACKUP_FILENAME_TEMPLATE = 'retention_latest.db'
+  latest = backup_filepath(backup_filename('unused'))
+  other = latest + '-journal'
+  for path in (latest, other):
+    open(path, 'a').close()
+
+  # recent by modification time
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=2)
+  assert exists(latest)
+
+  utime(latest, (time() - 10 * 24 * 60 * 60, ) * 2)
+  utime(other, (time() - 10 * 24 * 60 * 60, ) * 2)
+  routine.retention_sweep(backup_filename, backup_filepath, keep_days=2)
+  assert not exists(latest)
+  # only the exact filename matches
+  assert exists(other)
+
+
 def test_remove_inactive_users():
   cfg.INACTIVITY_LIMIT_DAYS = 1
   cfg.DATABASE_FILE_LOCATION = ':memory:'
@@ -199,51 +371,203 @@ def test_remove_old_logs():
   assert not exists(path_list[3])
 
 
-def test_daily_job():
-  assert routine.daily_event is None
+def test_run_maintenance_jobs():
+  # no active session, nothing gets deferred
+  routine.last_activity = 0
+  cfg.DATABASE_FILE_LOCATION = ':memory:'
+  database.initialize_connection()
+  database.create_tables()
+
+  results = routine.run_maintenance_jobs()
+
+  status_list = database.get_maintenance_status()
+
+  database.close_connection()
+
+  assert results == {
+    'backup_db': 'success',
+    'remove_backups': 'success',
+    'remove_inactive_users': 'success',
+    'remove_old_logs': 'success'
+  }
+  assert {s['name'] for s in status_list} == set(results)
+  assert all(s['last_success'] is not None for s in status_list)
+
+
+@pytest.fixture
+def mock_maintenance_jobs():
+  original_jobs = routine.maintenance_jobs
+  original_results = routine.maintenance_results
+  routine.maintenance_jobs = {}
+  routine.maintenance_results = {}
 
   cfg.DATABASE_FILE_LOCATION = ':memory:'
   database.initialize_connection()
   database.create_tables()
 
-  routine.daily_job()
+  yield
 
   database.close_connection()
 
-  assert routine.daily_event is not None
-  # cleanup
-  routine.scheduler.cancel(routine.daily_event)
-  routine.daily_event = None
+  routine.maintenance_jobs = original_jobs
+  routine.maintenance_results = original_results
+
 
+def test_run_maintenance_job_isolation(mock_maintenance_jobs):
+  def failing_job():
+    raise OSError('disk full')
+
+  routine.register_maintenance_job('first', failing_job)
+  routine.register_maintenance_job('second', lambda: 3, unit='rows')
+  routine.register_maintenance_job('third', lambda: 1,
+                                    depends_on=['first'])
+
+  results = routine.run_maintenance_jobs()
+
+  assert results == {'first': 'failed', 'second': 'success',
+                      'third': 'skipped'}
+
+  status = {s['name']: s for s in database.get_maintenance_status()}
+  assert 'disk full' in status['first']['message']
+  assert status['first']['last_success'] is None
+  assert status['second']['affected'] == 3
+  assert status['second']['unit'] == 'rows'
+  assert 'first' in status['third']['message']
+
+
+def test_run_maintenance_job_time_budget(mock_maintenance_jobs):
+  from time import sleep
+  routine.register_maintenance_job('slow', lambda: sleep(0.02),
+                                    time_budget=0.01)
+
+  assert routine.run_maintenance_job('slow') == 'success'
+
+  status = database.get_maintenance_status()[0]
+  assert status['duration'] >= 0.02
+  assert 'time budget' in status['message']
+
+
+def test_run_maintenance_job_no_database(mock_maintenance_jobs):
+  database.close_connection()
+  routine.register_maintenance_job('job', lambda: 1)
+
+  # failing to record the status doesn't affect the job itself
+  assert routine.run_maintenance_job('job') == 'success'
+  database.initialize_connection()
+
+
+def test_run_maintenance_job_deferred(mock_maintenance_jobs):
+  from time import time
+  cfg.MAINTENANCE_IDLE_SECONDS = 60
+  cfg.MAINTENANCE_DEFER_SECONDS = 120
 
-def test_daily_schedule():
-  original_daily_job = routine.daily_job
-  original_tomorrow = routine.tomorrow
+  routine.register_maintenance_job('heavy', lambda: 1, heavy=True)
+  routine.register_maintenance_job('dependent', lambda: 1,
+                                    depends_on=['heavy'])
+  routine.register_maintenance_job('light', lambda: 1)
 
-  def mock_daily_job():
+  routine.register_activity()
+  assert routine.session_active()
+
+  results = routine.run_maintenance_jobs()
+  assert results == {'heavy': 'deferred', 'dependent': 'deferred',
+                      'light': 'success'}
+
+  # deferred jobs are retried after MAINTENANCE_DEFER_SECONDS
+  for name in ('heavy', 'dependent'):
+    assert abs(routine.jobs[name].time - (time() + 120)) < 5
+
+  routine.last_activity = 0
+  assert not routine.session_active()
+
+  results = routine.run_maintenance_jobs()
+  assert results == {'heavy': 'success', 'dependent': 'success',
+                      'light': 'success'}
+
+  routine.cancel_all_jobs()
+
+
+def test_register_maintenance_job_priority(mock_maintenance_jobs):
+  routine.register_maintenance_job('a', lambda: 1)
+  routine.register_maintenance_job('b', lambda: 1, depends_on=['a'])
+  routine.register_maintenance_job('c', lambda: 1, depends_on=['a', 'b'])
+
+  assert routine.maintenance_jobs['a']['depth'] == 0
+  assert routine.maintenance_jobs['b']['depth'] == 1
+  assert routine.maintenance_jobs['c']['depth'] == 2
+
+  with pytest.raises(ValueError):
+    routine.register_maintenance_job('d', lambda: 1, depends_on=['unknown'])
+
+  routine.schedule_maintenance_jobs()
+  order = [e.priority for e in routine.scheduler.queue]
+  assert sorted(order) == [0, 1, 2]
+  routine.cancel_all_jobs()
+
+
+def test_schedule_job():
+  assert 'test_job' not in routine.jobs
+
+  routine.schedule_job('test_job', lambda: None, routine.tomorrow)
+  assert routine.jobs['test_job'] in routine.scheduler.queue
+
+  # rescheduling replaces the old event
+  old_event = routine.jobs['test_job']
+  routine.schedule_job('test_job', lambda: None, routine.every(60))
+  assert old_event not in routine.scheduler.queue
+  assert len(routine.scheduler.queue) == 1
+
+  routine.cancel_job('test_job')
+  assert 'test_job' not in routine.jobs
+  assert routine.scheduler.empty()
+
+  # cancelling twice fails silently
+  routine.cancel_job('test_job')
+
+
+def test_schedule_job_reschedules():
+  runs = []
+
+  def mock_job():
+    runs.append(1)
+    if len(runs) == 3:
+      routine.keep_running = False
+
+  routine.keep_running = True
+  routine.schedule_job('test_job', mock_job, routine.every(0.01))
+  routine.scheduler.run(blocking=True)
+
+  assert len(runs) == 3
+  assert routine.scheduler.empty()
+  routine.keep_running = True
+
+
+@pytest.fixture
+def mock_schedule_maintenance_jobs():
+  original_schedule_maintenance_jobs = routine.schedule_maintenance_jobs
+
+  def mock_job():
     routine.keep_running = False
 
-  def mock_tomorrow():
+  def mock_schedule():
     from datetime import datetime, timedelta
     return (datetime.now() + timedelta(seconds=1)).timestamp()
 
-  routine.daily_job = mock_daily_job
-  routine.tomorrow = mock_tomorrow
+  routine.schedule_maintenance_jobs = (
+    lambda: routine.schedule_job('mock_job', mock_job, mock_schedule))
 
-  routine.daily_schedule()
-
-  routine.daily_job = original_daily_job
-  routine.tomorrow = original_tomorrow
+  yield
 
+  routine.schedule_maintenance_jobs = original_schedule_maintenance_jobs
+  routine.keep_running = True
 
-def test_start_stop_routine():
-  original_daily_job = routine.daily_job
 
-  def mock_daily_job():
-    routine.keep_running = False
+def test_daily_schedule(mock_schedule_maintenance_jobs):
+  routine.daily_schedule()
+  assert not routine.keep_running
 
-  routine.daily_job = mock_daily_job
 
+def test_start_stop_routine(mock_schedule_maintenance_jobs):
   # Start
   routine.start_routine()
   # Restart
@@ -251,7 +575,25 @@ def test_start_stop_routine():
   # Stop
   routine.stop_routine()
 
-  routine.daily_job = original_daily_job
+
+def test_stop_routine_wakes_up_immediately():
+  from time import time, sleep
+
+  routine.start_routine()
+  # new jobs wake up the sleeping thread and get picked up right away
+  ran = []
+  routine.schedule_job('test_job', lambda: ran.append(time()),
+                        lambda: time() + 0.05)
+  t_0 = time()
+  while not ran and time() - t_0 < 1:
+    sleep(0.01)
+  assert ran
+
+  t_0 = time()
+  routine.stop_routine()
+  assert not routine.routine_thread.is_alive()
+  assert time() - t_0 < 0.5
+  assert routine.scheduler.empty()
 
 
 def test_start_stop_routine_no_event():
@@ -262,7 +604,6 @@ def test_start_stop_routine_no_event():
     pass
 
   routine.daily_schedule = mock_daily_schedule
-  routine.daily_event = None
 
   # Start
   routine.start_routine()
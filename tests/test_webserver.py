@@ -18,6 +18,7 @@ import werkzeugverleih.log as log
 import werkzeugverleih.database as db
 import werkzeugverleih.webserver as webserver
 import werkzeugverleih.nfc as nfc
+import werkzeugverleih.routine as routine
 import pytest
 
 
@@ -157,23 +158,79 @@ def test_start_webserver():
   cfg.DEBUG = True
   cfg.UI_DEFAULT_LANGUAGE = 'en'
 
-  # create mock of app.run()
-  # we are not testing the Flask framework itself
-  # and pytest will use test_client() instead anyways
-  def mock_run(debug=True, use_reloader=False):
-    pass
+  # real server on a random free port, stopped from this thread
+  cfg.WEBSERVER = 'flask'
+  cfg.WEBSERVER_PORT = 0
 
-  original_run = webserver.app.run
-  webserver.app.run = mock_run
+  from threading import Thread
+  from time import sleep
+  thread = Thread(target=webserver.start_webserver)
+  thread.start()
+  while webserver.server_stop is None:
+    sleep(0.01)
 
-  webserver.start_webserver()
+  webserver.stop_webserver()
+  thread.join(timeout=5)
+  assert not thread.is_alive()
+  assert webserver.server_stop is None
 
-  webserver.app.run = original_run
+  # nothing to stop
+  webserver.stop_webserver()
 
   db.close_connection()
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def test_stop_waitress_open_connection():
+  import socket
+  from threading import Thread
+  cfg.WEBSERVER_HOST = '127.0.0.1'
+  cfg.WEBSERVER_PORT = 0
+  cfg.WEBSERVER_KEEPALIVE_TIMEOUT = 30
+
+  serve, stop = webserver.create_server('waitress')
+  thread = Thread(target=serve)
+  thread.start()
+
+  # e.g. a browser keeping the connection alive
+  port = serve.__self__.effective_port
+  connection = socket.create_connection(('127.0.0.1', port))
+  try:
+    connection.sendall(b'GET /static/none HTTP/1.1\r\nHost: kiosk\r\n\r\n')
+    assert connection.recv(1024).startswith(b'HTTP/1.1')
+
+    stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+  finally:
+    connection.close()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_create_server():
+  import sys
+  cfg.WEBSERVER_PORT = 0
+
+  # servers that aren't installed fall back to the development server
+  modules = ('waitress', 'cheroot', 'uvicorn')
+  original_modules = {m: sys.modules.get(m) for m in modules}
+  sys.modules.update({m: None for m in modules})
+  try:
+    for kind in ('waitress', 'cheroot', 'uvicorn', 'unknown', 'flask'):
+      serve, stop = webserver.create_server(kind)
+      assert serve.__name__ == 'serve_forever'
+      serve.__self__.server_close()
+  finally:
+    for module, original in original_modules.items():
+      if original is None:
+        sys.modules.pop(module)
+      else:
+        sys.modules[module] = original
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def test_get_nfc_id(fixture_tag_id):
   client = fixture_tag_id
@@ -514,8 +571,11 @@ def test_register_user(fixture_add_user):
 
 # ------------------------------------------------------------------------------
 def test_video_feed(client):
+  routine.last_activity = 0
   response = client.get('/video-feed')
   assert 'multipart/x-mixed-replace' in response.mimetype
+  # passive viewers don't keep the kiosk busy
+  assert routine.last_activity == 0
 # ------------------------------------------------------------------------------
 
 
@@ -722,6 +782,7 @@ def test_admin_overview(fixture_tag_id):
   assert 'Admin Menü'.encode() in response.data
   assert ('Benutzer verwalten'.encode()
           in response.data)
+  assert 'Wartungsaufgabe'.encode() in response.data
   client.get('/clear-nfc-cache')
 
   webserver.UI_LANGUAGE = 'en'
@@ -729,10 +790,83 @@ def test_admin_overview(fixture_tag_id):
   assert 'Admin menu'.encode() in response.data
   assert ('Manage users'.encode()
           in response.data)
+  assert 'Maintenance job'.encode() in response.data
   client.get('/clear-nfc-cache')
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def test_admin_metrics(fixture_tag_id):
+  client = fixture_tag_id
+  url = '/admin/metrics'
+
+  helper_admin_privileges(client, url, method='get')
+
+  nfc.get_tag_id = mock_get_tag_id_Admin
+
+  client.get('/admin', follow_redirects=True)
+
+  webserver.UI_LANGUAGE = 'de'
+  response = client.get(url, follow_redirects=True)
+  assert 'Admin - Messwerte'.encode() in response.data
+  client.get('/clear-nfc-cache')
+
+  webserver.UI_LANGUAGE = 'en'
+  response = client.get(url, follow_redirects=True)
+  assert 'Admin - Metrics'.encode() in response.data
+  # previous requests, their database access and rendering got measured
+  assert b'/admin' in response.data
+  assert b'db_hold' in response.data
+  assert b'db_wait' in response.data
+  assert b'admin_overview.html' in response.data
+  client.get('/clear-nfc-cache')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_admin_metrics_profiler(fixture_tag_id):
+  import werkzeugverleih.profiler as profiler
+  client = fixture_tag_id
+  url = '/admin/metrics'
+
+  nfc.get_tag_id = mock_get_tag_id_Admin
+
+  response = client.post(url, data={'profile_seconds': 'invalid'},
+                         follow_redirects=True)
+  assert b'Profiler running' in response.data
+  profiler.stop_profiler()
+
+  response = client.get(url, follow_redirects=True)
+  assert b'Start profiler' in response.data
+  assert b'Latest profile' in response.data
+  client.get('/clear-nfc-cache')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def test_prometheus_metrics(client):
+  db.add_transaction('USER', b'IMAGE')
+  client.get('/index')
+
+  response = client.get('/metrics')
+  assert response.status_code == 200
+  assert response.mimetype == 'text/plain'
+  assert (b'werkzeugverleih_request_duration_seconds_count{route="/index"}'
+          in response.data)
+  assert b'werkzeugverleih_open_transactions 1\n' in response.data
+  assert b'werkzeugverleih_camera_active' in response.data
+  assert b'werkzeugverleih_db_lock_wait_seconds_bucket' in response.data
+
+  cfg.DB_LOCK_DIAGNOSTICS = True
+  db.add_transaction('USER', b'IMAGE')
+  response = client.get('/metrics')
+  assert (b'werkzeugverleih_db_lock_hold_max_seconds'
+          b'{function="add_transaction"}' in response.data)
+  cfg.DB_LOCK_DIAGNOSTICS = False
+  db.lock_statistics.clear()
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def test_admin_manage_users(fixture_tag_id):
   client = fixture_tag_id
@@ -0,0 +1,225 @@
+"""
+name:
+  Werkzeugverleih ASGI Application
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Asynchronous entry point for ASGI servers (e.g. uvicorn).
+  Serves the video stream with one coroutine per viewer, all other requests
+  are passed on to the Flask app.
+dependencies:
+  asgiref (optional, required for all requests except the video stream)
+"""
+
+
+# intra-package imports --------------------------------------------------------
+import werkzeugverleih.config as cfg
+import werkzeugverleih.camera as cam
+import werkzeugverleih.display as display
+import werkzeugverleih.metrics as metrics
+import werkzeugverleih.lifecycle as lifecycle
+from werkzeugverleih.log import log
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+# ------------------------------------------------------------------------------
+
+
+# FRAME BROADCAST ==============================================================
+# a single producer task fetches frames from the camera while there are
+# viewers, every viewer awaits the next frame instead of polling on its own
+latest_frame = b''
+frame_sequence = 0  # increased with every new frame
+viewers = 0
+frame_condition = None  # asyncio.Condition, bound to the running event loop
+producer_task = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_frame_condition() -> asyncio.Condition:
+  '''condition notified on new frames, created on first use inside the
+  event loop'''
+  global frame_condition
+  if frame_condition is None:
+    frame_condition = asyncio.Condition()
+  return frame_condition
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_jpeg() -> bytes:
+  '''camera frame, runs in a worker thread since the camera may block while
+  starting up'''
+  with metrics.timed('camera', 'get_jpeg'):
+    return cam.get_jpeg()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def produce_frames() -> None:
+  '''producer task, publish a new camera frame `cfg.STREAM_FRAMERATE` times
+  per second as long as there are viewers'''
+  global latest_frame, frame_sequence, producer_task
+  loop = asyncio.get_running_loop()
+  condition = get_frame_condition()
+
+  try:
+    while viewers > 0:
+      if display.screen_blanked():
+        # nobody is looking, lets the camera and the browsers idle
+        await asyncio.sleep(1)
+        continue
+      frame = await loop.run_in_executor(None, get_jpeg)
+
+      async with condition:
+        latest_frame = frame or b''
+        frame_sequence += 1
+        condition.notify_all()
+
+      await asyncio.sleep(1 / cfg.STREAM_FRAMERATE)
+  finally:
+    producer_task = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def next_frame(last_sequence: int) -> Tuple[int, bytes]:
+  '''wait for a frame newer than `last_sequence`, returns
+  `(sequence, frame)`'''
+  global producer_task
+  if producer_task is None:
+    producer_task = asyncio.ensure_future(produce_frames())
+
+  condition = get_frame_condition()
+  async with condition:
+    await condition.wait_for(lambda: frame_sequence != last_sequence)
+    return frame_sequence, latest_frame
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+SHUTDOWN_CHECK_INTERVAL = 0.5  # seconds, shutting_down is a threading.Event
+async def next_frame_or_stop(
+    last_sequence: int,
+    disconnected: asyncio.Future
+  ) -> Optional[Tuple[int, bytes]]:
+  '''like `next_frame()`, but returns None as soon as `disconnected` is done
+  or the shutdown begins, no new frames arrive while the screen is blanked'''
+  frame = asyncio.ensure_future(next_frame(last_sequence))
+  try:
+    while not lifecycle.shutting_down.is_set():
+      await asyncio.wait({frame, disconnected},
+                         timeout=SHUTDOWN_CHECK_INTERVAL,
+                         return_when=asyncio.FIRST_COMPLETED)
+      if disconnected.done():
+        return None
+      if frame.done():
+        return frame.result()
+    return None
+  finally:
+    frame.cancel()
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# ASGI APPLICATION =============================================================
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def video_stream(scope: Scope, receive: Receive, send: Send) -> None:
+  '''motion jpeg video stream, same format as webserver.video_feed(), ends
+  when the client disconnects or the application shuts down'''
+  global viewers
+  # no logging per frame, messages would be added STREAM_FRAMERATE times per
+  # second
+  # watching the stream doesn't count as activity, the kiosk shows it to
+  # passive viewers as well, see webserver.register_activity()
+
+  async def wait_for_disconnect():
+    while (await receive())['type'] != 'http.disconnect':
+      pass
+
+  disconnected = asyncio.ensure_future(wait_for_disconnect())
+
+  await send({ 'type': 'http.response.start',
+               'status': 200,
+               'headers': [(b'content-type',
+                            b'multipart/x-mixed-replace; boundary=frame')] })
+
+  viewers += 1
+  log('asgi.video_stream(): viewer connected, %s viewer(s)', viewers,
+      level='debug')
+  try:
+    sequence = 0
+    while True:
+      update = await next_frame_or_stop(sequence, disconnected)
+      if update is None:
+        break
+      sequence, frame = update
+      await send({ 'type': 'http.response.body',
+                   'body': (b'--frame\r\n'
+                            b'Content-Type: image/jpeg\r\n\r\n' + frame +
+                            b'\r\n'),
+                   'more_body': True })
+      metrics.increment('camera_frames_sent')
+  finally:
+    viewers -= 1
+    disconnected.cancel()
+    log('asgi.video_stream(): viewer disconnected, %s viewer(s)', viewers,
+        level='debug')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+flask_application = None
+def get_flask_application() -> Callable[[Scope, Receive, Send], Awaitable]:
+  '''the Flask app wrapped as ASGI application, requests are handled in
+  worker threads'''
+  global flask_application
+  if flask_application is None:
+    from asgiref.wsgi import WsgiToAsgi
+    from werkzeugverleih.webserver import app
+    flask_application = WsgiToAsgi(app)
+  return flask_application
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def lifespan(scope: Scope, receive: Receive, send: Send) -> None:
+  '''acknowledge startup and shutdown of the ASGI server'''
+  while True:
+    message = await receive()
+    if message['type'] == 'lifespan.startup':
+      await send({'type': 'lifespan.startup.complete'})
+    elif message['type'] == 'lifespan.shutdown':
+      await send({'type': 'lifespan.shutdown.complete'})
+      return
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+async def application(scope: Scope, receive: Receive, send: Send) -> None:
+  '''ASGI entry point, dispatches the video stream to `video_stream()` and
+  everything else to the Flask app'''
+  if scope['type'] == 'lifespan':
+    await lifespan(scope, receive, send)
+
+  elif scope['type'] == 'http' and scope['path'] == '/video-feed':
+    await video_stream(scope, receive, send)
+
+  else:
+    await get_flask_application()(scope, receive, send)
+# ------------------------------------------------------------------------------
+# ==============================================================================
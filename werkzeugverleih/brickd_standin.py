@@ -0,0 +1,262 @@
+"""
+name:
+  Werkzeugverleih brickd Stand-in
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Minimal TCP server speaking the Tinkerforge protocol in place of brickd,
+  with a single simulated NFC Bricklet (see nfc_simulator) attached.
+  Lets the unmodified tinkerforge bindings run on machines without hardware:
+  `python -m werkzeugverleih.brickd_standin --script script.json`
+  Only the functions used by the nfc module are implemented.
+dependencies:
+  -
+"""
+
+
+# intra-package imports --------------------------------------------------------
+import werkzeugverleih.config as cfg
+from werkzeugverleih.log import log
+from werkzeugverleih.nfc_simulator import SimulatedReader, load_script
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+from typing import Tuple
+# ------------------------------------------------------------------------------
+
+
+# PROTOCOL =====================================================================
+import struct
+HEADER = struct.Struct('<IBBBB')  # uid, length, function id, options, flags
+BASE58 = '123456789abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ'
+
+DEVICE_IDENTIFIER_NFC = 286
+FUNCTION_SET_MODE = 1
+FUNCTION_GET_MODE = 2
+FUNCTION_READER_REQUEST_TAG_ID = 3
+FUNCTION_READER_GET_TAG_ID_LOW_LEVEL = 4
+FUNCTION_READER_GET_STATE = 5
+FUNCTION_ENUMERATE = 254
+FUNCTION_GET_IDENTITY = 255
+CALLBACK_ENUMERATE = 253
+CALLBACK_READER_STATE_CHANGED = 13
+
+ERROR_FUNCTION_NOT_SUPPORTED = 2
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def base58_decode(uid: str) -> int:
+  '''numeric uid of a Tinkerforge uid string, e.g. `PMv`'''
+  value = 0
+  for character in uid:
+    value = value * 58 + BASE58.index(character)
+  return value
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def packet(uid: int, function_id: int, payload: bytes = b'',
+           sequence: int = 0, flags: int = 0) -> bytes:
+  '''complete packet with header, `sequence` 0 marks callbacks'''
+  options = (sequence << 4) | (0b1000 if sequence else 0)
+  return HEADER.pack(uid, HEADER.size + len(payload), function_id, options,
+                     flags) + payload
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# SERVER =======================================================================
+import socketserver
+from threading import Lock, Thread
+# ------------------------------------------------------------------------------
+class BrickdStandIn(socketserver.ThreadingTCPServer):
+  '''brickd replacement, one simulated NFC Bricklet with uid `nfc_uid`
+
+  arguments:
+  + `address` -- `(host, port)`, port 0 picks a free port
+  + `reader` -- SimulatedReader, created if not given
+  + `nfc_uid` -- string, defaults to `cfg.NFC_BRICKLET_UID`
+  '''
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(
+      self,
+      address: Tuple[str, int],
+      reader: SimulatedReader = None,
+      nfc_uid: str = None
+    ) -> None:
+    super().__init__(address, ConnectionHandler)
+    self.nfc_uid = nfc_uid or cfg.NFC_BRICKLET_UID
+    self.uid = base58_decode(self.nfc_uid)
+    self.reader = reader or SimulatedReader()
+    self.mode = 0
+    self.state = (self.reader.READER_STATE_IDLE, True)
+    self.clients = []
+    self.clients_lock = Lock()
+    self.thread = None
+    self.reader.register_callback(self.reader.CALLBACK_READER_STATE_CHANGED,
+                                  self.reader_state_changed)
+
+  def reader_state_changed(self, state: int, idle: bool) -> None:
+    '''forward reader states as callbacks to all connected clients'''
+    self.state = (state, idle)
+    self.broadcast(packet(self.uid, CALLBACK_READER_STATE_CHANGED,
+                          struct.pack('<B?', state, idle)))
+
+  def broadcast(self, data: bytes) -> None:
+    with self.clients_lock:
+      clients = list(self.clients)
+    for client in clients:
+      client.send(data)
+
+  def identity(self) -> bytes:
+    '''uid, connected uid, position, hardware and firmware version, device
+    identifier'''
+    return struct.pack('<8s8sc3B3BH', self.nfc_uid.encode(), b'0', b'a',
+                       1, 0, 0, 2, 0, 0, DEVICE_IDENTIFIER_NFC)
+
+  def call(self, function_id: int, payload: bytes) -> bytes:
+    '''run a function of the simulated bricklet, returns the response
+    payload, None for unsupported functions'''
+    if function_id == FUNCTION_SET_MODE:
+      self.mode = payload[0]
+      self.reader.set_mode(self.mode)
+      return b''
+    if function_id == FUNCTION_GET_MODE:
+      return struct.pack('<B', self.mode)
+    if function_id == FUNCTION_READER_REQUEST_TAG_ID:
+      self.reader.reader_request_tag_id()
+      return b''
+    if function_id == FUNCTION_READER_GET_TAG_ID_LOW_LEVEL:
+      tag = self.reader.reader_get_tag_id()
+      data = bytes(tag.tag_id).ljust(32, b'\0')
+      return struct.pack('<BB', tag.tag_type, len(tag.tag_id)) + data
+    if function_id == FUNCTION_READER_GET_STATE:
+      return struct.pack('<B?', *self.state)
+    if function_id == FUNCTION_GET_IDENTITY:
+      return self.identity()
+    return None
+
+  def start(self) -> None:
+    '''serve in a background thread'''
+    self.thread = Thread(target=self.serve_forever, name='brickd stand-in',
+                         daemon=True)
+    self.thread.start()
+
+  def stop(self) -> None:
+    self.shutdown()
+    self.server_close()
+    self.reader.stop()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class ConnectionHandler(socketserver.BaseRequestHandler):
+  '''one client connection, e.g. an IPConnection of the tinkerforge
+  bindings'''
+  def setup(self) -> None:
+    self.send_lock = Lock()
+    with self.server.clients_lock:
+      self.server.clients.append(self)
+
+  def finish(self) -> None:
+    with self.server.clients_lock:
+      self.server.clients.remove(self)
+
+  def send(self, data: bytes) -> None:
+    try:
+      with self.send_lock:
+        self.request.sendall(data)
+    except OSError:
+      pass  # client gone, finish() removes it
+
+  def receive(self, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+      chunk = self.request.recv(size - len(data))
+      if not chunk:
+        raise ConnectionError
+      data += chunk
+    return data
+
+  def handle(self) -> None:
+    server = self.server
+    try:
+      while True:
+        uid, length, function_id, options, _ = HEADER.unpack(
+          self.receive(HEADER.size))
+        payload = self.receive(length - HEADER.size)
+        sequence = options >> 4
+        response_expected = options & 0b1000
+
+        if uid == 0 and function_id == FUNCTION_ENUMERATE:
+          # enumeration type 0: available
+          self.send(packet(server.uid, CALLBACK_ENUMERATE,
+                           server.identity() + b'\0'))
+          if response_expected:
+            self.send(packet(0, function_id, sequence=sequence))
+          continue
+
+        if uid != server.uid:
+          continue  # e.g. disconnect probes, other devices
+
+        response = server.call(function_id, payload)
+        if not response_expected:
+          continue
+        if response is None:
+          self.send(packet(uid, function_id, sequence=sequence,
+                           flags=ERROR_FUNCTION_NOT_SUPPORTED << 6))
+        else:
+          self.send(packet(uid, function_id, response, sequence=sequence))
+
+    except (ConnectionError, OSError):
+      pass
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+  '''run the stand-in on `BRICKD_HOST:BRICKD_PORT` until interrupted'''
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description='brickd stand-in with a simulated NFC '
+                                      'Bricklet')
+  parser.add_argument('--host', default=cfg.BRICKD_HOST)
+  parser.add_argument('--port', type=int, default=cfg.BRICKD_PORT)
+  parser.add_argument('--uid', default=cfg.NFC_BRICKLET_UID)
+  parser.add_argument('--script', default=cfg.NFC_SIMULATOR_SCRIPT,
+                      help='json file with tag sequence, see nfc_simulator')
+  arguments = parser.parse_args()
+
+  from werkzeugverleih.log import initialize_logger
+  initialize_logger(cfg.LOG_LEVEL)
+  server = BrickdStandIn((arguments.host, arguments.port),
+                         nfc_uid=arguments.uid)
+  if arguments.script:
+    server.reader.run_script(load_script(arguments.script), repeat=True)
+
+  log('brickd_standin.main(): serving on %s:%s', arguments.host,
+      arguments.port, level='info')
+  print(f'brickd stand-in listening on {arguments.host}:{arguments.port}, '
+        f'NFC Bricklet uid {arguments.uid}')
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    server.reader.stop()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+  main()
+# ------------------------------------------------------------------------------
@@ -10,42 +10,55 @@ authors:
 description:
   Provides image data for the rental system.
 dependencies:
-  picamera
+  picamera (imported when the camera starts)
 """
 
 
 # intra-package imports --------------------------------------------------------
 import werkzeugverleih.config as cfg
+import werkzeugverleih.metrics as metrics
+from werkzeugverleih.log import log
 # ------------------------------------------------------------------------------
 import time
 import io
-try:
-  import picamera
-except (ModuleNotFoundError, FileNotFoundError):
-  cfg.DEBUG = True
+from importlib.util import find_spec
 from threading import Thread
 
 thread = None
 frames = None
 camera_frame = None
 last_access = 0
+stop_requested = False
+# use the test images as in DEBUG mode, without touching the config:
+# importing picamera takes a while and opens the camera libraries, so only
+# check if it's installed here, get_camera_frame() imports it
+fallback = find_spec('picamera') is None
+
+# ------------------------------------------------------------------------------
+def use_test_images():
+  '''True in DEBUG mode or if the camera can't be used at all'''
+  return cfg.DEBUG or fallback
 
 # ------------------------------------------------------------------------------
 def initialize_camera():
   '''public interface
   prerequisites before being able to capture images'''
 
-  global thread, frames
+  global thread, frames, stop_requested
 
-  if cfg.DEBUG:
-    frames = [open(f'tests/res/{f}.jpg', 'rb').read() for f in ['1', '2', '3']]
-  else:
+  if not use_test_images():
     if thread is None:
+        # a stop request may be left over if the last thread took too long
+        stop_requested = False
         thread = Thread(target=get_camera_frame)
         thread.start()
-        while camera_frame is None:
+        # thread is reset if the camera fails to start
+        while camera_frame is None and thread is not None:
             time.sleep(0.1)
 
+  if use_test_images():
+    frames = [open(f'tests/res/{f}.jpg', 'rb').read() for f in ['1', '2', '3']]
+
 # ------------------------------------------------------------------------------
 
 def get_jpeg():
@@ -60,7 +73,7 @@ def get_jpeg():
 
   last_access = time.time()
   # DEBUG
-  if cfg.DEBUG:
+  if use_test_images():
     return frames[int(time.time() * cfg.STREAM_FRAMERATE) % 3]
   else:
     return camera_frame
@@ -71,7 +84,17 @@ def get_jpeg():
 # ------------------------------------------------------------------------------
 
 def get_camera_frame():
-  global thread, camera_frame, last_access
+  global thread, camera_frame, last_access, fallback
+  try:
+    import picamera
+  except (ImportError, OSError) as e:
+    # e.g. not running on a Raspberry Pi, same fallback as without picamera,
+    # set before logging, initialize_camera() waits for it
+    fallback = True
+    thread = None
+    log('camera.get_camera_frame(): %r, using test images', e, level='error')
+    return None
+
   with picamera.PiCamera() as camera:
     camera.resolution = (1920, 1080)
     camera.hflip = True  # flips camera horizontally
@@ -82,11 +105,12 @@ def get_camera_frame():
                                           use_video_port=True):
       stream.seek(0)
       camera_frame = stream.read()
+      metrics.increment('camera_frames_produced')
 
       stream.seek(0)
       stream.truncate()
 
-      if time.time() - last_access > cfg.CAMERA_TIMEOUT:
+      if time.time() - last_access > cfg.CAMERA_TIMEOUT or stop_requested:
         break
   thread = None
 
@@ -95,6 +119,23 @@ def get_camera_frame():
 # ------------------------------------------------------------------------------
 
 
+def stop_camera(timeout=5):
+  '''public interface
+  stop capturing and release the camera, returns False if the camera thread
+  didn't finish within `timeout` seconds'''
+  global stop_requested
+  running = thread
+  if running is None:
+    return True
+
+  stop_requested = True
+  running.join(timeout)
+  # stop_requested is reset when the next thread starts, a thread that
+  # didn't finish in time still has to see it
+  return not running.is_alive()
+# ------------------------------------------------------------------------------
+
+
 # see https://github.com/miguelgrinberg/flask-video-streaming
 # especially the older and simpler verion
 # https://github.com/miguelgrinberg/flask-video-streaming/tree/v1
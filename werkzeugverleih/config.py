@@ -26,12 +26,44 @@ NFC_DEBUG_DELAY = 2  # in seconds
 
 STREAM_FRAMERATE = 30  # in Hz
 KEEP_BACKUPS_FOR_X_DAYS = 2
+KEEP_BACKUPS_FOR_X_WEEKS = 0
+KEEP_BACKUPS_FOR_X_MONTHS = 0
+BACKUP_SIZE_LIMIT_MB = None  # None = no limit
 KEEP_LOGS_FOR_X_DAYS = 14
+KEEP_LOGS_FOR_X_WEEKS = 0
+KEEP_LOGS_FOR_X_MONTHS = 0
+LOG_SIZE_LIMIT_MB = None  # None = no limit
+LOG_COMPRESS = False  # gzip log files of previous days
 
 INACTIVITY_LIMIT_DAYS = 180
 
+MAINTENANCE_WINDOW = None  # hour of day (0-23), None = derive from activity
+MAINTENANCE_ACTIVITY_DAYS = 14  # days of activity to derive the window from
+MAINTENANCE_IDLE_SECONDS = 300  # session counts as active after interaction
+MAINTENANCE_DEFER_SECONDS = 300  # retry delay for deferred heavy jobs
+
+METRICS_LOG_INTERVAL = 3600  # seconds, None = don't log timing metrics
+PROFILER_DURATION = 30  # seconds, default duration of a profile
+PROFILER_INTERVAL = 0.01  # seconds between two samples of the profiler
+PROFILER_KEEP = 5  # number of profile files kept, None = keep all
+
+WEBSERVER = 'waitress'  # 'waitress', 'cheroot', 'uvicorn' or 'flask' (debug)
+WEBSERVER_HOST = '127.0.0.1'
+WEBSERVER_PORT = 5000
+WEBSERVER_THREADS = 8  # worker threads of waitress/cheroot
+WEBSERVER_CONNECTION_LIMIT = 100  # simultaneous/queued connections
+WEBSERVER_KEEPALIVE_TIMEOUT = 30  # seconds until idle connections are closed
+
+SHUTDOWN_DRAIN_SECONDS = 5  # wait for running requests on shutdown
+SHUTDOWN_STAGE_TIMEOUT = 5  # seconds per module until shutdown moves on
+
 FLASK_CONFIG_LOCATION = 'data/flask.cfg'
 DATABASE_FILE_LOCATION = 'data/werkzeugverleih.db'
+DB_LOCK_DIAGNOSTICS = False  # record holder and statistics of the db lock
+DB_LOCK_WARN_SECONDS = 1.0  # warn about longer holds/waits of the db lock
+USER_CACHE_SIZE = 256  # users kept in memory, 0 = no cache
+LAST_ACCESS_FLUSH_INTERVAL = 300  # seconds between writes of last_access
+PREFETCH_DURATION = 30  # seconds prefetched transactions stay valid, 0 = off
 
 LOG_FILENAME_TEMPLATE = 'log_${date}.log'
 LOG_FILEPATH_TEMPLATE = 'data/logs/${filename}'
@@ -45,14 +77,26 @@ DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
 LOGGING_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
 
 LOGGING_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+LOG_JSON = False  # write JSON lines instead of LOGGING_FORMAT
 
 NFC_CACHE_DURATION = 5  # seconds
 NFC_SCAN_TIMEOUT = 3  # seconds
-NFC_POLL_INTERVALL = 0.1  # seconds
 NFC_BRICKLET_UID = "PMv"  # Individual UID of NFC-Bricklet
 BRICKD_HOST = "localhost"  # standard Host for running programm on raspberry PI
 BRICKD_PORT = 4223  # standard port for running programm on raspberry PI
 NFC_SEARCH_INTERVALL = 1  # intervall for searching for NFC-Chip
+NFC_PRESENCE_INTERVAL = 0.5  # seconds between checks if a tag is still there
+NFC_REMOVAL_GRACE_PERIOD = 5  # seconds a removed tag stays cached
+NFC_BACKEND = None  # 'tinkerforge', 'simulator' or 'file', None = by DEBUG
+NFC_SIMULATOR_DELAY = 0.05  # mean seconds until the simulator answers
+NFC_SIMULATOR_JITTER = 0.02  # standard deviation of the simulator delay
+NFC_SIMULATOR_SCRIPT = None  # json file with a tag sequence, see CONFIGURATION
+NFC_RECONNECT_DELAY = 1  # seconds after the first failed connect to brickd
+NFC_RECONNECT_MAX_DELAY = 60  # upper limit of the doubling reconnect delay
+
+DISPLAY_WAKE_METHOD = 'mouse'  # 'mouse' (pynput) or 'xset' (DPMS)
+DISPLAY_WAKE_DEBOUNCE = 10  # seconds further wake-ups are skipped
+DISPLAY_IDLE_SECONDS = 300  # blank the screen when idle, None = never
 
 CAMERA_TIMEOUT = 10  # seconds until camera shutdown if it's not needed anymore
 
@@ -18,15 +18,16 @@ dependencies:
 # intra-package imports --------------------------------------------------------
 import werkzeugverleih.config as cfg
 from werkzeugverleih.log import log
+import werkzeugverleih.metrics as metrics
 # ------------------------------------------------------------------------------
 
 
-from typing import Callable, Any, List
+from typing import Callable, Any, Dict, List
 
 
 # HELPER FUNCTIONS =============================================================
 # ------------------------------------------------------------------------------
-from time import time
+from time import time, perf_counter
 def unix_timestamp() -> int:
   '''integer, return seconds since Unix epoch (1970-01-01 00:00:00 UTC)'''
   return int(time())
@@ -37,48 +38,336 @@ def unix_timestamp() -> int:
 # THREAD SAFETY DECORATOR ======================================================
 from threading import Lock
 db_lock = Lock()
+
+# lock diagnostics, only recorded if cfg.DB_LOCK_DIAGNOSTICS is set
+lock_holder = None  # name of the function currently holding db_lock
+lock_statistics = {}  # function name -> dict, see get_lock_statistics()
+lock_statistics_lock = Lock()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def record_lock_usage(
+    name: str,
+    wait: float,
+    hold: float,
+    blocker: str
+  ) -> None:
+  '''add a single acquisition of db_lock to the lock statistics, warn about
+  holds and waits longer than `cfg.DB_LOCK_WARN_SECONDS`
+
+  arguments:
+  + `name` -- string, function that acquired the lock
+  + `wait` -- float, seconds spent waiting for the lock
+  + `hold` -- float, seconds the lock was held
+  + `blocker` -- string, function that held the lock when `name` started
+  waiting, None if the lock was free
+  '''
+  slow = hold > cfg.DB_LOCK_WARN_SECONDS
+
+  with lock_statistics_lock:
+    entry = lock_statistics.setdefault(name, { 'function': name,
+                                               'holds': 0,
+                                               'hold_total': 0.0,
+                                               'hold_max': 0.0,
+                                               'wait_total': 0.0,
+                                               'wait_caused': 0.0,
+                                               'slow_holds': 0 })
+    entry['holds'] += 1
+    entry['hold_total'] += hold
+    entry['hold_max'] = max(entry['hold_max'], hold)
+    entry['wait_total'] += wait
+    entry['slow_holds'] += slow
+
+    if blocker is not None and wait > 0:
+      blocking = lock_statistics.get(blocker)
+      if blocking is not None:
+        blocking['wait_caused'] += wait
+
+  if slow:
+    log('database.lock_and_release(): %s held the database lock for %.3f '
+        'seconds', name, hold, level='warning', event='db_lock_slow_hold',
+        function=name, duration_ms=round(hold * 1000, 1))
+
+  if wait > cfg.DB_LOCK_WARN_SECONDS:
+    log('database.lock_and_release(): %s waited %.3f seconds for the '
+        'database lock held by %s', name, wait, blocker, level='warning',
+        event='db_lock_slow_wait', function=name, holder=blocker,
+        duration_ms=round(wait * 1000, 1))
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_lock_statistics(limit: int = None) -> List[dict]:
+  '''return the lock statistics per function, functions holding the lock
+  the longest in total first
+
+  requires cfg.DB_LOCK_DIAGNOSTICS, data of a single function is stored as
+  dict, accessible via keys: `function`, `holds`, `hold_total`, `hold_max`,
+  `wait_total`, `wait_caused` (wait of other functions that found the lock
+  held by this one), `slow_holds` (longer than `cfg.DB_LOCK_WARN_SECONDS`),
+  all times in seconds
+
+  arguments:
+  + `limit` -- integer, maximum number of functions, None for all
+  '''
+  with lock_statistics_lock:
+    entries = [dict(entry) for entry in lock_statistics.values()]
+
+  entries.sort(key=lambda entry: entry['hold_total'], reverse=True)
+  return entries[:limit]
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 from functools import wraps
 def lock_and_release(func: Callable[..., Any]) -> Callable[..., Any]:
   '''wrapper for thread-safe database access,
   use as @decorator
 
+  records the time spent waiting for and holding the lock as metrics
+  `db_wait` and `db_hold`, labeled with the name of `func`, and with
+  `cfg.DB_LOCK_DIAGNOSTICS` the lock holder and per-function statistics
+  (see `record_lock_usage()`)
+
   arguments:
   + `func` -- the function to be wrapped
   '''
+  name = func.__name__
+  wait_histogram = metrics.get_histogram('db_wait', name)
+  hold_histogram = metrics.get_histogram('db_hold', name)
+
   @wraps(func)
   def wrapper(*args, **kwargs):
-    # log('database.lock_and_release(): acquiring lock on database',
-    #      level='debug')
+    global lock_holder
+    diagnostics = cfg.DB_LOCK_DIAGNOSTICS
+    # the holder at the start of the wait is blamed for all of it
+    blocker = lock_holder if diagnostics else None
+
+    start = perf_counter()
     db_lock.acquire()
+    acquired = perf_counter()
+    if diagnostics:
+      lock_holder = name
     try:
       r = func(*args, **kwargs)
     finally:
-      # log('database.lock_and_release(): releasing lock on database',
-      #      level='debug')
+      if diagnostics:
+        lock_holder = None
       db_lock.release()
+      released = perf_counter()
+      wait_histogram.observe(acquired - start)
+      hold_histogram.observe(released - acquired)
+      if diagnostics:
+        record_lock_usage(name, acquired - start, released - acquired,
+                          blocker)
     return r
   return wrapper
 # ------------------------------------------------------------------------------
 # ==============================================================================
 
 
-# DATABASE FUNCTIONS ===========================================================
+# USER CACHE ===================================================================
 import sqlite3
+from collections import OrderedDict
+# nfc_id -> user dict, least recently used first, see `cfg.USER_CACHE_SIZE`
+user_cache = OrderedDict()
+user_cache_lock = Lock()
+# increased on every change of the 'users' table, lookups that started before
+# a change must not put their (possibly outdated) result into the cache
+users_version = 0
+
+# nfc_id -> 'last_access' timestamp not yet written to the database, see
+# `write_pending_access()`
+pending_access = {}
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cached_user(nfc_id: str) -> dict:
+  '''copy of the cached user with `nfc_id` or None, marks it as recently
+  used'''
+  with user_cache_lock:
+    user = user_cache.get(nfc_id)
+    if user is None:
+      return None
+    user_cache.move_to_end(nfc_id)
+    return dict(user)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cache_user(user: dict, version: int) -> None:
+  '''put `user` into the cache, unless the 'users' table changed since
+  `version` was read, evicts the least recently used users beyond
+  `cfg.USER_CACHE_SIZE`'''
+  with user_cache_lock:
+    if version != users_version or not cfg.USER_CACHE_SIZE:
+      return
+    user_cache[user['nfc_id']] = dict(user)
+    user_cache.move_to_end(user['nfc_id'])
+    while len(user_cache) > cfg.USER_CACHE_SIZE:
+      user_cache.popitem(last=False)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def invalidate_users(nfc_ids: List[str] = None) -> None:
+  '''remove users from the cache after changes to the 'users' table
+
+  arguments:
+  + `nfc_ids` -- list of strings, None = all users
+  '''
+  global users_version
+  with user_cache_lock:
+    users_version += 1
+    if nfc_ids is None:
+      user_cache.clear()
+    else:
+      for nfc_id in nfc_ids:
+        user_cache.pop(nfc_id, None)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def register_access(nfc_id: str, timestamp: int) -> None:
+  '''remember the 'last_access' of a user for the next
+  `write_pending_access()`'''
+  with user_cache_lock:
+    pending_access[nfc_id] = timestamp
+    user = user_cache.get(nfc_id)
+    if user is not None:
+      user['last_access'] = timestamp
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def write_pending_access(c: sqlite3.Cursor) -> int:
+  '''write all remembered 'last_access' timestamps with cursor `c`,
+  the caller holds `db_lock` and commits, returns the number of users'''
+  global pending_access
+  with user_cache_lock:
+    pending, pending_access = pending_access, {}
+
+  if pending:
+    c.executemany('''UPDATE users
+                    SET last_access=?
+                    WHERE nfc_id=? AND last_access<?''',
+                  [(timestamp, nfc_id, timestamp)
+                   for nfc_id, timestamp in pending.items()])
+  return len(pending)
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# PREFETCH CACHE ===============================================================
+# nfc_id -> (expiry timestamp, list of transactions without their image),
+# filled by `prefetch()` right after a tag is scanned, images are loaded with
+# the page since a few of them would take up megabytes
+prefetched = {}
+prefetch_lock = Lock()
+# increased on every change of the 'transactions' table, a list loaded while
+# it changed may be outdated already and isn't stored
+transactions_version = 0
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def transactions_changed(
+    nfc_id: str = None,
+    transaction_id: int = None
+  ) -> None:
+  '''outdate the prefetched transactions of `nfc_id`, of the user owning
+  `transaction_id`, or of all users if neither is given'''
+  global transactions_version
+  with prefetch_lock:
+    transactions_version += 1
+    if nfc_id is not None:
+      prefetched.pop(nfc_id, None)
+    elif transaction_id is not None:
+      # ids arrive as strings from forms
+      for key in [k for k, v in prefetched.items()
+                  if any(str(t['transaction_id']) == str(transaction_id)
+                         for t in v[1])]:
+        del prefetched[key]
+    else:
+      prefetched.clear()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def prefetch(nfc_id: str) -> bool:
+  '''load the user with `nfc_id` into the user cache and their open
+  transactions into the prefetch cache for `cfg.PREFETCH_DURATION` seconds,
+  returns False for unknown users
+
+  called after NFC scans, before the user even pressed a button
+  '''
+  if not cfg.PREFETCH_DURATION:
+    return False
+
+  if cached_user(nfc_id) is None:
+    version = users_version
+    user = load_user(nfc_id)
+    if user is None:
+      return False
+    cache_user(user, version)
+
+  version = transactions_version
+  transactions = get_transaction_metadata_from_nfc_id(nfc_id)
+
+  now = time()
+  with prefetch_lock:
+    if version == transactions_version:
+      for key in [k for k, v in prefetched.items() if v[0] <= now]:
+        del prefetched[key]
+      prefetched[nfc_id] = (now + cfg.PREFETCH_DURATION, transactions)
+
+  log('database.prefetch(): %s transaction(s) for nfc_id %s',
+      len(transactions), nfc_id, level='debug')
+  return True
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_prefetched_transactions(nfc_id: str) -> List[dict]:
+  '''same as `get_transactions_from_nfc_id()`, but the list is served from
+  the prefetch cache if it was loaded recently and didn't change since, only
+  the images are loaded'''
+  with prefetch_lock:
+    entry = prefetched.get(nfc_id)
+    transactions = entry[1] if entry is not None and entry[0] > time() else None
+
+  if transactions is None:
+    metrics.increment('prefetch_misses')
+    return get_transactions_from_nfc_id(nfc_id)
+
+  metrics.increment('prefetch_hits')
+  images = get_images_from_nfc_id(nfc_id)
+  return [dict(t, image=images[t['transaction_id']]) for t in transactions
+          if t['transaction_id'] in images]
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# DATABASE FUNCTIONS ===========================================================
 db_connection = None
 # ------------------------------------------------------------------------------
 @lock_and_release
 def initialize_connection() -> None:
   '''connect to sqlite3 database located in cfg.DATABASE_FILE_LOCATION'''
 
-  log('database.initialize_connection(): to file '
-      f'{cfg.DATABASE_FILE_LOCATION}', level='debug')
+  log('database.initialize_connection(): to file %s',
+      cfg.DATABASE_FILE_LOCATION, level='debug')
 
   global db_connection
   if db_connection is None:
     db_connection = sqlite3.connect(cfg.DATABASE_FILE_LOCATION,
                                     check_same_thread=False)
     db_connection.row_factory = sqlite3.Row
+    # users and transactions cached from a previously opened database
+    invalidate_users()
+    transactions_changed()
   else:
     raise ValueError
 # ------------------------------------------------------------------------------
@@ -87,12 +376,15 @@ def initialize_connection() -> None:
 # ------------------------------------------------------------------------------
 @lock_and_release
 def close_connection() -> None:
-  '''disconnect from database and close connection, fail silently'''
+  '''disconnect from database and close connection, fail silently,
+  pending 'last_access' timestamps are written beforehand'''
 
   log('database.close_connection()', level='debug')
 
   global db_connection
   try:
+    if write_pending_access(db_connection.cursor()):
+      db_connection.commit()
     db_connection.close()
   except AttributeError:
     pass
@@ -106,15 +398,18 @@ def close_connection() -> None:
 def backup_database(backup_location: str) -> None:
   '''creates a backup of the active database in `backup_location`'''
 
-  log(f'database.backup_database(): to file "{backup_location}"',
-      level='debug')
+  log('database.backup_database(): to file "%s"',
+      backup_location, level='debug')
+
+  start = perf_counter()
 
   global db_connection
   with sqlite3.connect(backup_location) as backup_connection:
     db_connection.backup(backup_connection)
 
-  log('database.backup_database(): finished database backup to '
-      f'"{backup_location}"', level='info')
+  log('database.backup_database(): finished database backup to "%s"',
+      backup_location, level='info', event='backup',
+      duration_ms=round((perf_counter() - start) * 1000, 1))
 # ------------------------------------------------------------------------------
 
 
@@ -123,8 +418,8 @@ def backup_database(backup_location: str) -> None:
 def create_tables() -> None:
   '''ensure existance of necessary tables'''
 
-  log("database.create_tables(): 'users' and 'transactions' if missing",
-      level='debug')
+  log("database.create_tables(): 'users', 'transactions' and 'maintenance' "
+      "if missing", level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -145,6 +440,16 @@ def create_tables() -> None:
                   removal_key TEXT,
                   image BLOB)''')
 
+  c.execute( '''CREATE TABLE IF NOT EXISTS maintenance(
+                  name TEXT PRIMARY KEY NOT NULL,
+                  status TEXT,
+                  last_run INTEGER,
+                  last_success INTEGER,
+                  duration REAL,
+                  affected INTEGER,
+                  unit TEXT,
+                  message TEXT)''')
+
   db_connection.commit()
 # ------------------------------------------------------------------------------
 
@@ -171,8 +476,7 @@ def add_user(
   + `last_access` -- integer, current timestamp
   '''
 
-  log(f'database.add_user(): with data for nfc_id {nfc_id}',
-      level='debug')
+  log('database.add_user(): with data for nfc_id %s', nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -196,32 +500,58 @@ def add_user(
                   VALUES (?, ?, ?, ?, ?, ?, ?)''', params)
 
     db_connection.commit()
+    invalidate_users([nfc_id])
 
-    log('database.add_user(): successfully added user data for nfc_id '
-        f'{nfc_id}', level='info')
+    log('database.add_user(): successfully added user data for nfc_id %s',
+        nfc_id, level='info', event='user_added', nfc_id=nfc_id)
 
     return True
 
   except sqlite3.IntegrityError:
 
-    log('database.add_user(): failed to add user data for nfc_id '
-        f'{nfc_id} (IntegrityError)', level='warning')
+    log('database.add_user(): failed to add user data for nfc_id %s '
+        '(IntegrityError)', nfc_id, level='warning')
 
     return False
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-@lock_and_release
 def get_user(nfc_id: str) -> dict:
   '''search the 'users' table for row with 'nfc_id'=`nfc_id`,
   update 'last_access' of found row with current timestamp
 
+  arguments:
+  + `nfc_id` -- string, NFC ID formatted as hex string
+
+  users are served from the user cache if possible, 'last_access' is written
+  in batches, see `flush_last_access()`
+  '''
+  user = cached_user(nfc_id)
+  if user is None:
+    version = users_version
+    user = load_user(nfc_id)
+    if user is None:
+      return None
+    cache_user(user, version)
+
+  user['last_access'] = unix_timestamp()
+  register_access(nfc_id, user['last_access'])
+  return user
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@lock_and_release
+def load_user(nfc_id: str) -> dict:
+  '''row of table 'users' with 'nfc_id'=`nfc_id` as dict or None, without
+  any side effects, see `get_user()`
+
   arguments:
   + `nfc_id` -- string, NFC ID formatted as hex string
   '''
 
-  log(f'database.get_user(): data for nfc_id {nfc_id}', level='debug')
+  log('database.load_user(): data for nfc_id %s', nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -229,14 +559,6 @@ def get_user(nfc_id: str) -> dict:
   params = (nfc_id,)
 
   for row in c.execute('SELECT * FROM users WHERE nfc_id=?', params):
-
-    update_parameters = (unix_timestamp(), nfc_id)
-    c.execute( '''UPDATE users
-                  SET last_access=?
-                  WHERE nfc_id=?''', update_parameters)
-
-    db_connection.commit()
-
     return dict(zip(row.keys(), row))
 
   # no rows -> None
@@ -244,6 +566,27 @@ def get_user(nfc_id: str) -> dict:
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+@lock_and_release
+def flush_last_access() -> int:
+  '''write the 'last_access' timestamps collected by `get_user()`,
+  returns the number of users
+
+  routine job, see `cfg.LAST_ACCESS_FLUSH_INTERVAL`
+  '''
+
+  global db_connection
+  c = db_connection.cursor()
+
+  count = write_pending_access(c)
+  if count:
+    db_connection.commit()
+    log('database.flush_last_access(): %s user(s)', count, level='debug')
+
+  return count
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 @lock_and_release
 def get_users() -> List[dict]:
@@ -259,6 +602,9 @@ def get_users() -> List[dict]:
   global db_connection
   c = db_connection.cursor()
 
+  if write_pending_access(c):
+    db_connection.commit()
+
   rowlist = []
   for row in c.execute('SELECT * FROM users'):
     rowlist.append(dict(zip(row.keys(), row)))
@@ -286,8 +632,8 @@ def update_user(
   + `admin` -- bool
   '''
 
-  log(f'database.update_user(): change data for nfc_id {nfc_id}',
-      level='debug')
+  log('database.update_user(): change data for nfc_id %s',
+      nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -303,6 +649,7 @@ def update_user(
                 WHERE nfc_id=?''', params)
 
   db_connection.commit()
+  invalidate_users([nfc_id])
 # ------------------------------------------------------------------------------
 
 
@@ -316,7 +663,7 @@ def delete_user(nfc_id: str) -> int:
   + `nfc_id` -- string, NFC ID formatted as hex string
   '''
 
-  log(f'database.delete_user(): with nfc_id {nfc_id}', level='debug')
+  log('database.delete_user(): with nfc_id %s', nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -326,12 +673,14 @@ def delete_user(nfc_id: str) -> int:
   result = c.execute('DELETE FROM users WHERE nfc_id=?', params)
 
   db_connection.commit()
+  invalidate_users([nfc_id])
 
   if result.rowcount:
-    log(f'database.delete_user(): removed nfc_id {nfc_id}', level='info')
+    log('database.delete_user(): removed nfc_id %s', nfc_id, level='info',
+        event='user_deleted', nfc_id=nfc_id)
   else:
-    log(f'database.delete_user(): failed to remove nfc_id {nfc_id}',
-        level='warning')
+    log('database.delete_user(): failed to remove nfc_id %s',
+        nfc_id, level='warning')
 
   return result.rowcount
 # ------------------------------------------------------------------------------
@@ -350,12 +699,15 @@ def delete_inactive_users(inactivity_timestamp: int) -> int:
   timestamp of when a user counts as inactive
   '''
 
-  log(f'database.delete_inactive_users(): timestamps<={inactivity_timestamp}',
-      level='debug')
+  log('database.delete_inactive_users(): timestamps<=%s',
+      inactivity_timestamp, level='debug')
 
   global db_connection
   c = db_connection.cursor()
 
+  # users that were active recently must not be purged
+  write_pending_access(c)
+
   params = (inactivity_timestamp,)
 
   rowlist = []
@@ -375,9 +727,11 @@ def delete_inactive_users(inactivity_timestamp: int) -> int:
                           [(nfc_id, ) for nfc_id in nfc_list])
 
   db_connection.commit()
+  invalidate_users(nfc_list)
 
   log("database.delete_inactive_users(): removed from table 'users': "
-      f"{result.rowcount} row(s): {nfc_list}", level='info')
+      "%s row(s): %s", result.rowcount, nfc_list, level='info',
+      event='inactive_users_deleted', nfc_ids=nfc_list)
 
   return result.rowcount
 # ------------------------------------------------------------------------------
@@ -402,7 +756,7 @@ def add_transaction(nfc_id: str, image: bytes) -> dict:
   transaction
   '''
 
-  log(f'database.add_transaction(): data for nfc_id {nfc_id}', level='debug')
+  log('database.add_transaction(): data for nfc_id %s', nfc_id, level='debug')
 
   if nfc_id is None:
     log("database.add_transaction(): can't add transaction without "
@@ -410,13 +764,14 @@ def add_transaction(nfc_id: str, image: bytes) -> dict:
     return None
 
   if image is None:
-    log(f"database.add_transaction(): can't add empty image (None) for "
-        f"nfc_id {nfc_id}", level='warning')
+    log("database.add_transaction(): can't add empty image (None) for "
+        "nfc_id %s", nfc_id, level='warning')
     return None
 
   global db_connection
   c = db_connection.cursor()
 
+  start = perf_counter()
   removal_key = sha256(urandom(32)).hexdigest()
 
   try:
@@ -425,8 +780,8 @@ def add_transaction(nfc_id: str, image: bytes) -> dict:
                   removal_key,
                   sqlite3.Binary(image))
   except TypeError:
-    log(f"database.add_transaction(): invalid image data format for "
-        f"nfc_id {nfc_id}", level='warning')
+    log('database.add_transaction(): invalid image data format for nfc_id %s',
+        nfc_id, level='warning')
     return None
 
   try:
@@ -437,6 +792,7 @@ def add_transaction(nfc_id: str, image: bytes) -> dict:
     params = (c.lastrowid,)
 
     db_connection.commit()
+    transactions_changed(nfc_id=nfc_id)
 
     row = c.execute('SELECT * FROM transactions WHERE ROWID=?',
                     params).fetchone()
@@ -447,15 +803,17 @@ def add_transaction(nfc_id: str, image: bytes) -> dict:
       return None
     '''
     row_dict = dict(zip(row.keys(), row))
-    log('database.add_transaction(): added transaction with id '
-        f'{row_dict.get("transaction_id")} for '
-        f'nfc_id {row_dict.get("nfc_id")}', level='debug')
+    log('database.add_transaction(): added transaction with id %s for '
+        'nfc_id %s', row_dict.get('transaction_id'), row_dict.get('nfc_id'),
+        level='debug', event='transaction_added', nfc_id=nfc_id,
+        transaction_ids=[row_dict.get('transaction_id')],
+        duration_ms=round((perf_counter() - start) * 1000, 1))
     return row_dict.get('transaction_id')
 
   except sqlite3.InterfaceError:
 
-    log('database.add_transaction(): failed to add transaction for nfc_id '
-        f'{nfc_id} (InterfaceError)', level='warning')
+    log('database.add_transaction(): failed to add transaction for nfc_id %s '
+        '(InterfaceError)', nfc_id, level='warning')
 
     return None
 # ------------------------------------------------------------------------------
@@ -483,6 +841,19 @@ def get_transactions() -> List[dict]:
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+@lock_and_release
+def count_transactions() -> int:
+  '''return the number of transactions currently in database'''
+
+  log('database.count_transactions()', level='debug')
+
+  c = db_connection.cursor()
+
+  return c.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 @lock_and_release
 def get_transaction(transaction_id: int) -> dict:
@@ -495,8 +866,8 @@ def get_transaction(transaction_id: int) -> dict:
   + `transaction_id` -- integer, unique auto generated primary key
   '''
 
-  log(f'database.get_transaction(): data for transaction_id {transaction_id}',
-      level='debug')
+  log('database.get_transaction(): data for transaction_id %s',
+      transaction_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -526,7 +897,7 @@ def get_transactions_from_nfc_id(nfc_id: str) -> List[dict]:
   '''
 
   log('database.get_transactions_from_nfc_id(): list of transactions from '
-      f'nfc_id {nfc_id}', level='debug')
+      'nfc_id %s', nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -543,6 +914,58 @@ def get_transactions_from_nfc_id(nfc_id: str) -> List[dict]:
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+@lock_and_release
+def get_transaction_metadata_from_nfc_id(nfc_id: str) -> List[dict]:
+  '''same as `get_transactions_from_nfc_id()` without the `image` of the
+  transactions
+
+  arguments:
+  + `nfc_id` -- string, NFC ID formatted as hex string
+  '''
+
+  log('database.get_transaction_metadata_from_nfc_id(): list of transactions '
+      'from nfc_id %s', nfc_id, level='debug')
+
+  global db_connection
+  c = db_connection.cursor()
+
+  params = (nfc_id,)
+
+  rowlist = []
+  for row in c.execute('''SELECT transaction_id, nfc_id, transaction_time,
+                                 removal_key
+                          FROM transactions WHERE nfc_id=?''', params):
+
+    rowlist.append(dict(zip(row.keys(), row)))
+
+  return rowlist
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@lock_and_release
+def get_images_from_nfc_id(nfc_id: str) -> Dict[int, bytes]:
+  '''return the images of all transactions filtered by 'nfc_id'=`nfc_id`,
+  as dict `transaction_id` -> `image`
+
+  arguments:
+  + `nfc_id` -- string, NFC ID formatted as hex string
+  '''
+
+  log('database.get_images_from_nfc_id(): images of nfc_id %s', nfc_id,
+      level='debug')
+
+  global db_connection
+  c = db_connection.cursor()
+
+  params = (nfc_id,)
+
+  return dict(c.execute('''SELECT transaction_id, image FROM transactions
+                           WHERE nfc_id=?''', params))
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 @lock_and_release
 def delete_transaction(
@@ -562,8 +985,8 @@ def delete_transaction(
   transaction
   '''
 
-  log(f'database.delete_transaction(): with transaction_id {transaction_id}',
-      level='debug')
+  log('database.delete_transaction(): with transaction_id %s',
+      transaction_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -574,13 +997,15 @@ def delete_transaction(
                         WHERE transaction_id=? AND removal_key=?''', params)
 
   db_connection.commit()
+  transactions_changed(transaction_id=transaction_id)
 
   if result.rowcount:
-    log('database.delete_transaction(): removed transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.delete_transaction(): removed transaction_id %s',
+        transaction_id, level='info', event='transaction_deleted',
+        transaction_ids=[transaction_id])
   else:
-    log('database.delete_transaction(): failed to remove transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.delete_transaction(): failed to remove transaction_id %s',
+        transaction_id, level='info')
 
   return result.rowcount
 # ------------------------------------------------------------------------------
@@ -608,8 +1033,8 @@ def safe_delete_transaction(
   + `nfc_id` -- string, NFC ID formatted as hex string
   '''
 
-  log('database.safe_delete_transaction(): with transaction_id '
-      f'{transaction_id} from nfc_id {nfc_id}', level='debug')
+  log('database.safe_delete_transaction(): with transaction_id %s '
+      'from nfc_id %s', transaction_id, nfc_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -621,13 +1046,15 @@ def safe_delete_transaction(
                       params)
 
   db_connection.commit()
+  transactions_changed(nfc_id=nfc_id)
 
   if result.rowcount:
-    log('database.safe_delete_transaction(): removed transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.safe_delete_transaction(): removed transaction_id %s',
+        transaction_id, level='info', event='transaction_deleted',
+        transaction_ids=[transaction_id])
   else:
-    log('database.delete_transaction(): failed to remove transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.delete_transaction(): failed to remove transaction_id %s',
+        transaction_id, level='info')
 
   return result.rowcount
 # ------------------------------------------------------------------------------
@@ -646,8 +1073,8 @@ def unsafe_delete_transaction(transaction_id: int) -> int:
   + `transaction_id` -- integer, unique auto generated primary key
   '''
 
-  log('database.unsafe_delete_transaction(): with transaction_id '
-      f'{transaction_id}', level='debug')
+  log('database.unsafe_delete_transaction(): with transaction_id %s',
+      transaction_id, level='debug')
 
   global db_connection
   c = db_connection.cursor()
@@ -658,14 +1085,123 @@ def unsafe_delete_transaction(transaction_id: int) -> int:
                         WHERE transaction_id=?''', params)
 
   db_connection.commit()
+  transactions_changed(transaction_id=transaction_id)
 
   if result.rowcount:
-    log('database.unsafe_delete_transaction(): removed transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.unsafe_delete_transaction(): removed transaction_id %s',
+        transaction_id, level='info', event='transaction_deleted',
+        transaction_ids=[transaction_id])
   else:
-    log('database.delete_transaction(): failed to remove transaction_id '
-        f'{transaction_id}', level='info')
+    log('database.delete_transaction(): failed to remove transaction_id %s',
+        transaction_id, level='info')
 
   return result.rowcount
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@lock_and_release
+def get_activity_timestamps(since: int) -> List[int]:
+  '''return a list of all 'transaction_time' and 'last_access' timestamps
+  newer than `since`
+
+  arguments:
+  + `since` -- integer, unix timestamp of the oldest activity to include
+  '''
+
+  log('database.get_activity_timestamps(): since timestamp %s',
+      since, level='debug')
+
+  c = db_connection.cursor()
+
+  if write_pending_access(c):
+    db_connection.commit()
+
+  params = (since, since)
+
+  rows = c.execute('''SELECT transaction_time FROM transactions
+                      WHERE transaction_time>=?
+                      UNION ALL
+                      SELECT last_access FROM users
+                      WHERE last_access>=?''', params)
+
+  return [row[0] for row in rows]
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@lock_and_release
+def update_maintenance_status(
+    name: str,
+    status: str,
+    duration: float,
+    affected: int = None,
+    unit: str = '',
+    message: str = ''
+  ) -> None:
+  '''store the result of the latest run of a maintenance job in table
+  'maintenance', 'last_success' is only updated if `status` is 'success'
+
+  arguments:
+  + `name` -- string, unique name of the maintenance job
+  + `status` -- string, e.g. 'success', 'failed' or 'skipped'
+  + `duration` -- float, runtime in seconds
+  + `affected` -- integer, number of rows/bytes/files affected by the job
+  + `unit` -- string, unit of `affected`
+  + `message` -- string, additional information like error messages
+  '''
+
+  log('database.update_maintenance_status(): job %s with status %s',
+      name, status, level='debug')
+
+  c = db_connection.cursor()
+
+  now = unix_timestamp()
+  params = (name,
+                status,
+                now,
+                now if status == 'success' else None,
+                duration,
+                affected,
+                unit,
+                message)
+
+  c.execute( '''INSERT INTO maintenance
+                  (name, status, last_run, last_success, duration, affected,
+                  unit, message)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                  ON CONFLICT(name) DO UPDATE SET
+                    status=excluded.status,
+                    last_run=excluded.last_run,
+                    last_success=COALESCE(excluded.last_success, last_success),
+                    duration=excluded.duration,
+                    affected=excluded.affected,
+                    unit=excluded.unit,
+                    message=excluded.message''', params)
+
+  db_connection.commit()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@lock_and_release
+def get_maintenance_status() -> List[dict]:
+  '''return a list with the latest results of all maintenance jobs
+
+  data from a single job is stored as dict, accessible via keys:
+  `name`, `status`, `last_run`, `last_success`, `duration`, `affected`,
+  `unit`, `message`
+  '''
+
+  log('database.get_maintenance_status(): list of all maintenance jobs',
+      level='debug')
+
+  c = db_connection.cursor()
+
+  rowlist = []
+  for row in c.execute('SELECT * FROM maintenance ORDER BY name'):
+    rowlist.append(dict(zip(row.keys(), row)))
+
+  return rowlist
+# ------------------------------------------------------------------------------
 # ==============================================================================
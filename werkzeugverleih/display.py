@@ -9,21 +9,262 @@ authors:
   @ Technische Hochschule Deggendorf
 description:
   Save energy by turning off the screen when not in use!
+  Blanks the screen via DPMS (`xset`) after a period without activity on the
+  web interface or the NFC reader. Touches wake up the screen by themselves,
+  NFC scans wake it up either with a tiny mouse movement through a single
+  pynput controller or via DPMS. While the screen is blank, video streams
+  pause so the camera can shut down.
 dependencies:
-  -
+  pynput (wake method `mouse`)
+  xset (blanking, wake method `xset`)
 """
-from pynput.mouse import Controller
 
-def wake_up_screen_via_NFC():
-    mouse = Controller()
-    mouse.move(1,1)
 
+# intra-package imports --------------------------------------------------------
+import werkzeugverleih.config as cfg
+import werkzeugverleih.camera as cam
+import werkzeugverleih.metrics as metrics
+import werkzeugverleih.routine as routine
+from werkzeugverleih.log import log
 # ------------------------------------------------------------------------------
 
-# This module should handle:
-# 1. turn off screen after period of inactivity
-# 2. turn screen back on via touch event
-# 3. turn screen back on via nfc event
 
-# an alternative for 1. and 2. may be to use xscreensaver instead
-# and only handle case 3. in python with `xset s` / `xset dpms`
+# SCREEN STATE =================================================================
+from threading import Lock
+from time import monotonic, time
+screen_lock = Lock()
+screen_on = True  # the screen is on after booting the kiosk
+last_wake = None  # monotonic timestamp of the last wake-up, None = never
+blanked_at = 0.0  # unix timestamp like routine.last_activity
+wake_pending = False  # wake-up requested while the lock was held
+controller = None  # pynput mouse controller, keeps its X connection open
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_controller():
+  '''the pynput mouse controller, created on first use and kept afterwards
+  since every new controller opens its own connection to the X server'''
+  global controller
+  if controller is None:
+    # imported here, pynput connects to the X server on import already
+    from pynput.mouse import Controller
+    controller = Controller()
+  return controller
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def screen_awake() -> bool:
+  '''True if the screen is known to be on
+
+  the screen may still be blanked by the X server's own screensaver, so a
+  wake-up is only trusted for `cfg.DISPLAY_WAKE_DEBOUNCE` seconds
+  '''
+  return (screen_on and last_wake is not None and
+          monotonic() - last_wake < cfg.DISPLAY_WAKE_DEBOUNCE)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def screen_blanked() -> bool:
+  '''True while the screen is turned off due to inactivity, video streams
+  pause meanwhile'''
+  return not screen_on
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# WAKE METHODS =================================================================
+import subprocess
+# ------------------------------------------------------------------------------
+def wake_via_mouse() -> None:
+  '''move the pointer by one pixel and back, counts as user input for the
+  screensaver without moving the pointer away'''
+  mouse = get_controller()
+  mouse.move(1, 1)
+  mouse.move(-1, -1)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def wake_via_xset() -> None:
+  '''switch the monitor on via DPMS and reset the screensaver'''
+  subprocess.run(['xset', 'dpms', 'force', 'on'], check=True, timeout=5)
+  subprocess.run(['xset', 's', 'reset'], check=True, timeout=5)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# DISPLAY_WAKE_METHOD -> function waking up the screen
+WAKE_METHODS = {
+  'mouse': wake_via_mouse,
+  'xset': wake_via_xset,
+}
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# PUBLIC INTERFACE =============================================================
+# ------------------------------------------------------------------------------
+def wake_screen(reason: str = 'nfc') -> bool:
+  '''turn the screen on, no-op if it was woken up within the last
+  `cfg.DISPLAY_WAKE_DEBOUNCE` seconds
+
+  arguments:
+  + `reason` -- string, what woke up the screen, for logging only
+
+  returns True if the screen was actually woken up
+  '''
+  global wake_pending
+  if screen_awake():
+    return False
+  # repeated calls return without waiting for a running wake-up, a running
+  # blank_screen() wakes up the screen again once it's done
+  if not screen_lock.acquire(blocking=False):
+    wake_pending = True
+    return False
+
+  try:
+    return not screen_awake() and wake_locked(reason)
+  finally:
+    screen_lock.release()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def wake_locked(reason: str) -> bool:
+  '''turn the screen on, the caller holds `screen_lock`, returns True on
+  success'''
+  global screen_on, last_wake, wake_pending
+  try:
+    wake = WAKE_METHODS[cfg.DISPLAY_WAKE_METHOD]
+    with metrics.timed('display', 'wake_screen'):
+      wake()
+  except Exception as e:
+    log('display.wake_screen(): %r', e, level='error')
+    return False
+
+  screen_on = True
+  last_wake = monotonic()
+  wake_pending = False
+  metrics.increment('display_wakeups')
+  log('display.wake_screen(): woken up by %s', reason, level='debug')
+  return True
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def blank_screen() -> bool:
+  '''turn the screen off via DPMS and stop the camera, nobody is looking at
+  the stream anymore, returns True on success, False if it failed or was
+  woken up right away'''
+  global screen_on, blanked_at, wake_pending
+  with screen_lock:
+    # activity while xset runs happens after blanking as far as
+    # check_screen() is concerned
+    started = time()
+    wake_pending = False
+    try:
+      subprocess.run(['xset', 'dpms', 'force', 'off'], check=True, timeout=5)
+    except Exception as e:
+      log('display.blank_screen(): %r', e, level='error')
+      return False
+    screen_on = False
+    blanked_at = started
+
+    # NFC scans and touches meanwhile couldn't wake up the screen
+    if wake_pending or routine.last_activity >= started:
+      wake_locked('activity while blanking')
+      return False
+
+  metrics.increment('display_blanks')
+  log('display.blank_screen(): no activity for %s seconds',
+      cfg.DISPLAY_IDLE_SECONDS, level='info')
+  # streams pause while blanked, no need to wait for CAMERA_TIMEOUT
+  cam.stop_camera()
+  return True
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# INACTIVITY THREAD ============================================================
+from threading import Event, Thread
+BLANKED_CHECK_INTERVAL = 1  # seconds between checks for touches while blank
+thread = None
+stop_event = Event()
+started_at = 0.0  # activity before the start doesn't count
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def check_screen() -> float:
+  '''blank the screen after `cfg.DISPLAY_IDLE_SECONDS` without activity,
+  notice when it was woken up by a touch, returns the seconds until the next
+  check'''
+  last_activity = max(routine.last_activity, started_at)
+  if screen_on:
+    idle = time() - last_activity
+    if idle < cfg.DISPLAY_IDLE_SECONDS:
+      return cfg.DISPLAY_IDLE_SECONDS - idle
+    blank_screen()
+    # failed attempts are retried after another idle period
+    return BLANKED_CHECK_INTERVAL if not screen_on else cfg.DISPLAY_IDLE_SECONDS
+
+  if last_activity > blanked_at:
+    # a touch switched the monitor on and reached the web interface, the
+    # wake-up is only needed to track the state
+    wake_screen('touch')
+  elif time() - blanked_at >= cfg.DISPLAY_IDLE_SECONDS:
+    # touches outside of the browser switch the monitor on unnoticed
+    blank_screen()
+  return BLANKED_CHECK_INTERVAL
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def run_display() -> None:
+  '''worker function for the display thread'''
+  global thread
+  try:
+    while not stop_event.wait(check_screen()):
+      pass
+  except Exception as e:
+    log('display.run_display(): %r', e, level='error')
+  finally:
+    thread = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def start_display() -> None:
+  '''public interface
+  start blanking the screen on inactivity, not in DEBUG mode or if
+  `cfg.DISPLAY_IDLE_SECONDS` is not set'''
+  global thread, started_at
+  if cfg.DEBUG or not cfg.DISPLAY_IDLE_SECONDS or thread is not None:
+    return
+
+  started_at = time()
+  stop_event.clear()
+  thread = Thread(target=run_display, name='display', daemon=True)
+  thread.start()
+  log('display.start_display(): blanking after %s seconds of inactivity',
+      cfg.DISPLAY_IDLE_SECONDS, level='info')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def stop_display(timeout: float = 5) -> bool:
+  '''public interface
+  stop the display thread and turn the screen back on, returns False if the
+  thread didn't finish within `timeout` seconds'''
+  running = thread
+  stop_event.set()
+  if running is not None:
+    running.join(timeout)
+  if screen_blanked():
+    wake_screen('shutdown')
+  return running is None or not running.is_alive()
+# ------------------------------------------------------------------------------
+# ==============================================================================
@@ -0,0 +1,178 @@
+"""
+name:
+  Werkzeugverleih Lifecycle Management
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Coordinates the shutdown of all modules: runs the webserver until the
+  shutdown begins, tracks in-flight requests, tells streams to end, runs the
+  shutdown stages in order with timeouts and reports how long each of them
+  took.
+dependencies:
+  -
+"""
+
+
+# intra-package imports --------------------------------------------------------
+from werkzeugverleih.log import log
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+from typing import Any, Callable, List, Tuple
+# ------------------------------------------------------------------------------
+
+
+# SHUTDOWN STATE ===============================================================
+from threading import Condition, Event
+# set once the application starts shutting down, streams end when it's set
+shutting_down = Event()
+
+in_flight = 0  # number of requests currently handled by the webserver
+in_flight_condition = Condition()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def begin_shutdown() -> None:
+  '''mark the application as shutting down, safe to call from signal
+  handlers'''
+  shutting_down.set()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def request_started() -> None:
+  '''count a request as in flight, see `wait_for_requests()`'''
+  global in_flight
+  with in_flight_condition:
+    in_flight += 1
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def request_finished() -> None:
+  '''counterpart of `request_started()`'''
+  global in_flight
+  with in_flight_condition:
+    in_flight -= 1
+    if in_flight <= 0:
+      in_flight_condition.notify_all()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def wait_for_requests(timeout: float = None) -> bool:
+  '''block until all in-flight requests are finished, returns False if
+  `timeout` seconds passed first'''
+  with in_flight_condition:
+    return in_flight_condition.wait_for(lambda: in_flight <= 0, timeout)
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# SHUTDOWN STAGES ==============================================================
+from threading import Thread
+from time import perf_counter
+# ------------------------------------------------------------------------------
+def serve_until_shutdown(serve: Callable[[], Any]) -> Thread:
+  '''run `serve` (e.g. the webserver) in a helper thread, block until it
+  returns or the shutdown begins, whichever comes first
+
+  the calling (main) thread keeps running signal handlers meanwhile, returns
+  the server thread for `stop_server()`
+  '''
+  server = Thread(target=serve, name='webserver', daemon=True)
+  server.start()
+  while server.is_alive() and not shutting_down.wait(0.5):
+    pass
+  return server
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def stop_server(
+    stop: Callable[[], Any],
+    server: Thread,
+    timeout: float
+  ) -> bool:
+  '''shutdown stage for the server thread of `serve_until_shutdown()`, call
+  `stop` and wait up to `timeout` seconds for the server to finish, returns
+  False if it's still running, it's a daemon thread and doesn't keep the
+  process alive'''
+  if server.is_alive():
+    stop()
+  server.join(timeout)
+  return not server.is_alive()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# ------------------------------------------------------------------------------
+def run_stage(
+    name: str,
+    action: Callable[[], Any],
+    timeout: float
+  ) -> Tuple[str, float]:
+  '''run a single shutdown stage in a helper thread, give up waiting for it
+  after `timeout` seconds, returns `(status, duration)`
+
+  status is one of `ok`, `failed` (exception, logged) or `timeout` (the
+  stage keeps running in the background, but doesn't block the shutdown)
+  '''
+  status = 'timeout'
+
+  def run():
+    nonlocal status
+    try:
+      result = action()
+    except Exception as e:
+      log('lifecycle.run_stage(): stage %s failed: %r', name, e,
+          level='error')
+      status = 'failed'
+    else:
+      # stages may report that they didn't finish in time on their own
+      status = 'timeout' if result is False else 'ok'
+
+  start = perf_counter()
+  thread = Thread(target=run, name=f'shutdown {name}', daemon=True)
+  thread.start()
+  thread.join(timeout)
+  return status, perf_counter() - start
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def run_shutdown(
+    stages: List[Tuple[str, Callable[[], Any], float]]
+  ) -> List[Tuple[str, str, float]]:
+  '''run all shutdown `stages` in order and report their durations
+
+  arguments:
+  + `stages` -- list of `(name, action, timeout)`, `action` is a function
+  without arguments that may return False if it couldn't finish in time
+
+  returns a list of `(name, status, duration)`, see `run_stage()`
+  '''
+  begin_shutdown()
+
+  results = []
+  start = perf_counter()
+  for name, action, timeout in stages:
+    status, duration = run_stage(name, action, timeout)
+    results.append((name, status, duration))
+
+    log('lifecycle.run_shutdown(): stage %s: %s after %.3f seconds', name,
+        status, duration, level='info' if status == 'ok' else 'warning',
+        event='shutdown_stage', stage=name, status=status,
+        duration_ms=round(duration * 1000, 1))
+    print(f' - Shutdown stage {name}: {status} after {duration:.3f} s')
+
+  print(f' - Shutdown finished after {perf_counter() - start:.3f} s')
+  return results
+# ------------------------------------------------------------------------------
+# ==============================================================================
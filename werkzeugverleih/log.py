@@ -21,34 +21,187 @@ from werkzeugverleih.template_string import log_filename, log_filepath
 
 
 # HELPER FUNCTIONS =============================================================
-from datetime import date
-def today():
-  return date.today()
+from datetime import date, timedelta
+from datetime import datetime as dt
+def next_midnight() -> float:
+  '''returns the timestamp of the next local midnight'''
+  return dt.combine(date.today() + timedelta(days=1), dt.min.time()).timestamp()
+
+
+def dated_log_file() -> str:
+  '''returns the path of today's log file, set by template
+  cfg.LOG_FILEPATH_TEMPLATE, cfg.LOG_FILENAME_TEMPLATE, and cfg.DATE_FORMAT'''
+  return log_filepath(log_filename(dt.now().strftime(cfg.DATE_FORMAT)))
+
+
+import gzip
+from os import remove, replace
+from shutil import copyfileobj
+def compress_file(filename: str) -> None:
+  '''gzip `filename` to `filename.gz` and remove the original'''
+  with open(filename, 'rb') as source:
+    with gzip.open(filename + '.gz.tmp', 'wb') as target:
+      copyfileobj(source, target)
+  # only replace the original once the compressed file is complete
+  replace(filename + '.gz.tmp', filename + '.gz')
+  remove(filename)
 # ==============================================================================
 
 
 # LOGGING FUNCTIONS ============================================================
 import logging
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
+from os.path import abspath
+from contextvars import ContextVar
+from queue import Queue
+from threading import Lock
 logger = None
-log_date = today()
+
+# callers only put records into log_queue, the listener thread takes care of
+# formatting, the daily rotation of log files and writing to disk
+log_queue = Queue()
+queue_handler = None
+listener = None
+
+# active file handler, only used by the listener thread (and change_log_file),
+# rolls over to a new file by itself
+file_handler = None
+file_handler_lock = Lock()
+
+LOG_LEVELS = { 'debug':    logging.DEBUG,
+               'info':     logging.INFO,
+               'warning':  logging.WARNING,
+               'error':    logging.ERROR,
+               'critical': logging.CRITICAL }
+# ------------------------------------------------------------------------------
+
+
+# correlation id of the request handled by the current thread/context,
+# attached to every record logged while handling it
+request_id = ContextVar('request_id', default=None)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class EnqueueHandler(QueueHandler):
+  '''QueueHandler that leaves formatting to the listener thread'''
+  def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+    # merge message arguments right away, since they may change after the
+    # call returns, everything else is done by the listener thread
+    record.msg = record.getMessage()
+    record.args = None
+    return record
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class DailyRotatingFileHandler(BaseRotatingHandler):
+  '''file handler that changes to the file of the new day at midnight
+
+  The rollover time is computed once per file, so checking a record only
+  costs a comparison of its creation time. Rolling over happens inside
+  `emit()` while holding the handler lock, so no record can be written in
+  between closing the old and opening the new file.
+
+  arguments:
+  + `filename` - string, path of the file to be written to until midnight,
+  defaults to today's file (see `dated_log_file()`)
+  + `compress` - boolean, gzip the previous file after rolling over
+  '''
+  def __init__(self, filename: str = None, compress: bool = False) -> None:
+    if filename is None:
+      filename = dated_log_file()
+    super().__init__(filename, mode='a', encoding='utf-8')
+    self.compress = compress
+    self.rollover_at = next_midnight()
+
+  def shouldRollover(self, record: logging.LogRecord) -> bool:
+    return record.created >= self.rollover_at
+
+  def doRollover(self) -> None:
+    if self.stream is not None:
+      self.stream.close()
+      self.stream = None
+
+    previous = self.baseFilename
+    self.baseFilename = abspath(dated_log_file())
+    self.rollover_at = next_midnight()
+    self.stream = self._open()
+
+    # Don't log this message, since it's guaranteed to appear in the new file,
+    # which already knows it's own filename
+    print(f' - Changing log file to file "{self.baseFilename}"')
+
+    if self.compress and previous != self.baseFilename:
+      try:
+        compress_file(previous)
+      except OSError as e:
+        self.stream.write(f'log.DailyRotatingFileHandler.doRollover(): '
+                          f'could not compress {previous}: {e}'
+                          f'{self.terminator}')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+import json
+class JsonFormatter(logging.Formatter):
+  '''formats records as one JSON object per line
+
+  every line contains `time`, `level` and `message`, plus `request_id` if
+  the record was logged while handling a request and all structured fields
+  passed to `log()`, e.g. `event`, `nfc_id`, `transaction_ids` or
+  `duration_ms`
+  '''
+  def format(self, record: logging.LogRecord) -> str:
+    entry = { 'time': self.formatTime(record, self.datefmt),
+              'level': record.levelname.lower(),
+              'message': record.getMessage() }
+
+    if getattr(record, 'request_id', None) is not None:
+      entry['request_id'] = record.request_id
+
+    entry.update(getattr(record, 'fields', {}))
+
+    if record.exc_info:
+      entry['exception'] = self.formatException(record.exc_info)
+
+    return json.dumps(entry, ensure_ascii=False, default=str)
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class FileDispatchHandler(logging.Handler):
+  '''passes records from the log queue on to the active file handler
+
+  runs on the listener thread only
+  '''
+  def handle(self, record: logging.LogRecord) -> None:
+    with file_handler_lock:
+      if file_handler is not None:
+        file_handler.handle(record)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+import atexit
 def initialize_logger(level: str = 'info') -> None:
   '''start the logger with default settings'''
-  global logger
+  global logger, queue_handler, listener
   if logger is None:
     logger = logging.getLogger(name='werkzeugverleih')
     change_log_file(filename=None)
 
-  map_level = { 'debug':    logging.DEBUG,
-                'info':     logging.INFO,
-                'warning':  logging.WARNING,
-                'error':    logging.ERROR,
-                'critical': logging.CRITICAL}
+  if queue_handler is None:
+    queue_handler = EnqueueHandler(log_queue)
 
-  if level in map_level:
-    logger.setLevel(map_level.get(level, logging.INFO))
-  else:
-    logger.setLevel(logging.INFO)
+  if queue_handler not in logger.handlers:
+    logger.addHandler(queue_handler)
+
+  if listener is None:
+    listener = QueueListener(log_queue, FileDispatchHandler())
+    listener.start()
+
+  logger.setLevel(LOG_LEVELS.get(level, logging.INFO))
 
   log(f'log.initialize_logger(): ready to start logging with level "{level}"',
       level='info')
@@ -56,7 +209,25 @@ def initialize_logger(level: str = 'info') -> None:
 
 
 # ------------------------------------------------------------------------------
-from datetime import datetime as dt
+def flush_logger() -> None:
+  '''block until all queued log messages are written to file'''
+  if listener is not None:
+    log_queue.join()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@atexit.register
+def stop_logger() -> None:
+  '''write all queued log messages and stop the listener thread'''
+  global listener
+  if listener is not None:
+    listener.stop()
+    listener = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
 from time import gmtime
 def change_log_file(filename: str = None) -> None:
   '''change the log destination of the active logger
@@ -66,73 +237,101 @@ def change_log_file(filename: str = None) -> None:
 
   if filename=None, will default to the filename set by template
   cfg.LOG_FILEPATH_TEMPLATE, cfg.LOG_FILENAME_TEMPLATE, and cfg.DATE_FORMAT
-  '''
-  global logger
 
-  if filename is None:
-    filename = log_filepath(log_filename(dt.now().strftime(cfg.DATE_FORMAT)))
+  in both cases, the log changes to the file set by template at midnight
+  '''
+  global file_handler
 
-  file_handler = logging.FileHandler(filename=filename, mode='a',
-                                      encoding='utf-8')
+  new_handler = DailyRotatingFileHandler(filename=filename,
+                                         compress=cfg.LOG_COMPRESS)
 
-  formatter = logging.Formatter(fmt=cfg.LOGGING_FORMAT,
-                                datefmt=cfg.LOGGING_DATETIME_FORMAT)
+  if cfg.LOG_JSON:
+    formatter = JsonFormatter(datefmt=cfg.LOGGING_DATETIME_FORMAT)
+  else:
+    formatter = logging.Formatter(fmt=cfg.LOGGING_FORMAT,
+                                  datefmt=cfg.LOGGING_DATETIME_FORMAT)
   formatter.converter = gmtime
-  file_handler.setFormatter(formatter)
+  new_handler.setFormatter(formatter)
 
-  for handler in logger.handlers:
-    logger.removeHandler(handler)
-
-  logger.addHandler(file_handler)
-
-  global log_date
-  log_date = today()
+  with file_handler_lock:
+    if file_handler is not None:
+      file_handler.close()
+    file_handler = new_handler
 
   # Don't log this message, since it's guaranteed to appear in the new file,
   # which already knows it's own filename
-  print(f' - Changing log file to file "{filename}"')
+  print(f' - Changing log file to file "{new_handler.baseFilename}"')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def is_enabled(level: str = 'info') -> bool:
+  '''returns True if messages with `level` are written to the logfile,
+  use to skip building expensive log messages'''
+  return logger.isEnabledFor(LOG_LEVELS.get(level, logging.INFO))
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def log(message: str = '', level: str = 'info') -> None:
+from typing import Any, Callable, Union
+def log(
+    message: Union[str, Callable[[], str]] = '',
+    *args: Any,
+    level: str = 'info',
+    **fields: Any
+  ) -> None:
   '''logs `message` in currently set logfile
 
   arguments:
-  + `message` - string, text to save in logfile
+  + `message` - string, text to save in logfile, may contain `%s`-style
+  placeholders for `args`, alternatively a function without arguments
+  that returns the text
+  + `args` - values for the placeholders in `message`
   + `level` - string, plaintext log level
+  + `fields` - structured values for JSON log output (`cfg.LOG_JSON`),
+  e.g. `event`, `nfc_id`, `transaction_ids` or `duration_ms`, ignored by the
+  plaintext format
 
   valid values for levels include [`debug`, `info`, `warning`, `error`,
   `critical`], will default to `info`
+
+  `message` is only formatted (or called) if `level` is enabled,
+  writing to file happens on the listener thread
   '''
-  global logger
+  levelno = LOG_LEVELS.get(level, logging.INFO)
+  if not logger.isEnabledFor(levelno):
+    return
 
-  # change log file when date changes
-  if log_date != today():
-    change_log_file()
+  if callable(message):
+    message = message()
 
-  map_f = { 'debug':    logger.debug,
-            'info':     logger.info,
-            'warning':  logger.warning,
-            'error':    logger.warning,
-            'critical': logger.critical }
+  # the request id is taken from the calling thread, not the listener thread
+  logger.log(levelno, message, *args,
+             extra={'fields': fields, 'request_id': request_id.get()})
+# ------------------------------------------------------------------------------
 
-  if level in map_f:
-    log_f = map_f.get(level, logger.info)
-  else:
-    log_f = logger.info
 
-  log_f(message)
+# ------------------------------------------------------------------------------
+from uuid import uuid4
+def set_request_id(value: str = None) -> str:
+  '''set the correlation id for all messages logged by the current thread
+  until it's set again, returns the id
+
+  arguments:
+  + `value` - string, id to use, defaults to a new random id
+  '''
+  if value is None:
+    value = uuid4().hex[:12]
+  request_id.set(value)
+  return value
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
 def current_log_file() -> str:
-  '''returns the filename of the active logger's first filehandler'''
-  filenames = [i.baseFilename for i in logger.handlers
-                if hasattr(i, 'baseFilename')]
-  if filenames:
-    return filenames[0]
+  '''returns the filename of the active file handler'''
+  if file_handler is not None:
+    return file_handler.baseFilename
 
   return None
 # ------------------------------------------------------------------------------
@@ -21,6 +21,11 @@ import werkzeugverleih.nfc as nfc
 import werkzeugverleih.database as db
 import werkzeugverleih.webserver as webserver
 import werkzeugverleih.routine as routine
+import werkzeugverleih.metrics as metrics
+import werkzeugverleih.profiler as profiler
+import werkzeugverleih.camera as cam
+import werkzeugverleih.display as display
+import werkzeugverleih.lifecycle as lifecycle
 # ------------------------------------------------------------------------------
 
 
@@ -49,6 +54,36 @@ def default_flask_config_if_missing() -> None:
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+import signal
+from threading import Thread
+def register_profiler_signal() -> None:
+  '''start the sampling profiler on SIGUSR1 (not available on Windows)'''
+  def start_profiler(signum, frame):
+    # start_profiler() logs and takes locks, which the interrupted main
+    # thread may hold already, so it runs in a thread of its own
+    Thread(target=profiler.start_profiler, name='profiler signal',
+           daemon=True).start()
+
+  if hasattr(signal, 'SIGUSR1'):
+    signal.signal(signal.SIGUSR1, start_profiler)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def register_shutdown_signals() -> None:
+  '''begin the shutdown on SIGTERM and SIGINT (Ctrl+C), main() then stops
+  the webserver and all other modules'''
+  def begin_shutdown(signum, frame):
+    # only sets an event, safe to repeat and no locks involved, video
+    # streams end as soon as it's set
+    lifecycle.begin_shutdown()
+
+  signal.signal(signal.SIGTERM, begin_shutdown)
+  signal.signal(signal.SIGINT, begin_shutdown)
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def main() -> None:
   '''program entry point'''
@@ -74,17 +109,44 @@ def main() -> None:
 
   log.log('main(): starting routine operation thread', level='info')
   routine.start_routine()
+  if cfg.METRICS_LOG_INTERVAL:
+    routine.schedule_job('log_metrics', metrics.log_metrics,
+                         routine.every(cfg.METRICS_LOG_INTERVAL))
+  if cfg.LAST_ACCESS_FLUSH_INTERVAL:
+    routine.schedule_job('flush_last_access', db.flush_last_access,
+                         routine.every(cfg.LAST_ACCESS_FLUSH_INTERVAL))
+
+  log.log('main(): starting display management', level='info')
+  display.start_display()
+
+  register_profiler_signal()
+  register_shutdown_signals()
 
   log.log('main(): starting webserver', level='info')
-  webserver.start_webserver()
+  # returns when the shutdown begins, even if the server doesn't stop
+  server = lifecycle.serve_until_shutdown(webserver.start_webserver)
 
   print('Shutting down application')
 
   log.log('main(): shutting down program', level='info')
-  routine.stop_routine()
-  db.close_connection()
-  nfc.stop_nfc()
+  timeout = cfg.SHUTDOWN_STAGE_TIMEOUT
+  lifecycle.run_shutdown([
+    ('webserver',
+     lambda: lifecycle.stop_server(webserver.stop_webserver, server, timeout),
+     timeout + 1),
+    ('requests',
+     lambda: lifecycle.wait_for_requests(cfg.SHUTDOWN_DRAIN_SECONDS),
+     cfg.SHUTDOWN_DRAIN_SECONDS + 1),
+    ('routine', routine.stop_routine, timeout),
+    ('profiler', profiler.stop_profiler, timeout),
+    ('display', lambda: display.stop_display(timeout), timeout + 1),
+    ('camera', lambda: cam.stop_camera(timeout), timeout + 1),
+    ('nfc', nfc.stop_nfc, timeout),
+    ('database', db.close_connection, timeout),
+    ('log', log.flush_logger, timeout),
+  ])
   log.log('main(): all modules finished, exit now', level='info')
+  log.stop_logger()
   exit(0)
 # ------------------------------------------------------------------------------
 
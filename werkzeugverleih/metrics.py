@@ -0,0 +1,331 @@
+"""
+name:
+  Werkzeugverleih Metrics
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  In-process timing histograms and event counters for web requests,
+  database access, template rendering, image encoding, camera and NFC reader,
+  exported as summary or in the Prometheus text format.
+dependencies:
+  -
+"""
+
+
+# intra-package imports --------------------------------------------------------
+from werkzeugverleih.log import log, is_enabled
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+from typing import Any, Dict, Iterator, List, Tuple
+# ------------------------------------------------------------------------------
+
+
+# HISTOGRAMS ===================================================================
+from threading import Lock
+# upper bounds of the histogram buckets in seconds, the last bucket catches
+# everything above
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, float('inf'))
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class Histogram:
+  '''thread-safe histogram of durations in seconds with fixed buckets'''
+  def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+    self.buckets = buckets
+    self.lock = Lock()
+    self.reset()
+
+  def reset(self) -> None:
+    '''remove all recorded values'''
+    with self.lock:
+      self.counts = [0] * len(self.buckets)
+      self.count = 0
+      self.sum = 0.0
+      self.max = 0.0
+
+  def observe(self, seconds: float) -> None:
+    '''add a single duration'''
+    index = 0
+    while seconds > self.buckets[index]:
+      index += 1
+
+    with self.lock:
+      self.counts[index] += 1
+      self.count += 1
+      self.sum += seconds
+      if seconds > self.max:
+        self.max = seconds
+
+  def snapshot(self) -> dict:
+    '''consistent copy of all values, `counts` are per bucket (not
+    cumulative)'''
+    with self.lock:
+      return { 'buckets': self.buckets,
+               'counts': list(self.counts),
+               'count': self.count,
+               'sum': self.sum,
+               'max': self.max }
+
+  def quantile(self, q: float) -> float:
+    '''upper bound estimate of the `q`-quantile (0 <= q <= 1) in seconds,
+    limited to the largest observed duration'''
+    snapshot = self.snapshot()
+    if snapshot['count'] == 0:
+      return 0.0
+
+    rank = q * snapshot['count']
+    seen = 0
+    for bound, count in zip(snapshot['buckets'], snapshot['counts']):
+      seen += count
+      if seen >= rank:
+        return min(bound, snapshot['max'])
+
+    return snapshot['max']  # pragma: no cover
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# (metric, label) -> Histogram, e.g. ('request', '/checkin') or
+# ('db_wait', 'get_user')
+histograms: Dict[Tuple[str, str], Histogram] = {}
+histograms_lock = Lock()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_histogram(metric: str, label: str) -> Histogram:
+  '''returns the histogram for `metric` and `label`, creates it if necessary'''
+  key = (metric, label)
+  histogram = histograms.get(key)
+  if histogram is None:
+    with histograms_lock:
+      histogram = histograms.setdefault(key, Histogram())
+  return histogram
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def observe(metric: str, label: str, seconds: float) -> None:
+  '''record a duration
+
+  arguments:
+  + `metric` -- string, what was measured, see `HISTOGRAM_EXPORTS`
+  + `label` -- string, where it was measured, e.g. route or function name
+  + `seconds` -- float, measured duration
+  '''
+  get_histogram(metric, label).observe(seconds)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+from contextlib import contextmanager
+from time import perf_counter
+@contextmanager
+def timed(metric: str, label: str) -> Iterator[None]:
+  '''context manager, records the duration of its block'''
+  start = perf_counter()
+  try:
+    yield
+  finally:
+    observe(metric, label, perf_counter() - start)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def summary() -> List[dict]:
+  '''list of all histograms with recorded values sorted by metric and label,
+  durations in milliseconds'''
+  with histograms_lock:
+    items = sorted(histograms.items())
+
+  result = []
+  for (metric, label), histogram in items:
+    snapshot = histogram.snapshot()
+    count = snapshot['count']
+    if count == 0:
+      continue
+    result.append({ 'metric': metric,
+                    'label': label,
+                    'count': count,
+                    'total_ms': snapshot['sum'] * 1000,
+                    'mean_ms': snapshot['sum'] * 1000 / count,
+                    'p50_ms': histogram.quantile(0.5) * 1000,
+                    'p95_ms': histogram.quantile(0.95) * 1000,
+                    'max_ms': snapshot['max'] * 1000 })
+  return result
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def log_metrics() -> None:
+  '''write one line per histogram to the log file
+
+  routine job, see `cfg.METRICS_LOG_INTERVAL`
+  '''
+  if not is_enabled('info'):
+    return
+
+  for entry in summary():
+    log('metrics.log_metrics(): %s %s count=%s mean=%.1fms p50=%.1fms '
+        'p95=%.1fms max=%.1fms', entry['metric'], entry['label'],
+        entry['count'], entry['mean_ms'], entry['p50_ms'], entry['p95_ms'],
+        entry['max_ms'], level='info', event='metrics', **entry)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def reset_metrics() -> None:
+  '''remove all recorded values, histograms stay registered since callers
+  may keep references to them'''
+  with histograms_lock:
+    for histogram in histograms.values():
+      histogram.reset()
+
+  with counters_lock:
+    counters.clear()
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# COUNTERS =====================================================================
+# ------------------------------------------------------------------------------
+# name -> number of events since start, e.g. 'camera_frames_sent'
+counters: Dict[str, int] = {}
+counters_lock = Lock()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def increment(name: str, amount: int = 1) -> None:
+  '''count `amount` events of `name`'''
+  with counters_lock:
+    counters[name] = counters.get(name, 0) + amount
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# PROMETHEUS TEXT EXPOSITION ===================================================
+# ------------------------------------------------------------------------------
+# metric -> (exported name, label name, help text)
+HISTOGRAM_EXPORTS = {
+  'request': ('werkzeugverleih_request_duration_seconds', 'route',
+              'Duration of web requests'),
+  'db_wait': ('werkzeugverleih_db_lock_wait_seconds', 'function',
+              'Time spent waiting for the database lock'),
+  'db_hold': ('werkzeugverleih_db_lock_hold_seconds', 'function',
+              'Time the database lock was held'),
+  'render': ('werkzeugverleih_render_duration_seconds', 'template',
+             'Duration of template rendering'),
+  'encode': ('werkzeugverleih_encode_duration_seconds', 'format',
+             'Duration of image encoding'),
+  'camera': ('werkzeugverleih_camera_access_seconds', 'function',
+             'Duration of camera frame access'),
+  'nfc': ('werkzeugverleih_nfc_duration_seconds', 'function',
+          'Duration of NFC tag reads and lookups'),
+}
+
+# counter -> help text
+COUNTER_HELP = {
+  'camera_frames_produced': 'Frames captured by the camera',
+  'camera_frames_sent': 'Frames sent to video stream clients',
+  'nfc_scans': 'NFC tags read successfully',
+  'nfc_scan_errors': 'Failed NFC tag reads while a tag was held, including '
+                     'removed tags, and reader errors',
+  'nfc_reconnects': 'Reconnects to brickd after the first connection',
+  'display_wakeups': 'Screen wake-ups, repeated calls within the debounce '
+                     'time are not counted',
+  'display_blanks': 'Screen turned off due to inactivity',
+  'prefetch_hits': 'Check-in pages served from prefetched transactions',
+  'prefetch_misses': 'Check-in pages that had to query the transactions',
+}
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def format_labels(labels: Dict[str, str]) -> str:
+  '''`{name="value",...}` with escaped values, empty string without labels'''
+  if not labels:
+    return ''
+
+  def escape(value: Any) -> str:
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                      .replace('\n', '\\n'))
+
+  return '{' + ','.join(f'{name}="{escape(value)}"'
+                        for name, value in labels.items()) + '}'
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def format_value(value: float) -> str:
+  '''number in Prometheus notation'''
+  if value == float('inf'):
+    return '+Inf'
+  return repr(value) if isinstance(value, float) else str(value)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def prometheus_text(
+    gauges: List[Tuple[str, str, Dict[str, str], float]] = ()
+  ) -> str:
+  '''all histograms and counters in the Prometheus text exposition format
+  (version 0.0.4)
+
+  arguments:
+  + `gauges` -- list of `(name, help, labels, value)` for values that are
+  computed by the caller at scrape time, e.g. the database file size,
+  entries with the same name are grouped together
+  '''
+  lines = []
+
+  with histograms_lock:
+    items = sorted(histograms.items())
+
+  exported = set()
+  for (metric, label), histogram in items:
+    name, label_name, help_text = HISTOGRAM_EXPORTS.get(
+      metric, (f'werkzeugverleih_{metric}_seconds', 'label', metric))
+    if name not in exported:
+      exported.add(name)
+      lines.append(f'# HELP {name} {help_text}')
+      lines.append(f'# TYPE {name} histogram')
+
+    snapshot = histogram.snapshot()
+    cumulative = 0
+    for bound, count in zip(snapshot['buckets'], snapshot['counts']):
+      cumulative += count
+      labels = format_labels({label_name: label, 'le': format_value(bound)})
+      lines.append(f'{name}_bucket{labels} {cumulative}')
+    labels = format_labels({label_name: label})
+    lines.append(f'{name}_sum{labels} {format_value(snapshot["sum"])}')
+    lines.append(f'{name}_count{labels} {snapshot["count"]}')
+
+  with counters_lock:
+    counter_items = sorted(counters.items())
+
+  for counter, value in counter_items:
+    name = f'werkzeugverleih_{counter}_total'
+    lines.append(f'# HELP {name} {COUNTER_HELP.get(counter, counter)}')
+    lines.append(f'# TYPE {name} counter')
+    lines.append(f'{name} {value}')
+
+  exported = set()
+  for name, help_text, labels, value in sorted(gauges, key=lambda g: g[0]):
+    if name not in exported:
+      exported.add(name)
+      lines.append(f'# HELP {name} {help_text}')
+      lines.append(f'# TYPE {name} gauge')
+    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+  return '\n'.join(lines) + '\n'
+# ------------------------------------------------------------------------------
+# ==============================================================================
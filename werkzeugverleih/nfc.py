@@ -12,79 +12,517 @@ description:
   In theory, the application can use other means of authentication, like
   biometrics or other hardware tokens, as long as get_tag_id() provides
   one unique ID per user.
+  Reader backends (see `cfg.NFC_BACKEND`): `tinkerforge` (NFC Bricklet via
+  brickd), `simulator` (see nfc_simulator) and `file` (debug file).
 dependencies:
-  tinkerforge
+  tinkerforge (optional, only for the tinkerforge backend)
 """
 
 
 # intra-package imports --------------------------------------------------------
 import werkzeugverleih.config as cfg
 from werkzeugverleih.log import log
+import werkzeugverleih.metrics as metrics
 import werkzeugverleih.camera as cam
+import werkzeugverleih.database as db
 import werkzeugverleih.display as display
+import werkzeugverleih.routine as routine
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
 from time import time, sleep
-from tinkerforge.ip_connection import IPConnection
-from tinkerforge.bricklet_nfc import BrickletNFC
+from threading import Condition
 cached_id = None
-cached_timestamp = 0
-def cb_reader_state_changed(state, idle, nfc):
-    global cached_id, cached_timestamp
-    if state == nfc.READER_STATE_IDLE:
-        nfc.reader_request_tag_id()
-    elif state == nfc.READER_STATE_REQUEST_TAG_ID_READY:
-        ret = nfc.reader_get_tag_id()
-        cached_id = "".join(s[2:].upper() for s in map(hex, ret.tag_id))
-        cached_timestamp = time()
-        cam.initialize_camera()
-        display.wake_up_screen_via_NFC()
-        while cached_timestamp > (time() - cfg.NFC_CACHE_DURATION):
-            sleep(.1)
-        cached_id = None
-        cached_timestamp = 0
-        nfc.reader_request_tag_id()
-    elif state == nfc.READER_STATE_REQUEST_TAG_ID_ERROR:
-      sleep(cfg.NFC_SEARCH_INTERVALL)
-      nfc.reader_request_tag_id()
+cached_timestamp = 0  # last time the tag was seen on the reader
+cached_expiry = 0  # the cached tag id is valid until then
+# notified whenever a new tag id is cached, see get_tag_id()
+tag_condition = Condition()
+# ------------------------------------------------------------------------------
+
 
 # ------------------------------------------------------------------------------
+def tag_cached() -> bool:
+  '''True while a tag id is cached and not yet expired'''
+  return cached_id is not None and time() < cached_expiry
+# ------------------------------------------------------------------------------
 
-def initialize_nfc():
-  if cfg.DEBUG:
+
+# ------------------------------------------------------------------------------
+def publish_tag_id(tag_id: str) -> None:
+  '''cache `tag_id` for `cfg.NFC_CACHE_DURATION` seconds and wake up all
+  requests waiting in get_tag_id(), also used to refresh the cache while the
+  tag stays on the reader'''
+  global cached_id, cached_timestamp, cached_expiry
+  with tag_condition:
+    cached_id = tag_id
+    cached_timestamp = time()
+    cached_expiry = cached_timestamp + cfg.NFC_CACHE_DURATION
+    tag_condition.notify_all()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def expire_tag_id(seconds: float) -> None:
+  '''let the cached tag id expire in `seconds` at the latest'''
+  global cached_expiry
+  with tag_condition:
+    cached_expiry = min(cached_expiry, time() + seconds)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def clear_tag_id() -> None:
+  '''remove the cached tag id'''
+  global cached_id, cached_timestamp, cached_expiry
+  with tag_condition:
+    cached_id = None
+    cached_timestamp = 0
+    cached_expiry = 0
+# ------------------------------------------------------------------------------
+
+
+# NFC WORKER ===================================================================
+from queue import Queue, Empty
+from threading import Thread
+# the tinkerforge callback only enqueues reader states, the worker thread
+# handles them, so no callback is ever blocked
+events = Queue()
+STOP = object()  # sentinel event, ends the worker
+ATTACH = object()  # sentinel event, reader (re)connected, switch to reader mode
+
+# worker states
+SEARCHING = 'searching'  # tag id requested, waiting for the reader
+HOLDING = 'holding'  # tag on the reader, check again after a moment
+CHECKING = 'checking'  # tag id requested while holding, is it still there?
+BACKOFF = 'backoff'  # no tag found, search again after NFC_SEARCH_INTERVALL
+DETACHED = 'detached'  # reader not reachable, waiting for ATTACH
+
+worker = None
+worker_state = None
+reader = None  # BrickletNFC or SimulatedReader
+scan_side_effects = True  # see tag_scanned(), disabled for benchmarks
+ipcon = None  # tinkerforge backend only
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cb_reader_state_changed(state, idle):
+  '''tinkerforge callback, hands the new reader state to the worker'''
+  events.put(state)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def tag_scanned(tag_id: str) -> None:
+  '''side effects of a scan, run in their own thread since starting the
+  camera blocks until the first frame is available'''
+  try:
+    # first thing the user should notice
+    display.wake_screen('nfc')
+    # the user's next page most likely needs their data
+    db.prefetch(tag_id)
+    cam.initialize_camera()
+  except Exception as e:
+    log('nfc.tag_scanned(): %r', e, level='error')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def read_tag_id(reader) -> str:
+  '''tag id of the tag on the reader as hex string'''
+  with metrics.timed('nfc', 'reader_get_tag_id'):
+    ret = reader.reader_get_tag_id()
+  return "".join(s[2:].upper() for s in map(hex, ret.tag_id))
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def handle_event(reader, state: str, deadline: float, event):
+  '''one step of the worker state machine
+
+  arguments:
+  + `reader` -- BrickletNFC
+  + `state` -- string, current worker state (SEARCHING, HOLDING, CHECKING,
+  BACKOFF, DETACHED)
+  + `deadline` -- timestamp of the current state's timer or None
+  + `event` -- reader state from the callback, ATTACH if the reader
+  (re)appeared, None if the timer expired
+
+  returns `(new_state, new_deadline)`
+
+  while a tag is held, the reader is asked for the tag id every
+  `cfg.NFC_PRESENCE_INTERVAL` seconds: a different tag replaces the cached id
+  at once, a removed tag stays cached for `cfg.NFC_REMOVAL_GRACE_PERIOD`
+  seconds, so users can put the tag aside before using the touch screen
+  '''
+  if event is ATTACH:
+    # the reader answers with READER_STATE_IDLE
+    reader.set_mode(reader.MODE_READER)
+    return SEARCHING, None
+
+  if not attached:
+    return DETACHED, None
+
+  if event is None:  # timer expired
+    if not tag_cached():
+      clear_tag_id()
+    reader.reader_request_tag_id()
+    return (CHECKING if state == HOLDING else SEARCHING), None
+
+  if event == reader.READER_STATE_IDLE:
+    reader.reader_request_tag_id()
+    return SEARCHING, None
+
+  if event == reader.READER_STATE_REQUEST_TAG_ID_READY:
+    tag_id = read_tag_id(reader)
+    if tag_id == cached_id and tag_cached():
+      publish_tag_id(tag_id)  # still there, keep it cached
+    else:
+      if cached_id is not None:
+        log('nfc.handle_event(): tag changed', level='debug')
+      publish_tag_id(tag_id)
+      metrics.increment('nfc_scans')
+      routine.register_activity()
+      if scan_side_effects:
+        Thread(target=tag_scanned, args=(tag_id,), name='nfc scanned',
+               daemon=True).start()
+    return HOLDING, time() + cfg.NFC_PRESENCE_INTERVAL
+
+  if event == reader.READER_STATE_REQUEST_TAG_ID_ERROR:
+    # while searching, that's just the answer without a tag in the field
+    if state in (CHECKING, HOLDING):
+      log('nfc.handle_event(): tag removed or unreadable', level='debug')
+      metrics.increment('nfc_scan_errors')
+      expire_tag_id(cfg.NFC_REMOVAL_GRACE_PERIOD)
+    return BACKOFF, time() + cfg.NFC_SEARCH_INTERVALL
+
+  # intermediate states, e.g. READER_STATE_REQUEST_TAG_ID
+  return state, deadline
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def run_worker(reader) -> None:
+  '''worker function for the nfc thread, waits for reader states or the
+  timer of the current state, whichever comes first'''
+  global worker_state
+  state, deadline = SEARCHING, None
+  worker_state = state
+  while True:
+    timeout = None if deadline is None else max(0, deadline - time())
+    try:
+      event = events.get(timeout=timeout)
+    except Empty:
+      event = None
+    if event is STOP:
+      break
+
+    try:
+      state, deadline = handle_event(reader, state, deadline, event)
+    except Exception as e:
+      # e.g. brickd connection lost, try again later
+      log('nfc.run_worker(): %r', e, level='error')
+      metrics.increment('nfc_scan_errors')
+      state, deadline = BACKOFF, time() + cfg.NFC_SEARCH_INTERVALL
+    worker_state = state
+
+  worker_state = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def start_worker(reader) -> None:
+  '''start the nfc thread for `reader`, unless it's already running'''
+  global worker
+  if worker is not None and worker.is_alive():
     return
-  global cached_id, cached_timestamp, ipcon, stop
-  cached_timestamp = 0
-  cached_id = None
-  stop = False
+
+  worker = Thread(target=run_worker, args=(reader,), name='nfc', daemon=True)
+  worker.start()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def stop_worker(timeout: float = 3) -> bool:
+  '''stop the nfc thread, returns False if it didn't finish in time'''
+  global worker
+  running = worker
+  if running is None:
+    return True
+
+  events.put(STOP)
+  running.join(timeout)
+  worker = None
+  if running.is_alive():
+    return False
+
+  # drop states left over for the next run
+  while not events.empty():
+    events.get_nowait()
+  return True
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# READER BACKENDS ==============================================================
+# ------------------------------------------------------------------------------
+def backend() -> str:
+  '''configured reader backend, `file` in DEBUG mode and `tinkerforge`
+  otherwise unless `cfg.NFC_BACKEND` is set'''
+  if cfg.NFC_BACKEND:
+    return cfg.NFC_BACKEND
+  return 'file' if cfg.DEBUG else 'tinkerforge'
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def create_tinkerforge_reader():
+  '''NFC Bricklet `cfg.NFC_BRICKLET_UID` connected via brickd, works with
+  brickd_standin as well
+
+  connects in the background, the bricklet is attached once brickd reports
+  it (see `cb_enumerate()`)
+  '''
+  global ipcon
+  from tinkerforge.ip_connection import IPConnection
+  from tinkerforge.bricklet_nfc import BrickletNFC
 
   ipcon = IPConnection()
+  # reconnects are done by connect_brickd() with backoff instead
+  ipcon.set_auto_reconnect(False)
   nfc = BrickletNFC(cfg.NFC_BRICKLET_UID, ipcon)
-  ipcon.connect(cfg.BRICKD_HOST, cfg.BRICKD_PORT)
-  nfc.register_callback(nfc.CALLBACK_READER_STATE_CHANGED,
-                          lambda x, y: cb_reader_state_changed(x, y, nfc))
-  nfc.set_mode(nfc.MODE_READER)
+  ipcon.register_callback(IPConnection.CALLBACK_CONNECTED, cb_connected)
+  ipcon.register_callback(IPConnection.CALLBACK_DISCONNECTED, cb_disconnected)
+  ipcon.register_callback(IPConnection.CALLBACK_ENUMERATE, cb_enumerate)
+  start_connecting()
+  return nfc
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def create_simulated_reader():
+  '''in-process reader without hardware, see nfc_simulator'''
+  from werkzeugverleih.nfc_simulator import create_reader
+  reader = create_reader()
+  set_connection_state('connected')
+  attach_reader()
+  return reader
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# backend name -> function returning a reader with the BrickletNFC interface,
+# the backend calls attach_reader() once the reader can be used
+READER_BACKENDS = {
+  'tinkerforge': create_tinkerforge_reader,
+  'simulator': create_simulated_reader,
+}
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# CONNECTION HEALTH ============================================================
+from threading import Event
+connection_state = 'disconnected'  # 'connecting', 'connected', 'disconnected'
+attached = False  # reader reported by brickd and switched to reader mode
+reconnects = 0  # connections after the first one
+ever_connected = False
+connect_thread = None
+connect_stop = Event()
+
+# tinkerforge constants, the bindings are only imported with the backend
+DISCONNECT_REASON_REQUEST = 0
+ENUMERATION_TYPE_DISCONNECTED = 2
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def set_connection_state(state: str) -> None:
+  '''remember and log changes of the connection to the reader'''
+  global connection_state
+  if state != connection_state:
+    log('nfc.set_connection_state(): %s -> %s', connection_state, state,
+        level='info' if state == 'connected' else 'warning',
+        event='nfc_connection', state=state)
+  connection_state = state
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def attach_reader() -> None:
+  '''the reader is ready, the worker switches it to reader mode'''
+  global attached
+  attached = True
+  events.put(ATTACH)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def connect_brickd() -> None:
+  '''worker function for the connect thread, tries to connect to brickd
+  until it succeeds, waiting `cfg.NFC_RECONNECT_DELAY` seconds after the
+  first failure, twice as long after every further one, but at most
+  `cfg.NFC_RECONNECT_MAX_DELAY` seconds'''
+  global connect_thread
+  attempt = 0
+  set_connection_state('connecting')
+  try:
+    while not connect_stop.is_set():
+      try:
+        ipcon.connect(cfg.BRICKD_HOST, cfg.BRICKD_PORT)
+        return  # cb_connected() takes over
+      except Exception as e:
+        delay = min(cfg.NFC_RECONNECT_DELAY * 2 ** attempt,
+                    cfg.NFC_RECONNECT_MAX_DELAY)
+        attempt += 1
+        log('nfc.connect_brickd(): connection to %s:%s failed (%r), '
+            'attempt %s, retry in %s seconds', cfg.BRICKD_HOST,
+            cfg.BRICKD_PORT, e, attempt, delay,
+            level='warning' if attempt == 1 else 'debug')
+        connect_stop.wait(delay)
+  finally:
+    connect_thread = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def start_connecting() -> None:
+  '''(re)connect to brickd in the background, unless already trying'''
+  global connect_thread
+  if connect_thread is not None or connect_stop.is_set():
+    return
+  connect_thread = Thread(target=connect_brickd, name='nfc connect',
+                          daemon=True)
+  connect_thread.start()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cb_connected(connect_reason: int) -> None:
+  '''tinkerforge callback, connected to brickd, ask for the attached
+  devices'''
+  global reconnects, ever_connected
+  if ever_connected:
+    reconnects += 1
+    metrics.increment('nfc_reconnects')
+  ever_connected = True
+  set_connection_state('connected')
+  try:
+    ipcon.enumerate()
+  except Exception as e:
+    log('nfc.cb_connected(): enumerate failed: %r', e, level='error')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cb_disconnected(disconnect_reason: int) -> None:
+  '''tinkerforge callback, connection to brickd lost, reconnect unless the
+  disconnect was requested'''
+  global attached
+  attached = False
+  set_connection_state('disconnected')
+  if disconnect_reason != DISCONNECT_REASON_REQUEST:
+    start_connecting()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cb_enumerate(uid, connected_uid, position, hardware_version,
+                 firmware_version, device_identifier, enumeration_type):
+  '''tinkerforge callback, devices reported by brickd, e.g. after a reset of
+  the bricklet'''
+  global attached
+  if uid != cfg.NFC_BRICKLET_UID:
+    return
+
+  if enumeration_type == ENUMERATION_TYPE_DISCONNECTED:
+    attached = False
+    log('nfc.cb_enumerate(): NFC bricklet %s disconnected', uid,
+        level='warning', event='nfc_connection', state='detached')
+  else:
+    log('nfc.cb_enumerate(): NFC bricklet %s available', uid, level='info')
+    attach_reader()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def reader_health() -> dict:
+  '''state of the reader for monitoring, `healthy` is True if tags can be
+  read right now'''
+  worker_alive = worker is not None and worker.is_alive()
+  return { 'backend': backend(),
+           'connection': connection_state,
+           'attached': attached,
+           'worker_alive': worker_alive,
+           'worker_state': worker_state,
+           'reconnects': reconnects,
+           'healthy': (connection_state == 'connected' and attached and
+                       worker_alive) }
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# ------------------------------------------------------------------------------
+def initialize_nfc():
+  '''public interface
+  connect the configured reader backend and start the nfc thread'''
+  global reader
+  name = backend()
+  if name == 'file':
+    return
+  clear_tag_id()
+
+  create_reader = READER_BACKENDS.get(name)
+  if create_reader is None:
+    log('nfc.initialize_nfc(): unknown backend %s', name, level='error')
+    return
+
+  log('nfc.initialize_nfc(): backend %s', name, level='info')
+  connect_stop.clear()
+  reader = create_reader()
+  reader.register_callback(reader.CALLBACK_READER_STATE_CHANGED,
+                           cb_reader_state_changed)
+  start_worker(reader)
 # ------------------------------------------------------------------------------
 
 def stop_nfc():
-  if cfg.DEBUG:
+  '''public interface
+  stop the nfc thread and disconnect the reader'''
+  global reader, ipcon, attached
+  if reader is None:
     return
-  global cached_id, cached_timestamp, ipcon
-  cached_id = None
-  cached_timestamp = 0
-  ipcon.disconnect()
+  connect_stop.set()
+  running = connect_thread
+  if running is not None:
+    running.join(timeout=3)
+  stop_worker()
+  clear_tag_id()
+  attached = False
+  if ipcon is not None:
+    try:
+      ipcon.disconnect()
+    except Exception as e:
+      # e.g. not connected at all
+      log('nfc.stop_nfc(): %r', e, level='debug')
+    ipcon = None
+  set_connection_state('disconnected')
+  if hasattr(reader, 'stop'):
+    reader.stop()
+  reader = None
 # ------------------------------------------------------------------------------
 
 def get_tag_id():
   '''public interface
   read NFC tag and return its ID (Hex String)
-  return None if no nfc tag after timeout'''
-  global cached_id, cached_timestamp
+  return None if no nfc tag after timeout
+
+  blocks until the reader publishes a tag (see `publish_tag_id()`) or
+  `cfg.NFC_SCAN_TIMEOUT` seconds have passed
+  '''
 
   # DEBUG
-  if cfg.DEBUG:
+  if backend() == 'file':
     sleep(cfg.NFC_DEBUG_DELAY)  # fake nfc scan delay
     with open('./tests/res/nfc.txt', 'r') as nfc_file:
       nfc_id = nfc_file.readline()
@@ -92,37 +530,10 @@ def get_tag_id():
         return None
       print('nfc.get_tag_id(): DEBUG ID: {nfc_id}')
       return nfc_id
-  else:
-    if cached_timestamp > (time() - cfg.NFC_CACHE_DURATION):
+  with tag_condition:
+    if tag_condition.wait_for(tag_cached, timeout=cfg.NFC_SCAN_TIMEOUT):
       return cached_id
-    else:
-      cached_id = None
-      cached_timestamp = 0
-      for i in range(int(cfg.NFC_SCAN_TIMEOUT / cfg.NFC_POLL_INTERVALL)):
-        if cached_timestamp > (time() - cfg.NFC_CACHE_DURATION):
-          return cached_id
-          sleep(cfg.NFC_POLL_INTERVALL)
-  return None
-  # ------------------------------------------------------------------------------
 
   log('nfc.get_tag_id(): No NFC ID available', level='debug')
   return None
 # ------------------------------------------------------------------------------
-
-# a viable strategy for a real NFC reader implementation may be running its own
-# thread and keeping track of its current state.
-# registering a callback to CALLBACK_READER_STATE_CHANGED may do most of the
-# legwork.
-# the callback should always wake up the screen after inactivity (see display),
-# activate the pi camera (see camera) and then try to read the tag id.
-# After the tag id has been read, it should be cached for faster responses by
-# other parts of the application (most notibly, the webserver)
-# Once a tag has been cached, the thread should periodically (1 sec intervals?)
-# check if a different tag is on the reader (->instantly invalidate cache and
-# cache new tag) or no tag is available anymore (keep cache for a short while,
-# to allow users to scan tag and then click buttons on the user interface,
-# instead of doing both actions in parallel)
-# CALLBACK_READER_STATE_CHANGED may conflict with the periodical polling, so
-# reliabilty testing should be performed for the callback.
-# if the callback is reliable in all cases, then polling may not be needed in
-# the first place
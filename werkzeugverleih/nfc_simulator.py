@@ -0,0 +1,275 @@
+"""
+name:
+  Werkzeugverleih NFC Reader Simulator
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  In-process stand-in for the NFC Bricklet in reader mode, for development
+  and benchmarks without hardware. Tags are put on and taken off the
+  simulated reader by hand or by a script, every tag id request is answered
+  after a random delay.
+  Run `python -m werkzeugverleih.nfc_simulator` to benchmark the scan
+  latency of the nfc module.
+dependencies:
+  -
+"""
+
+
+# intra-package imports --------------------------------------------------------
+import werkzeugverleih.config as cfg
+from werkzeugverleih.log import log
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+from typing import Callable, List, Tuple
+# ------------------------------------------------------------------------------
+
+
+# SIMULATED READER =============================================================
+import random
+from collections import namedtuple
+from threading import Event, Lock, Thread, Timer
+# same layout as BrickletNFC.reader_get_tag_id()
+GetTagID = namedtuple('TagID', ['tag_type', 'tag_id'])
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+class SimulatedReader:
+  '''subset of the BrickletNFC interface used by the nfc module
+
+  arguments:
+  + `delay` -- float, mean seconds until a tag id request is answered,
+  defaults to `cfg.NFC_SIMULATOR_DELAY`
+  + `jitter` -- float, standard deviation of the delay, defaults to
+  `cfg.NFC_SIMULATOR_JITTER`
+  '''
+  CALLBACK_READER_STATE_CHANGED = 13
+  MODE_READER = 2
+  READER_STATE_IDLE = 128
+  READER_STATE_REQUEST_TAG_ID = 2
+  READER_STATE_REQUEST_TAG_ID_READY = 130
+  READER_STATE_REQUEST_TAG_ID_ERROR = 194
+  TAG_TYPE_TYPE2 = 2
+
+  def __init__(self, delay: float = None, jitter: float = None) -> None:
+    self.delay = cfg.NFC_SIMULATOR_DELAY if delay is None else delay
+    self.jitter = cfg.NFC_SIMULATOR_JITTER if jitter is None else jitter
+    self.lock = Lock()
+    self.tag_id = None  # hex string of the tag on the reader
+    self.answered_tag_id = None  # tag id of the last READY state
+    self.callback = None
+    self.timer = None
+    self.requests = 0
+    self.script_thread = None
+    self.script_stop = Event()
+
+  # tag handling ---------------------------------------------------------------
+  def put_tag(self, tag_id: str) -> None:
+    '''put the tag with hex string `tag_id` on the reader, replaces any other
+    tag'''
+    with self.lock:
+      self.tag_id = tag_id
+
+  def remove_tag(self) -> None:
+    '''take the tag off the reader'''
+    with self.lock:
+      self.tag_id = None
+
+  # BrickletNFC interface ------------------------------------------------------
+  def register_callback(self, callback_id: int, function: Callable) -> None:
+    if callback_id == self.CALLBACK_READER_STATE_CHANGED:
+      self.callback = function
+
+  def set_mode(self, mode: int) -> None:
+    '''the reader starts idle, like the real bricklet after a mode change'''
+    self.emit(self.READER_STATE_IDLE, True)
+
+  def reader_request_tag_id(self) -> None:
+    '''answer with READY or ERROR after a random delay'''
+    with self.lock:
+      self.requests += 1
+      if self.timer is not None:
+        self.timer.cancel()
+      delay = max(0.0, random.gauss(self.delay, self.jitter))
+      self.timer = Timer(delay, self.answer_request)
+      self.timer.daemon = True
+      self.timer.start()
+    self.emit(self.READER_STATE_REQUEST_TAG_ID, False)
+
+  def reader_get_tag_id(self) -> GetTagID:
+    if self.answered_tag_id is None:
+      return GetTagID(self.TAG_TYPE_TYPE2, [])
+    return GetTagID(self.TAG_TYPE_TYPE2,
+                    list(bytes.fromhex(self.answered_tag_id)))
+
+  # internals ------------------------------------------------------------------
+  def answer_request(self) -> None:
+    with self.lock:
+      self.timer = None
+      self.answered_tag_id = self.tag_id
+    if self.answered_tag_id is None:
+      self.emit(self.READER_STATE_REQUEST_TAG_ID_ERROR, True)
+    else:
+      self.emit(self.READER_STATE_REQUEST_TAG_ID_READY, True)
+
+  def emit(self, state: int, idle: bool) -> None:
+    if self.callback is not None:
+      self.callback(state, idle)
+
+  # scripts --------------------------------------------------------------------
+  def run_script(
+      self,
+      steps: List[Tuple[str, float]],
+      repeat: bool = False
+    ) -> None:
+    '''put tags on and off the reader in the background
+
+    arguments:
+    + `steps` -- list of `(tag_id, seconds)`, `tag_id` None removes the tag
+    + `repeat` -- bool, start over after the last step
+    '''
+    self.stop_script()
+    self.script_stop.clear()
+
+    def run():
+      while not self.script_stop.is_set():
+        for tag_id, seconds in steps:
+          if tag_id is None:
+            self.remove_tag()
+          else:
+            self.put_tag(tag_id)
+          if self.script_stop.wait(seconds):
+            return
+        if not repeat:
+          return
+
+    self.script_thread = Thread(target=run, name='nfc simulator',
+                                daemon=True)
+    self.script_thread.start()
+
+  def stop_script(self) -> None:
+    '''end a running script, the current tag stays on the reader'''
+    self.script_stop.set()
+    if self.script_thread is not None:
+      self.script_thread.join()
+      self.script_thread = None
+
+  def stop(self) -> None:
+    '''end the script and pending requests'''
+    self.stop_script()
+    with self.lock:
+      if self.timer is not None:
+        self.timer.cancel()
+        self.timer = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+from json import load as json_load
+def load_script(filename: str) -> List[Tuple[str, float]]:
+  '''read a script for `SimulatedReader.run_script()` from a json file,
+  a list of `{"tag": "04A1B2C3", "seconds": 5}` objects, `"tag": null`
+  removes the tag'''
+  with open(filename) as script_file:
+    return [(step.get('tag'), float(step.get('seconds', 1)))
+            for step in json_load(script_file)]
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def create_reader() -> SimulatedReader:
+  '''reader for the `simulator` backend of the nfc module, runs
+  `cfg.NFC_SIMULATOR_SCRIPT` in a loop if set'''
+  reader = SimulatedReader()
+  if cfg.NFC_SIMULATOR_SCRIPT:
+    reader.run_script(load_script(cfg.NFC_SIMULATOR_SCRIPT), repeat=True)
+    log('nfc_simulator.create_reader(): running script "%s"',
+        cfg.NFC_SIMULATOR_SCRIPT, level='info')
+  return reader
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# BENCHMARK ====================================================================
+from time import perf_counter, sleep
+# ------------------------------------------------------------------------------
+def benchmark(
+    users: int = 20,
+    delay: float = None,
+    jitter: float = None
+  ) -> List[float]:
+  '''put `users` different tags on the simulated reader one after another and
+  measure how long it takes until `nfc.get_tag_id()` returns each of them,
+  like consecutive users at the counter, returns the latencies in seconds
+
+  the nfc module has to be idle (not initialized) beforehand, side effects of
+  scans (camera, screen, prefetch) are not part of the measurement
+  '''
+  import werkzeugverleih.nfc as nfc
+
+  backend, cfg.NFC_BACKEND = cfg.NFC_BACKEND, 'simulator'
+  nfc.scan_side_effects = False
+  reader = SimulatedReader(delay, jitter)
+  nfc.clear_tag_id()
+  reader.register_callback(reader.CALLBACK_READER_STATE_CHANGED,
+                           nfc.cb_reader_state_changed)
+  nfc.start_worker(reader)
+  nfc.attach_reader()
+
+  latencies = []
+  try:
+    for user in range(users):
+      tag_id = f'{0x10 + user % 0xF0:02X}A1B2C3'
+      start = perf_counter()
+      reader.put_tag(tag_id)
+      while nfc.get_tag_id() != tag_id:
+        sleep(0.001)
+      latencies.append(perf_counter() - start)
+      reader.remove_tag()
+  finally:
+    nfc.stop_worker()
+    reader.stop()
+    nfc.attached = False
+    nfc.clear_tag_id()
+    nfc.scan_side_effects = True
+    cfg.NFC_BACKEND = backend
+  return latencies
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def main() -> None:
+  '''print scan latency statistics of `benchmark()`'''
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description='benchmark the NFC scan latency with '
+                                      'a simulated reader')
+  parser.add_argument('--users', type=int, default=20)
+  parser.add_argument('--delay', type=float, default=cfg.NFC_SIMULATOR_DELAY)
+  parser.add_argument('--jitter', type=float,
+                      default=cfg.NFC_SIMULATOR_JITTER)
+  arguments = parser.parse_args()
+
+  from werkzeugverleih.log import initialize_logger
+  initialize_logger(cfg.LOG_LEVEL)
+  latencies = sorted(benchmark(arguments.users, arguments.delay,
+                               arguments.jitter))
+  count = len(latencies)
+  print(f'{count} scans, latency '
+        f'mean={sum(latencies) / count * 1000:.1f}ms '
+        f'p50={latencies[count // 2] * 1000:.1f}ms '
+        f'p95={latencies[min(count - 1, int(count * 0.95))] * 1000:.1f}ms '
+        f'max={latencies[-1] * 1000:.1f}ms')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+  main()
+# ------------------------------------------------------------------------------
+# ==============================================================================
@@ -0,0 +1,193 @@
+"""
+name:
+  Werkzeugverleih Sampling Profiler
+copyright:
+  (C) 2020
+authors:
+  Stadler, Jakob
+  Sagmeister, Matthias
+  @ Technische Hochschule Deggendorf
+description:
+  Low-overhead sampling profiler over all threads of the running
+  application, writes collapsed stacks compatible with flamegraph tools.
+dependencies:
+  -
+"""
+
+
+# intra-package imports --------------------------------------------------------
+import werkzeugverleih.config as cfg
+from werkzeugverleih.log import log
+from werkzeugverleih.template_string import log_filepath
+# ------------------------------------------------------------------------------
+
+
+# shared imports ---------------------------------------------------------------
+from typing import Dict, List
+# ------------------------------------------------------------------------------
+
+
+# SAMPLING FUNCTIONS ===========================================================
+import sys
+from threading import enumerate as enumerate_threads, get_ident
+# ------------------------------------------------------------------------------
+def frame_name(frame) -> str:
+  '''`module.function` of a stack frame'''
+  return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def sample_stacks() -> List[str]:
+  '''current stack of every thread except the calling one in collapsed
+  format, `thread;outermost.function;...;innermost.function`'''
+  names = {t.ident: t.name for t in enumerate_threads()}
+  own_ident = get_ident()
+
+  stacks = []
+  for ident, frame in sys._current_frames().items():
+    if ident == own_ident:
+      continue
+
+    functions = []
+    while frame is not None:
+      functions.append(frame_name(frame))
+      frame = frame.f_back
+    functions.append(names.get(ident, str(ident)))
+
+    # ';' separates frames, the count follows after the last space
+    stacks.append(';'.join(reversed(functions)).replace(' ', '_'))
+  return stacks
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# PROFILER THREAD ==============================================================
+from collections import Counter
+from datetime import datetime as dt
+from threading import Event, Lock, Thread
+from time import perf_counter
+thread = None
+thread_lock = Lock()
+stop_event = Event()
+last_profile = None  # filename of the latest finished profile
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def write_profile(filename: str, samples: Dict[str, int]) -> None:
+  '''write `samples` as one `stack count` line per stack'''
+  with open(filename, 'w', encoding='utf-8') as f:
+    for stack, count in sorted(samples.items()):
+      f.write(f'{stack} {count}\n')
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+from os import remove, scandir
+def remove_old_profiles(keep: int) -> int:
+  '''delete all but the newest `keep` profiles (at least one) in the log
+  directory, returns the number of deleted files'''
+  with scandir(log_filepath('')) as scan:
+    # the timestamp in the filename sorts oldest first
+    names = sorted(entry.name for entry in scan
+                   if entry.name.startswith('profile_') and
+                      entry.name.endswith('.folded') and entry.is_file())
+
+  old = names[:len(names) - max(keep, 1)]
+  for name in old:
+    remove(log_filepath(name))
+  return len(old)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def run_profiler(duration: float, interval: float, filename: str) -> None:
+  '''worker function for the profiler thread, sample all threads every
+  `interval` seconds for `duration` seconds, then write `filename`'''
+  global thread, last_profile
+
+  samples = Counter()
+  count = 0
+  start = perf_counter()
+  try:
+    while perf_counter() - start < duration and not stop_event.is_set():
+      samples.update(sample_stacks())
+      count += 1
+      stop_event.wait(interval)
+
+    write_profile(filename, samples)
+    last_profile = filename
+    log('profiler.run_profiler(): wrote %s samples of %.1f seconds to "%s"',
+        count, perf_counter() - start, filename, level='info')
+
+    if cfg.PROFILER_KEEP is not None:
+      removed = remove_old_profiles(cfg.PROFILER_KEEP)
+      if removed:
+        log('profiler.run_profiler(): removed %s old profile(s)', removed,
+            level='info')
+
+  except OSError as e:
+    log('profiler.run_profiler(): failed to write "%s" or remove old '
+        'profiles: %s', filename, e, level='error')
+
+  finally:
+    with thread_lock:
+      thread = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def start_profiler(duration: float = None, interval: float = None) -> str:
+  '''start sampling all threads in the background, returns the filename the
+  profile will be written to, or None if the profiler is already running
+
+  arguments:
+  + `duration` -- float, seconds to sample, defaults to
+  `cfg.PROFILER_DURATION`
+  + `interval` -- float, seconds between two samples, defaults to
+  `cfg.PROFILER_INTERVAL`
+
+  the file is placed next to the log files (see `cfg.LOG_FILEPATH_TEMPLATE`)
+  '''
+  global thread
+  if duration is None:
+    duration = cfg.PROFILER_DURATION
+  if interval is None:
+    interval = cfg.PROFILER_INTERVAL
+
+  with thread_lock:
+    if thread is not None:
+      log('profiler.start_profiler(): already running', level='warning')
+      return None
+
+    filename = log_filepath(
+      f'profile_{dt.now().strftime("%Y-%m-%d_%H-%M-%S")}.folded')
+
+    stop_event.clear()
+    thread = Thread(target=run_profiler, args=(duration, interval, filename),
+                    name='profiler', daemon=True)
+    thread.start()
+
+  log('profiler.start_profiler(): sampling for %s seconds every %s seconds',
+      duration, interval, level='info')
+  return filename
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def stop_profiler() -> None:
+  '''stop sampling early, the profile collected so far is still written'''
+  running = thread
+  stop_event.set()
+  if running is not None:
+    running.join(timeout=3)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def profiler_running() -> bool:
+  '''True while the profiler thread is sampling'''
+  return thread is not None
+# ------------------------------------------------------------------------------
+# ==============================================================================
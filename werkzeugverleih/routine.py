@@ -25,13 +25,14 @@ from werkzeugverleih.template_string import ( log_filename,
 
 
 # ------------------------------------------------------------------------------
-from typing import List
+from typing import Any, Callable, List
 # ------------------------------------------------------------------------------
 
 
 # HELPER FUNCTIONS =============================================================
 import datetime as dt
 from datetime import timedelta
+from time import time
 # ------------------------------------------------------------------------------
 def tomorrow() -> float:
   '''return the timestamp of tomorrow 00:01:00'''
@@ -48,6 +49,49 @@ def tomorrow() -> float:
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def quiet_hour() -> int:
+  '''return the hour of day (0-23) with the least kiosk activity
+
+  Uses `cfg.MAINTENANCE_WINDOW` if set, otherwise the 'transaction_time' and
+  'last_access' records of the last `MAINTENANCE_ACTIVITY_DAYS` days.
+  Ties are resolved in favor of the earliest hour after midnight.
+  '''
+  if cfg.MAINTENANCE_WINDOW is not None:
+    return int(cfg.MAINTENANCE_WINDOW) % 24
+
+  since = int(time() - cfg.MAINTENANCE_ACTIVITY_DAYS * 24 * 60 * 60)
+  try:
+    timestamps = db.get_activity_timestamps(since)
+  except AttributeError:  # no database connection
+    timestamps = []
+
+  activity = [0] * 24
+  for timestamp in timestamps:
+    activity[dt.datetime.fromtimestamp(timestamp).hour] += 1
+
+  return activity.index(min(activity))
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def next_maintenance_window() -> float:
+  '''return the timestamp of the next start of the maintenance window,
+  one minute after the start of `quiet_hour()`'''
+
+  if cfg.DEBUG:
+    # quickly test the routine thread functionality by executing the job once
+    # a minute instead of once a day
+    return (dt.datetime.now() + timedelta(minutes=1)).timestamp()
+
+  window = dt.datetime.combine(dt.date.today(), dt.time(quiet_hour(), 1, 0))
+  if window <= dt.datetime.now():
+    window += timedelta(days=1)
+
+  return window.timestamp()
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def get_formatted_days_elapsed(days: int = 0) -> List[str]:
   '''return list of formatted strings with dates,
@@ -76,91 +120,336 @@ def get_formatted_days_elapsed(days: int = 0) -> List[str]:
 
 # SCHEDULE FUNCTIONS ===========================================================
 from sched import scheduler as sched_scheduler
-from time import time, sleep
+from threading import Event, RLock
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# set whenever the schedule changes or the routine thread should stop, allows
+# the routine thread to sleep until the exact deadline of the next job instead
+# of waking up periodically
+wakeup = Event()
+def wait_for_wakeup(timeout: float = None) -> None:
+  '''delay function of the scheduler, sleep for `timeout` seconds or until
+  `wake_up_scheduler()` is called, whichever comes first
+
+  arguments:
+  + `timeout` -- float, seconds to sleep, None to sleep until woken up
+  '''
+  wakeup.wait(timeout)
+  wakeup.clear()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def wake_up_scheduler() -> None:
+  '''interrupt the sleeping routine thread to re-evaluate the schedule'''
+  wakeup.set()
+# ------------------------------------------------------------------------------
+
+
 # declared globally in order to make them externally modifiable
-scheduler = sched_scheduler(time, sleep)
-daily_event = None
+scheduler = sched_scheduler(time, wait_for_wakeup)
+jobs = {}  # job name -> sched.Event of the next execution
+jobs_lock = RLock()
 keep_running = True
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def cancel_daily_event() -> None:
-  global daily_event
-  try:
-    scheduler.cancel(daily_event)
-    daily_event = None
-  except (ValueError, AttributeError):
-    # No event scheduled, just reset the variable and move on
-    daily_event = None
+def every(seconds: float) -> Callable[[], float]:
+  '''return a schedule function for `schedule_job()` that repeats a job
+  every `seconds` seconds
+
+  arguments:
+  + `seconds` -- float, interval between two executions
+  '''
+  return lambda: time() + seconds
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def daily_schedule() -> None:
-  '''worker function for the daily routine schedule'''
-  global daily_event, keep_running
+def schedule_job(
+    name: str,
+    action: Callable[[], Any],
+    next_time: Callable[[], float],
+    priority: int = 1
+  ) -> None:
+  '''schedule `action` as named job, replacing any job with the same name
+
+  The job will be executed at the timestamp returned by `next_time()` and is
+  rescheduled with a fresh call to `next_time()` after every execution.
+
+  arguments:
+  + `name` -- string, unique name of the job
+  + `action` -- function without arguments, the job itself
+  + `next_time` -- function without arguments, returns the unix timestamp of
+  the next execution, see `tomorrow()` and `every()`
+  + `priority` -- integer, lower values run first if jobs are due at the same
+  time
+  '''
+  def run_job():
+    with jobs_lock:
+      jobs.pop(name, None)
+
+    action()
+
+    with jobs_lock:
+      # don't resurrect jobs that got replaced or stopped in the meantime
+      if keep_running and name not in jobs:
+        schedule_job(name, action, next_time, priority)
 
+  timestamp = next_time()
   time_formatted = (dt.datetime.utcfromtimestamp(
-                      tomorrow()
+                      timestamp
                     ).strftime(cfg.DATETIME_FORMAT))
-  log('routine.daily_schedule(): scheduling next daily_job for '
-      f'{time_formatted}', level='info')
+  log(f'routine.schedule_job(): scheduling next {name} for {time_formatted}',
+      level='info')
+
+  with jobs_lock:
+    cancel_job(name)
+    jobs[name] = scheduler.enterabs(time=timestamp, priority=priority,
+                                     action=run_job)
+
+  wake_up_scheduler()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cancel_job(name: str) -> None:
+  '''remove the job `name` from the schedule, fail silently'''
+  with jobs_lock:
+    event = jobs.pop(name, None)
+    try:
+      scheduler.cancel(event)
+    except ValueError:
+      # job is currently running or was never scheduled, just move on
+      pass
+
+  wake_up_scheduler()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def cancel_all_jobs() -> None:
+  '''remove every job from the schedule'''
+  with jobs_lock:
+    for name in list(jobs):
+      cancel_job(name)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def daily_schedule() -> None:
+  '''worker function for the routine schedule
+
+  sleeps until the deadline of the next job, new jobs and `stop_routine()`
+  wake it up immediately
+  '''
+  schedule_maintenance_jobs()
 
-  daily_event = scheduler.enterabs(time=tomorrow(), priority=1,
-                                    action=daily_job)
   while keep_running:
-    next_deadline = scheduler.run(blocking=False)
-    if next_deadline is not None:
-      sleep(min(1, next_deadline))
-    else:
-      sleep(1)
+    # returns once no more jobs are scheduled
+    scheduler.run(blocking=True)
+    if keep_running:
+      wait_for_wakeup()
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
+# ACTIVITY TRACKING ============================================================
+last_activity = 0
+# ------------------------------------------------------------------------------
+def register_activity() -> None:
+  '''mark the kiosk as in use, e.g. on web requests or NFC scans'''
+  global last_activity
+  last_activity = time()
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
+def session_active() -> bool:
+  '''True if the kiosk was used within the last `MAINTENANCE_IDLE_SECONDS`'''
+  return time() - last_activity < cfg.MAINTENANCE_IDLE_SECONDS
+# ------------------------------------------------------------------------------
+# ==============================================================================
 
 
+# MAINTENANCE JOB REGISTRY =====================================================
+from time import perf_counter
+maintenance_jobs = {}  # job name -> dict with job declaration
+maintenance_results = {}  # job name -> status of the latest run
 # ------------------------------------------------------------------------------
-def daily_job() -> None:
-  '''maintenance function that gets called once a day
+def register_maintenance_job(
+    name: str,
+    action: Callable[[], int],
+    schedule: Callable[[], float] = None,
+    time_budget: float = None,
+    depends_on: List[str] = (),
+    unit: str = '',
+    heavy: bool = False
+  ) -> None:
+  '''add a maintenance job to the registry
 
-  Tasks to do:
-  + backup database
-  + delete old database backups
-  + remove inactive users from database
-  + delete old logs
+  arguments:
+  + `name` -- string, unique name of the job
+  + `action` -- function without arguments, returns the number of
+  rows/bytes/files affected (or None)
+  + `schedule` -- function without arguments, returns the unix timestamp of
+  the next execution, defaults to `next_maintenance_window()`
+  + `time_budget` -- float, expected maximum runtime in seconds, runs
+  exceeding the budget are logged as warning
+  + `depends_on` -- list of already registered job names, which need to
+  succeed on their latest run before this job is allowed to run
+  + `unit` -- string, unit of the value returned by `action`
+  + `heavy` -- bool, job blocks the kiosk while running and gets deferred
+  while a user session is active, see `session_active()`
+
+  Jobs are scheduled with a priority derived from their dependencies, so
+  dependencies run first when several jobs are due at the same time.
   '''
-  global daily_event
+  for dependency in depends_on:
+    if dependency not in maintenance_jobs:
+      raise ValueError(f'unknown dependency "{dependency}" of job "{name}"')
+
+  depth = max((maintenance_jobs[d].get('depth') + 1 for d in depends_on),
+              default=0)
+
+  maintenance_jobs[name] = {
+    'action':       action,
+    'schedule':     (schedule if schedule
+                      else lambda: next_maintenance_window()),
+    'time_budget':  time_budget,
+    'depends_on':   list(depends_on),
+    'unit':         unit,
+    'heavy':        heavy,
+    'depth':        depth
+  }
+# ------------------------------------------------------------------------------
 
-  log('routine.daily_job(): starting daily job', level='info')
 
-  # backup database
-  backup_db()
+# ------------------------------------------------------------------------------
+def run_maintenance_job(name: str) -> str:
+  '''run the registered maintenance job `name` isolated from all other jobs,
+  record the result in the database and return its status
+  ('success', 'failed', 'skipped' or 'deferred')
+
+  A job is skipped if one of its dependencies didn't succeed on its latest
+  run. Heavy jobs, and jobs depending on deferred jobs, are deferred by
+  `MAINTENANCE_DEFER_SECONDS` while a user session is active.
+  Exceptions of the job are logged and never reach the scheduler.
+  '''
+  job = maintenance_jobs[name]
+
+  log(f'routine.run_maintenance_job(): starting job {name}', level='info')
+
+  affected = None
+  message = ''
+
+  unmet = [d for d in job.get('depends_on')
+            if maintenance_results.get(d) != 'success']
+
+  deferred = (job.get('heavy') and session_active()) or any(
+                maintenance_results.get(d) == 'deferred' for d in unmet)
+
+  t_0 = perf_counter()
+  if deferred:
+    status = 'deferred'
+    message = 'user session active'
+    log(f'routine.run_maintenance_job(): deferred job {name} by '
+        f'{cfg.MAINTENANCE_DEFER_SECONDS}s, {message}', level='info')
+    schedule_maintenance_job(name, time() + cfg.MAINTENANCE_DEFER_SECONDS)
+  elif unmet:
+    status = 'skipped'
+    message = f'dependencies not met: {", ".join(unmet)}'
+    log(f'routine.run_maintenance_job(): skipped job {name}, {message}',
+        level='warning')
+  else:
+    try:
+      affected = job.get('action')()
+      status = 'success'
+    except Exception as e:
+      status = 'failed'
+      message = f'{type(e).__name__}: {e}'
+      log(f'routine.run_maintenance_job(): job {name} failed with {message}',
+          level='error')
+  duration = perf_counter() - t_0
+
+  time_budget = job.get('time_budget')
+  if time_budget is not None and duration > time_budget:
+    message = ' '.join(filter(None, [
+                message, f'exceeded time budget of {time_budget}s'
+              ]))
+    log(f'routine.run_maintenance_job(): job {name} took {duration:.3f}s, '
+        f'exceeding its time budget of {time_budget}s', level='warning')
+
+  maintenance_results[name] = status
 
-  # delete old backups older than KEEP_BACKUPS_FOR_X_DAYS
-  remove_backups()
+  try:
+    db.update_maintenance_status(name, status, duration, affected,
+                                 job.get('unit'), message)
+  except Exception as e:
+    log('routine.run_maintenance_job(): failed to record status of job '
+        f'{name} ({type(e).__name__}: {e})', level='warning')
+
+  log(f'routine.run_maintenance_job(): finished job {name} with status '
+      f'{status} in {duration:.3f}s, affected {affected} {job.get("unit")}',
+      level='info')
 
-  # remove inactive users longer than INACTIVITY_LIMIT_DAYS
-  remove_inactive_users()
+  return status
+# ------------------------------------------------------------------------------
 
-  # delete old logs older than KEEP_LOGS_FOR_X_DAYS
-  remove_old_logs()
 
-  time_formatted = (dt.datetime.utcfromtimestamp(
-                      tomorrow()
-                    ).strftime(cfg.DATETIME_FORMAT))
-  log('routine.daily_job(): scheduling next daily_job for '
-      f'{time_formatted}', level='info')
+# ------------------------------------------------------------------------------
+def run_maintenance_jobs() -> dict:
+  '''run all registered maintenance jobs immediately in dependency order,
+  returns dict with job name -> status'''
+  order = sorted(maintenance_jobs,
+                  key=lambda name: maintenance_jobs[name].get('depth'))
+  return {name: run_maintenance_job(name) for name in order}
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def schedule_maintenance_job(name: str, first_time: float = None) -> None:
+  '''add the registered maintenance job `name` to the routine schedule
+
+  arguments:
+  + `name` -- string, name of the registered job
+  + `first_time` -- float, optional unix timestamp of the next execution,
+  following executions use the job's own schedule again
+  '''
+  job = maintenance_jobs[name]
+  schedule = job.get('schedule')
 
-  daily_event = scheduler.enterabs(time=tomorrow(), priority=1,
-                                      action=daily_job)
+  if first_time is None:
+    next_time = schedule
+  else:
+    pending = [first_time]
+
+    def next_time():
+      return pending.pop() if pending else schedule()
+
+  schedule_job(name, lambda: run_maintenance_job(name), next_time,
+                priority=job.get('depth'))
 # ------------------------------------------------------------------------------
 
 
-# helper functions for daily_job()
 # ------------------------------------------------------------------------------
-def backup_db() -> None:
-  '''backup database
+def schedule_maintenance_jobs() -> None:
+  '''add all registered maintenance jobs to the routine schedule'''
+  for name in maintenance_jobs:
+    schedule_maintenance_job(name)
+# ------------------------------------------------------------------------------
+
 
-  helper function for daily_job()
+# maintenance jobs
+# ------------------------------------------------------------------------------
+from os.path import getsize
+def backup_db() -> int:
+  '''backup database, returns the size of the backup in bytes
+
+  maintenance job
   '''
   log('routine.backup_db(): backup database', level='debug')
 
@@ -172,78 +461,173 @@ def backup_db() -> None:
 
   log(f'routine.backup_db(): saved db backup to {backup_location}',
       level='info')
+
+  return getsize(backup_location)
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
 from os import scandir, remove
-import fnmatch
-def remove_backups() -> None:
-  '''delete old backups older than `KEEP_BACKUPS_FOR_X_DAYS`
+def retention_sweep(
+    filename: Callable[[str], str],
+    filepath: Callable[[str], str],
+    keep_days: int,
+    keep_weeks: int = 0,
+    keep_months: int = 0,
+    size_limit_mb: float = None
+  ) -> int:
+  '''delete dated files that fall out of the retention policy,
+  returns the number of bytes freed
 
-  helper function for daily_job()
+  arguments:
+  + `filename` -- template string builder for filenames, e.g. `log_filename`
+  + `filepath` -- template string builder for file locations
+  + `keep_days` -- integer, keep all files of today and the prior
+  `keep_days` days
+  + `keep_weeks` -- integer, additionally keep the newest file of each of the
+  newest `keep_weeks` calendar weeks
+  + `keep_months` -- integer, additionally keep the newest file of each of the
+  newest `keep_months` calendar months
+  + `size_limit_mb` -- float, optional limit for the total size of all kept
+  files, older files beyond the limit are deleted, the newest file is always
+  kept
+
+  The date of each file is parsed once from its filename (format
+  `cfg.DATE_FORMAT`), falling back to its modification time, so a sweep is
+  linear in the number of files regardless of the retention periods. Without
+  `${date}` in the template, only the file with exactly that name matches.
+  Compressed files (`.gz` appended to the filename) are treated like the
+  original file.
   '''
-  log('routine.remove_backups(): remove old backups', level='debug')
-
-  # get list of filenames to keep
-  valid_dates = get_formatted_days_elapsed(cfg.KEEP_BACKUPS_FOR_X_DAYS)
-  valid_filenames = [backup_filename(date) for date in valid_dates]
+  parts = filename('\0').split('\0')
+  dated = len(parts) > 1
+  prefix, suffix = parts[0], parts[-1] if dated else ''
+  today = dt.date.today()
+
+  files = []  # (date, name, size), one entry per matching file
+  with scandir(filepath('')) as scan:
+    for entry in scan:
+      name = entry.name
+      base = name[:-len('.gz')] if name.endswith('.gz') else name
+      matches = (len(base) >= len(prefix) + len(suffix) and
+                  base.startswith(prefix) and base.endswith(suffix)
+                  if dated else base == prefix)
+      if not matches or not entry.is_file():
+        continue
+
+      stat = entry.stat()
+      try:
+        date = dt.datetime.strptime(base[len(prefix):len(base) - len(suffix)],
+                                    cfg.DATE_FORMAT).date()
+      except ValueError:
+        date = dt.date.fromtimestamp(stat.st_mtime)
+
+      files.append((date, name, stat.st_size))
+
+  # newest first, so the first file seen of every week/month is its newest
+  files.sort(reverse=True)
+
+  keep = set()
+  weeks = set()
+  months = set()
+  for date, name, size in files:
+    week = date.isocalendar()[:2]
+    month = (date.year, date.month)
+
+    if (today - date).days <= keep_days:
+      keep.add(name)
+    if week not in weeks and len(weeks) < keep_weeks:
+      weeks.add(week)
+      keep.add(name)
+    if month not in months and len(months) < keep_months:
+      months.add(month)
+      keep.add(name)
+
+  if size_limit_mb is not None and keep:
+    size_limit = size_limit_mb * 1024 * 1024
+    kept_files = [f for f in files if f[1] in keep]
+    # the newest file is always kept, older files only up to the size limit
+    total = kept_files[0][2]
+    for date, name, size in kept_files[1:]:
+      total += size
+      if total > size_limit:
+        keep.discard(name)
+
+  freed = 0
+  for date, name, size in files:
+    if name not in keep:
+      remove(filepath(name))
+      freed += size
+      log(f'routine.retention_sweep(): removed file {filepath(name)}',
+          level='info')
+
+  return freed
+# ------------------------------------------------------------------------------
 
-  with scandir(backup_filepath('')) as scan:
 
-    # build list of names for all elements in scan directory that are files
-    # inner list could be replaced with `filter(lambda e: e.is_file(), scan)`
-    file_list = [file.name for file in [e for e in scan if e.is_file()]]
+# ------------------------------------------------------------------------------
+def remove_backups() -> int:
+  '''delete old backups according to `KEEP_BACKUPS_FOR_X_DAYS`,
+  `KEEP_BACKUPS_FOR_X_WEEKS`, `KEEP_BACKUPS_FOR_X_MONTHS` and
+  `BACKUP_SIZE_LIMIT_MB`, returns the number of bytes freed
 
-    pattern = backup_filename('*')
-    for filename in fnmatch.filter(file_list, pattern):
+  maintenance job
+  '''
+  log('routine.remove_backups(): remove old backups', level='debug')
 
-      if filename not in valid_filenames:
-        remove(backup_filepath(filename))
-        log('routine.remove_backups(): removed db backup '
-            f'{backup_filepath(filename)}', level='info')
+  return retention_sweep(backup_filename, backup_filepath,
+                          cfg.KEEP_BACKUPS_FOR_X_DAYS,
+                          cfg.KEEP_BACKUPS_FOR_X_WEEKS,
+                          cfg.KEEP_BACKUPS_FOR_X_MONTHS,
+                          cfg.BACKUP_SIZE_LIMIT_MB)
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def remove_inactive_users() -> None:
-  '''remove users that are inactive for longer than `INACTIVITY_LIMIT_DAYS`
+def remove_inactive_users() -> int:
+  '''remove users that are inactive for longer than `INACTIVITY_LIMIT_DAYS`,
+  returns the number of removed users
 
-  helper function for daily_job()
+  maintenance job
   '''
   log('routine.remove_inactive_users(): remove inactive users', level='debug')
 
   cutoff_time = int(time() - (cfg.INACTIVITY_LIMIT_DAYS * 24 * 60 * 60))
 
-  db.delete_inactive_users(cutoff_time)
+  return db.delete_inactive_users(cutoff_time)
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-def remove_old_logs() -> None:
-  '''delete old logs older than `KEEP_LOGS_FOR_X_DAYS`
+def remove_old_logs() -> int:
+  '''delete old logs according to `KEEP_LOGS_FOR_X_DAYS`,
+  `KEEP_LOGS_FOR_X_WEEKS`, `KEEP_LOGS_FOR_X_MONTHS` and `LOG_SIZE_LIMIT_MB`,
+  returns the number of bytes freed
 
-  helper function for daily_job()
+  maintenance job
   '''
   log('routine.remove_old_logs(): remove old logs', level='debug')
 
-  # get list of filenames to keep
-  valid_dates = get_formatted_days_elapsed(cfg.KEEP_LOGS_FOR_X_DAYS)
-  valid_filenames = [log_filename(date) for date in valid_dates]
-
-  with scandir(log_filepath('')) as scan:
-
-    # build list of names for all elements in scan directory that are files
-    # inner list could be replaced with `filter(lambda e: e.is_file(), scan)`
-    file_list = [file.name for file in [e for e in scan if e.is_file()]]
+  return retention_sweep(log_filename, log_filepath,
+                          cfg.KEEP_LOGS_FOR_X_DAYS,
+                          cfg.KEEP_LOGS_FOR_X_WEEKS,
+                          cfg.KEEP_LOGS_FOR_X_MONTHS,
+                          cfg.LOG_SIZE_LIMIT_MB)
+# ------------------------------------------------------------------------------
 
-    pattern = log_filename('*')
-    for filename in fnmatch.filter(file_list, pattern):
 
-      if filename not in valid_filenames:
-        remove(log_filepath(filename))
-        log('routine.remove_old_logs(): removed log file '
-            f'{log_filepath(filename)}', level='info')
+# ------------------------------------------------------------------------------
+# default maintenance jobs, run once a day during the maintenance window
+register_maintenance_job('backup_db', backup_db, time_budget=60,
+                          unit='bytes', heavy=True)
+# only rotate and purge after a successful backup
+register_maintenance_job('remove_backups', remove_backups, time_budget=10,
+                          depends_on=['backup_db'], unit='bytes')
+register_maintenance_job('remove_inactive_users', remove_inactive_users,
+                          time_budget=10, depends_on=['backup_db'],
+                          unit='rows')
+register_maintenance_job('remove_old_logs', remove_old_logs, time_budget=10,
+                          unit='bytes')
 # ------------------------------------------------------------------------------
 # ==============================================================================
 
@@ -254,36 +638,33 @@ routine_thread = None
 # ------------------------------------------------------------------------------
 def start_routine() -> None:
   '''start the routine thread'''
-  global routine_thread, keep_running, daily_event
+  global routine_thread, keep_running
 
   if routine_thread:
     log('routine.start_routine(): restarting thread: '
         'stopping old thread beforehand', level='debug')
-
-    keep_running = False
-    cancel_daily_event()
-
-    routine_thread.join(timeout=3)
+    stop_routine()
     routine_thread = None
 
   log('routine.start_routine(): start thread', level='debug')
 
   keep_running = True
-  routine_thread = Thread(target=daily_schedule)
+  routine_thread = Thread(target=daily_schedule, name='routine')
   routine_thread.start()
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
 def stop_routine() -> None:
-  '''start the routine thread'''
-  global routine_thread, keep_running, daily_event
+  '''stop the routine thread'''
+  global keep_running
 
   log('routine.stop_routine(): stop thread', level='debug')
 
   keep_running = False
-  cancel_daily_event()
+  cancel_all_jobs()
 
+  # the thread only waits for the currently running job, if any
   routine_thread.join(timeout=3)
 # ------------------------------------------------------------------------------
 # ==============================================================================
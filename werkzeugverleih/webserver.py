@@ -20,8 +20,13 @@ import sys
 import werkzeugverleih.config as cfg
 import werkzeugverleih.database as db
 import werkzeugverleih.camera as cam
+import werkzeugverleih.display as display
 import werkzeugverleih.nfc as nfc
-from werkzeugverleih.log import log
+import werkzeugverleih.routine as routine
+import werkzeugverleih.metrics as metrics
+import werkzeugverleih.profiler as profiler
+import werkzeugverleih.lifecycle as lifecycle
+from werkzeugverleih.log import log, is_enabled, set_request_id
 from werkzeugverleih.template_string import (
         current_user as template_current_user )
 # ------------------------------------------------------------------------------
@@ -31,7 +36,7 @@ from werkzeugverleih.template_string import (
 from flask import (
                     Flask,
                     redirect,
-                    render_template,
+                    render_template as flask_render_template,
                     request,
                     Response,
                     session,
@@ -40,7 +45,7 @@ from flask import (
 # ------------------------------------------------------------------------------
 
 
-from typing import Any
+from typing import Any, Callable, Tuple
 
 # global Flask app
 app = Flask('werkzeugverleih')
@@ -49,20 +54,133 @@ app = Flask('werkzeugverleih')
 UI_LANGUAGE = cfg.UI_DEFAULT_LANGUAGE
 
 # Initialization ---------------------------------------------------------------
+def create_server(kind: str) -> Tuple[Callable[[], Any], Callable[[], Any]]:
+  '''create a WSGI server for `app`, returns the functions
+  `(serve, stop)` to run it until stopped and to stop it from another thread,
+  `serve` doesn't need to run in the main thread
+
+  arguments:
+  + `kind` -- string, one of `waitress`, `cheroot` (threaded production
+  servers), `uvicorn` (asynchronous server, see werkzeugverleih.asgi) or
+  `flask` (Werkzeug development server), falls back to `flask` if the
+  selected server isn't installed
+
+  host, port, number of worker threads, connection limit and keep-alive
+  timeout are set by the `cfg.WEBSERVER_*` settings
+  '''
+  host = cfg.WEBSERVER_HOST
+  port = cfg.WEBSERVER_PORT
+
+  if kind == 'waitress':
+    try:
+      import waitress
+    except ImportError:
+      log('webserver.create_server(): waitress not installed, falling back '
+          'to flask', level='warning')
+    else:
+      server = waitress.create_server(
+                  app, host=host, port=port,
+                  threads=cfg.WEBSERVER_THREADS,
+                  connection_limit=cfg.WEBSERVER_CONNECTION_LIMIT,
+                  channel_timeout=cfg.WEBSERVER_KEEPALIVE_TIMEOUT)
+      log('webserver.create_server(): waitress on %s:%s with %s threads',
+          host, port, cfg.WEBSERVER_THREADS, level='info')
+
+      def stop():
+        # close() only stops accepting, run() keeps serving open keep-alive
+        # connections, closing all of them ends its loop
+        from waitress.wasyncore import close_all
+        server.close()
+        close_all(server._map)
+        server.task_dispatcher.shutdown()
+
+      return server.run, stop
+
+  elif kind == 'cheroot':
+    try:
+      from cheroot.wsgi import Server as CherootServer
+    except ImportError:
+      log('webserver.create_server(): cheroot not installed, falling back '
+          'to flask', level='warning')
+    else:
+      server = CherootServer(
+                  (host, port), app,
+                  numthreads=cfg.WEBSERVER_THREADS,
+                  accepted_queue_size=cfg.WEBSERVER_CONNECTION_LIMIT,
+                  timeout=cfg.WEBSERVER_KEEPALIVE_TIMEOUT)
+      log('webserver.create_server(): cheroot on %s:%s with %s threads',
+          host, port, cfg.WEBSERVER_THREADS, level='info')
+      return server.start, server.stop
+
+  elif kind == 'uvicorn':
+    try:
+      import uvicorn
+      import asgiref  # noqa: F401 - required for all pages but the stream
+    except ImportError:
+      log('webserver.create_server(): uvicorn or asgiref not installed, '
+          'falling back to flask', level='warning')
+    else:
+      from werkzeugverleih.asgi import application
+      server = uvicorn.Server(uvicorn.Config(
+                  application, host=host, port=port,
+                  limit_concurrency=cfg.WEBSERVER_CONNECTION_LIMIT,
+                  timeout_keep_alive=cfg.WEBSERVER_KEEPALIVE_TIMEOUT))
+      log('webserver.create_server(): uvicorn on %s:%s', host, port,
+          level='info')
+      # serve() runs in a helper thread, main() handles the signals
+      server.install_signal_handlers = lambda: None
+
+      def stop():
+        server.should_exit = True
+
+      return server.run, stop
+
+  elif kind != 'flask':
+    log('webserver.create_server(): unknown server "%s", falling back to '
+        'flask', kind, level='warning')
+
+  from werkzeug.serving import make_server
+  server = make_server(host, port, app, threaded=True)
+  log('webserver.create_server(): flask development server on %s:%s',
+      host, server.server_port, level='info')
+  return server.serve_forever, server.shutdown
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
 from os.path import abspath
+server_stop = None  # stop function of the running server
 def start_webserver() -> None:
-  '''start the Flask webserver'''
+  '''start the webserver selected by `cfg.WEBSERVER`, returns after
+  `stop_webserver()` was called'''
+  global server_stop
   flask_config_file = abspath(cfg.FLASK_CONFIG_LOCATION)
 
-  log('webserver.start_webserver() Loading Flask config from '
-      f'"{flask_config_file}"', level='info')
+  log('webserver.start_webserver() Loading Flask config from "%s"',
+      flask_config_file, level='info')
 
   app.config.from_pyfile(flask_config_file)
+  app.debug = cfg.DEBUG
 
   global UI_LANGUAGE
   UI_LANGUAGE = cfg.UI_DEFAULT_LANGUAGE
 
-  app.run(debug=cfg.DEBUG, use_reloader=False)
+  serve, server_stop = create_server(cfg.WEBSERVER)
+  try:
+    serve()
+  finally:
+    server_stop = None
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def stop_webserver() -> None:
+  '''stop the running webserver, call from a different thread than
+  `start_webserver()`'''
+  stop = server_stop
+  if stop is not None:
+    log('webserver.stop_webserver(): stopping webserver', level='info')
+    stop()
 # ------------------------------------------------------------------------------
 
 
@@ -72,11 +190,12 @@ def get_nfc_id() -> str:
   '''get nfc_id from cache, alternatively from hardware, cache result'''
   nfc_id = session.get('nfc_id')
   if nfc_id is None:
-    nfc_id = nfc.get_tag_id()
+    with metrics.timed('nfc', 'get_tag_id'):
+      nfc_id = nfc.get_tag_id()
     session['nfc_id'] = nfc_id
   else:
-    log(f'webserver.get_nfc_id(): get nfc_id {nfc_id} from session cache',
-        level='debug')
+    log('webserver.get_nfc_id(): get nfc_id %s from session cache',
+        nfc_id, level='debug')
   return nfc_id
 # ------------------------------------------------------------------------------
 
@@ -102,41 +221,122 @@ def get_nfc_info() -> str:
 
   user = db.get_user(nfc_id)
   if user is None:
-    log(f'webserver.get_nfc_info(): nfc_id {nfc_id} not in database',
-        level='debug')
+    log('webserver.get_nfc_info(): nfc_id %s not in database',
+        nfc_id, level='debug')
     return translate_to_UI_lang({
         'de': "Unregistrierter NFC tag",
         'en': "Unregistered NFC tag"
       })
 
   # return string based on template cfg.CURRENT_USER_TEMPLATE
-  log(f'webserver.get_nfc_info(): returned user with nfc_id {nfc_id}',
-        level='debug')
+  log('webserver.get_nfc_info(): returned user with nfc_id %s',
+      nfc_id, level='debug')
   return current_user(user)
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+from time import perf_counter
+# key of the request start in the WSGI environ, unlike `g` it's still
+# available in teardown_request hooks after the app context is gone
+REQUEST_START = 'werkzeugverleih.request_start'
+def request_duration_ms() -> float:
+  '''milliseconds since the start of the current request'''
+  return round((perf_counter() - request.environ[REQUEST_START]) * 1000, 1)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def render_template(template_name: str, **context: Any) -> str:
+  '''Flask's render_template(), records the duration as metric `render`'''
+  with metrics.timed('render', template_name):
+    return flask_render_template(template_name, **context)
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def get_jpeg() -> bytes:
   '''proxy call for frame_generator(), allows function override for testing'''
-  return cam.get_jpeg()
+  with metrics.timed('camera', 'get_jpeg'):
+    return cam.get_jpeg()
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
 import time
 def frame_generator() -> bytes:
-  '''get images from camera and prepare for motion jpeg video stream'''
-  while True:
+  '''get images from camera and prepare for motion jpeg video stream,
+  ends when the application shuts down'''
+  while not lifecycle.shutting_down.is_set():
+    if display.screen_blanked():
+      # nobody is looking, lets the camera and the browser idle
+      time.sleep(1)
+      continue
     frame = get_jpeg()
     if frame is None:
       frame = b''
     yield (b'--frame\r\n'
             b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    metrics.increment('camera_frames_sent')
     time.sleep(1 / cfg.STREAM_FRAMERATE)
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+from os.path import getsize
+def collect_gauges() -> list:
+  '''current values for the /metrics endpoint as list of
+  `(name, help, labels, value)`'''
+  gauges = [
+    ('werkzeugverleih_open_transactions', 'Transactions in the database',
+     {}, db.count_transactions()),
+    ('werkzeugverleih_camera_active', '1 if the camera is capturing frames',
+     {}, 1 if cam.thread is not None else 0),
+    ('werkzeugverleih_screen_on', '0 while the screen is blanked due to '
+     'inactivity', {}, 0 if display.screen_blanked() else 1),
+  ]
+
+  health = nfc.reader_health()
+  if health['backend'] != 'file':
+    gauges.append(('werkzeugverleih_nfc_reader_up',
+                   '1 if the NFC reader is connected and can read tags',
+                   {'backend': health['backend']},
+                   1 if health['healthy'] else 0))
+
+  try:
+    gauges.append(('werkzeugverleih_db_file_size_bytes',
+                   'Size of the database file', {},
+                   getsize(cfg.DATABASE_FILE_LOCATION)))
+  except OSError:
+    # in-memory database or file not created yet
+    pass
+
+  for job in db.get_maintenance_status():
+    gauges.append(('werkzeugverleih_maintenance_duration_seconds',
+                   'Duration of the latest run of a maintenance job, '
+                   'e.g. backup_db', {'job': job.get('name')},
+                   job.get('duration') or 0))
+    gauges.append(('werkzeugverleih_maintenance_last_success_seconds',
+                   'Timestamp of the latest successful run of a '
+                   'maintenance job', {'job': job.get('name')},
+                   job.get('last_success') or 0))
+
+  for entry in db.get_lock_statistics():
+    labels = {'function': entry['function']}
+    gauges.append(('werkzeugverleih_db_lock_hold_max_seconds',
+                   'Longest hold of the database lock', labels,
+                   entry['hold_max']))
+    gauges.append(('werkzeugverleih_db_lock_slow_holds',
+                   'Holds of the database lock longer than '
+                   'DB_LOCK_WARN_SECONDS', labels, entry['slow_holds']))
+    gauges.append(('werkzeugverleih_db_lock_wait_caused_seconds',
+                   'Time other functions waited for the database lock held '
+                   'by this function', labels, entry['wait_caused']))
+
+  return gauges
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def translate_to_UI_lang(multilang_dict: dict) -> str:
   '''choose the correct transaltion according to UI_LANGUAGE, default to "en"'''
@@ -159,7 +359,8 @@ def base64ify(image_blob: bytes) -> str:
   + `image_blob` -- binary data, e.g. b'DATA'
   '''
   try:
-    return b64encode(image_blob).decode("utf-8")
+    with metrics.timed('encode', 'base64'):
+      return b64encode(image_blob).decode("utf-8")
   except TypeError:
     log('webserver.base64ify(): invalid type for image_blob', level='warning')
     return ''
@@ -216,6 +417,48 @@ def translate_ui_context_filter(
 # ==============================================================================
 
 
+# REQUEST HOOKS ================================================================
+# ------------------------------------------------------------------------------
+@app.before_request
+def start_request() -> None:
+  '''tag all log messages of this request with a common id, start timing,
+  count it as in flight for the shutdown'''
+  request.environ[REQUEST_START] = perf_counter()
+  set_request_id()
+  lifecycle.request_started()
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@app.teardown_request
+def finish_request(exception: BaseException = None) -> None:
+  '''record the duration of the request as metric `request`, labeled with
+  the matched route'''
+  start = request.environ.get(REQUEST_START)
+  if start is None:
+    return
+
+  lifecycle.request_finished()
+
+  # streams outlive their request, static files aren't interesting
+  if request.endpoint not in (None, 'static', 'video_feed'):
+    metrics.observe('request', request.url_rule.rule, perf_counter() - start)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@app.before_request
+def register_activity() -> None:
+  '''mark the kiosk as in use for the routine maintenance scheduler'''
+  # the index page is where idle kiosks end up, it doesn't count as activity,
+  # neither do monitoring scrapes and passive viewers of the video stream
+  if request.endpoint not in ('static', 'site_index', 'redirect_to_index',
+                              'prometheus_metrics', 'video_feed'):
+    routine.register_activity()
+# ------------------------------------------------------------------------------
+# ==============================================================================
+
+
 # FLASK ROUTES =================================================================
 # ------------------------------------------------------------------------------
 @app.route('/')
@@ -335,8 +578,8 @@ def error_page() -> Response:
       'en': '<br>You will be redirected to the homepage.'
     })
 
-  log(f'webserver/error: display error page with type {error_type}',
-      level='error')
+  log('webserver/error: display error page with type %s',
+      error_type, level='error')
 
   return render_template('error.html', nfc_info=None,
                           error_message=error_message)
@@ -390,15 +633,17 @@ def register_user() -> Response:
 
     if insert_successful:
 
-      log('webserver/register: successfully registered user '
-            'with nfc_id {nfc_id}', level='info')
+      log('webserver/register: successfully registered user with nfc_id %s',
+          nfc_id, level='info', event='register', nfc_id=nfc_id,
+          duration_ms=request_duration_ms())
 
       return redirect(url_for('page_checkout'))
 
     else:
 
-      log(f'webserver/register: failed to register user with nfc_id {nfc_id}',
-          level='warning')
+      log('webserver/register: failed to register user with nfc_id %s',
+          nfc_id, level='warning', event='register_failed', nfc_id=nfc_id,
+          duration_ms=request_duration_ms())
 
       # render same page with error message
       error_message = translate_to_UI_lang({
@@ -410,8 +655,8 @@ def register_user() -> Response:
 
     # endof: if request.method == 'POST':
 
-  log(f'webserver/register: display registration page for nfc_id {nfc_id}',
-      level='info')
+  log('webserver/register: display registration page for nfc_id %s',
+      nfc_id, level='info')
 
   return render_template("register.html", nfc_info=get_nfc_info(),
                           error_message=None,
@@ -460,13 +705,17 @@ def finish_checkout() -> Response:
     result = db.delete_transaction(transaction_id, removal_key)
 
     if result:
-      log(f'webserver/finish-checkout: revert transaction {transaction_id}',
-            level='info')
+      log('webserver/finish-checkout: revert transaction %s',
+          transaction_id, level='info', event='checkout_reverted',
+          transaction_ids=[transaction_id],
+          duration_ms=request_duration_ms())
       return redirect(url_for('page_checkout'))
 
     else:
-      log('webserver/finish-checkout: failed to revert transaction '
-          f'{transaction_id}', level='warn')
+      log('webserver/finish-checkout: failed to revert transaction %s',
+          transaction_id, level='warning', event='checkout_revert_failed',
+          transaction_ids=[transaction_id],
+          duration_ms=request_duration_ms())
       return redirect(url_for('error_page', error_type='fail_revert'))
 
     # endof: if request.method == 'POST'
@@ -499,9 +748,9 @@ def finish_checkout() -> Response:
     # ERROR! database integrity in danger
     return redirect(url_for('error_page', error_type='db_integrity'))
 
-  log(f'webserver/finish-checkout: added transaction {transaction_id} by '
-      f'nfc_id {nfc_id}',
-        level='info')
+  log('webserver/finish-checkout: added transaction %s by nfc_id %s',
+      transaction_id, nfc_id, level='info', event='checkout', nfc_id=nfc_id,
+      transaction_ids=[transaction_id], duration_ms=request_duration_ms())
 
   return render_template("finish_checkout.html", nfc_info=get_nfc_info(),
                           transaction=transaction, user=user)
@@ -554,9 +803,11 @@ def page_checkin() -> Response:
               ' successfully removed from the database.'
       })
 
-      id_list = [t.get('transaction_id') for t in transaction_list]
-      log(f'webserver/checkin: for nfc_id {nfc_id} '
-          f'removed transactions {id_list}', level='info')
+      if is_enabled('info'):
+        id_list = [t.get('transaction_id') for t in transaction_list]
+        log('webserver/checkin: for nfc_id %s removed transactions %s',
+            nfc_id, id_list, level='info', event='checkin', nfc_id=nfc_id,
+            transaction_ids=id_list, duration_ms=request_duration_ms())
 
       # display results page with all removed images, allowing the user
       # to take another look at all the items he has to return to their
@@ -567,11 +818,14 @@ def page_checkin() -> Response:
 
     # else -> Fallthrough: Render the whole page again
 
-  transaction_list = db.get_transactions_from_nfc_id(nfc_id)
+  # usually prefetched right after the NFC scan
+  transaction_list = db.get_prefetched_transactions(nfc_id)
 
-  id_list = [t.get('transaction_id') for t in transaction_list]
-  log(f'webserver/checkin: for nfc_id {nfc_id} display transactions {id_list}',
-      level='info')
+  if is_enabled('info'):
+    id_list = [t.get('transaction_id') for t in transaction_list]
+    log('webserver/checkin: for nfc_id %s display transactions %s',
+        nfc_id, id_list, level='info', event='checkin_list', nfc_id=nfc_id,
+        transaction_ids=id_list, duration_ms=request_duration_ms())
 
   return render_template('checkin.html', nfc_info=get_nfc_info(),
                           transaction_list=transaction_list)
@@ -595,13 +849,79 @@ def admin_overview() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
-  log(f'webserver/admin: access admin menu by nfc_id {nfc_id}', level='info')
+  log('webserver/admin: access admin menu by nfc_id %s', nfc_id, level='info')
+
+  # results of the latest routine maintenance jobs
+  maintenance_list = db.get_maintenance_status()
+
+  return render_template('admin_overview.html', nfc_info=get_nfc_info(),
+                          maintenance_list=maintenance_list)
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@app.route('/admin/metrics', methods=('GET', 'POST'))
+def admin_metrics() -> Response:
+  '''display content based on request method:
+
+  + GET: display timing histograms of requests, database access, rendering
+  and image encoding and the state of the sampling profiler
+  + POST: start the sampling profiler for `profile_seconds` seconds, then
+  display the same page
+  '''
+  nfc_id = get_nfc_id()
+
+  # no nfc tag -> redirect to explanation
+  if nfc_id is None:
+    return redirect(url_for('no_nfc_tag'))
+
+  user = db.get_user(nfc_id)
+  # nfc not in database -> registration required
+  if user is None:
+    return redirect(url_for('register_user'))
 
-  return render_template('admin_overview.html', nfc_info=get_nfc_info())
+  if not user.get('admin'):
+    # ERROR! user is not admin
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
+    return redirect(url_for('error_page', error_type='no_admin'))
+
+  if request.method == 'POST':
+    try:
+      seconds = float(request.form.get('profile_seconds'))
+    except (TypeError, ValueError):
+      seconds = cfg.PROFILER_DURATION
+
+    # keep the profiler from running unattended for too long
+    seconds = min(max(seconds, 1), 600)
+
+    log('webserver/admin/metrics: nfc_id %s started the profiler for %s '
+        'seconds', nfc_id, seconds, level='info', event='profiler_start',
+        nfc_id=nfc_id)
+    profiler.start_profiler(duration=seconds)
+
+  metrics_list = metrics.summary()
+
+  # functions holding the database lock the longest
+  lock_statistics = None
+  if cfg.DB_LOCK_DIAGNOSTICS:
+    lock_statistics = db.get_lock_statistics(limit=10)
+
+  log('webserver/admin/metrics: display %s histograms',
+      len(metrics_list), level='info')
+
+  return render_template('admin_metrics.html', nfc_info=get_nfc_info(),
+                          metrics_list=metrics_list,
+                          lock_statistics=lock_statistics,
+                          profiler_running=profiler.profiler_running(),
+                          last_profile=profiler.last_profile,
+                          profile_seconds=cfg.PROFILER_DURATION)
 # ------------------------------------------------------------------------------
 
 
@@ -622,8 +942,9 @@ def admin_manage_users() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   userlist = db.get_users()
@@ -633,8 +954,8 @@ def admin_manage_users() -> Response:
     user['transactions'] = len(
       db.get_transactions_from_nfc_id(user.get('nfc_id')))
 
-  log(f'webserver/admin/users: display userlist with {len(userlist)} entries',
-      level='info')
+  log('webserver/admin/users: display userlist with %s entries',
+      len(userlist), level='info')
 
   return render_template('manage_users.html', nfc_info=get_nfc_info(),
                           userlist=userlist)
@@ -658,8 +979,9 @@ def admin_manage_user() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   # error_type from /error?type=<parameter>
@@ -697,8 +1019,8 @@ def admin_manage_user() -> Response:
   if edit_user is None:
     return redirect(url_for('error_page', error_type='unknown_nfc_id'))
 
-  log(f'webserver/admin/user: display user page of nfc_id {user_nfc_id} with '
-      f'error_type {error_type}', level='info')
+  log('webserver/admin/user: display user page of nfc_id %s with error_type %s',
+      user_nfc_id, error_type, level='info')
 
   return render_template('manage_user.html', nfc_info=get_nfc_info(),
                           user=edit_user, display_message=display_message)
@@ -723,8 +1045,9 @@ def change_user() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   user_nfc_id = request.form.get('nfc_id')
@@ -741,15 +1064,15 @@ def change_user() -> Response:
 
   if user_nfc_id == nfc_id and admin != user.get('admin'):
     # admins can't take their own admin privileges!
-    log(f'webserver/admin/change_user: {nfc_id} got denied taking their own '
-          'admin privileges', level='info')
+    log('webserver/admin/change_user: %s got denied taking their own admin '
+        'privileges', nfc_id, level='info')
     return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                               error_type='demotion_error'))
 
   db.update_user(user_nfc_id, given_name, surname, room, admin)
 
-  log(f'webserver/admin/change_user: {nfc_id} updated user data for '
-      f'{user_nfc_id}', level='info')
+  log('webserver/admin/change_user: %s updated user data for %s',
+      nfc_id, user_nfc_id, level='info')
 
   return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                             error_type='data_changed'))
@@ -774,8 +1097,9 @@ def delete_user() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   user_nfc_id = request.form.get('nfc_id')
@@ -791,15 +1115,15 @@ def delete_user() -> Response:
 
   if user_nfc_id == nfc_id:
     # admins can't delete their own account
-    log(f'webserver/admin/delete_user: admin {nfc_id} got denied deleting '
-          'their own account', level='info')
+    log('webserver/admin/delete_user: admin %s got denied deleting their own '
+        'account', nfc_id, level='info')
     return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                               error_type='self_deletion_error'))
 
   if len(db.get_transactions_from_nfc_id(user_nfc_id)) > 0:
     # can't delete accounts with remaining transactions
-    log(f"webserver/admin/delete_user: nfc_id {user_nfc_id} has "
-        "transactions remaining and can't be deleted", level='info')
+    log("webserver/admin/delete_user: nfc_id %s has transactions remaining "
+        "and can't be deleted", user_nfc_id, level='info')
     return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                               error_type='transactions_remain_error'))
 
@@ -810,8 +1134,8 @@ def delete_user() -> Response:
     'room':       room
   }
 
-  log(f'webserver/admin/delete_user: nfc_id {nfc_id} starting deletion '
-      f'process for user with nfc_id {nfc_id}', level='info')
+  log('webserver/admin/delete_user: nfc_id %s starting deletion process for '
+      'user with nfc_id %s', nfc_id, nfc_id, level='info')
 
   return render_template('delete_user.html', nfc_info=get_nfc_info(),
                           user=edit_user)
@@ -836,30 +1160,31 @@ def confirm_delete_user() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   user_nfc_id = request.form.get('nfc_id')
 
   if user_nfc_id == nfc_id:
     # admins can't delete their own account
-    log(f'webserver/admin/confirm_delete_user: admin {nfc_id} got denied '
-          'deleting their own account', level='info')
+    log('webserver/admin/confirm_delete_user: admin %s got denied deleting '
+        'their own account', nfc_id, level='info')
     return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                               error_type='self_deletion_error'))
 
   if len(db.get_transactions_from_nfc_id(user_nfc_id)) > 0:
     # can't delete accounts with remaining transactions
-    log(f"webserver/admin/confirm_delete_user: nfc_id {user_nfc_id} has "
-        "transactions remaining and can't be deleted", level='info')
+    log("webserver/admin/confirm_delete_user: nfc_id %s has transactions "
+        "remaining and can't be deleted", user_nfc_id, level='info')
     return redirect(url_for('admin_manage_user', nfc_id=user_nfc_id,
                               error_type='transactions_remain_error'))
 
   db.delete_user(user_nfc_id)
 
-  log(f'webserver/admin/confirm_delete_user: nfc_id {nfc_id} confirmed '
-      f'deletion of user with nfc_id {nfc_id}', level='info')
+  log('webserver/admin/confirm_delete_user: nfc_id %s confirmed deletion of '
+      'user with nfc_id %s', nfc_id, nfc_id, level='info')
 
   return redirect(url_for('admin_manage_users'))
 # ------------------------------------------------------------------------------
@@ -886,8 +1211,9 @@ def admin_manage_transactions() -> Response:
 
   if not user.get('admin'):
     # ERROR! user is not admin
-    log(f'webserver/admin/*: nfc_id {nfc_id} tried to access admin page '
-          'without admin privileges', level='warning')
+    log('webserver/admin/*: nfc_id %s tried to access admin page without '
+        'admin privileges', nfc_id, level='warning', event='admin_denied',
+        nfc_id=nfc_id)
     return redirect(url_for('error_page', error_type='no_admin'))
 
   # limit_to_nfc_id from /admin/transactions?nfc_id=<parameter>
@@ -911,14 +1237,17 @@ def admin_manage_transactions() -> Response:
       fcount = str(count) + ' ' + (
         'Eintrag wurde' if count == 1 else 'Einträge wurden')
 
-      id_list = [t.get('transaction_id') for t in transaction_list]
-      if limit_to_nfc_id:
-        log(f'admin/transactions: for nfc_id {limit_to_nfc_id} removed '
-            f'transactions {id_list}',
-              level='info')
-      else:
-        log(f'admin/transactions: removed transactions {id_list}',
-              level='info')
+      if is_enabled('info'):
+        id_list = [t.get('transaction_id') for t in transaction_list]
+        if limit_to_nfc_id:
+          log('admin/transactions: for nfc_id %s removed transactions %s',
+              limit_to_nfc_id, id_list, level='info', event='admin_checkin',
+              nfc_id=limit_to_nfc_id, transaction_ids=id_list,
+              duration_ms=request_duration_ms())
+        else:
+          log('admin/transactions: removed transactions %s',
+              id_list, level='info', event='admin_checkin',
+              transaction_ids=id_list, duration_ms=request_duration_ms())
 
       # display results page with all removed images, allowing the user
       # to take another look at all the items he has to return to their
@@ -941,12 +1270,23 @@ def admin_manage_transactions() -> Response:
                 for u in db.get_users()
                 if u.get('nfc_id') in nfc_id_list }
 
-  id_list = [t.get('transaction_id') for t in transaction_list]
-  log(f'admin/transactions: for nfc_id {limit_to_nfc_id} serve list {id_list}',
-        level='info')
+  if is_enabled('info'):
+    id_list = [t.get('transaction_id') for t in transaction_list]
+    log('admin/transactions: for nfc_id %s serve list %s',
+        limit_to_nfc_id, id_list, level='info')
 
   return render_template('manage_transactions.html', nfc_info=get_nfc_info(),
                           transaction_list=transaction_list,
                           user_dict=user_dict)
 # ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+@app.route('/metrics')
+def prometheus_metrics() -> Response:
+  '''request, database, camera and NFC metrics in the Prometheus text format,
+  no NFC tag required, meant for monitoring tools'''
+  return Response(metrics.prometheus_text(collect_gauges()),
+                  mimetype='text/plain; version=0.0.4')
+# ------------------------------------------------------------------------------
 # ==============================================================================